@@ -0,0 +1,112 @@
+import cv2
+
+# (JPEG quality, scale) steps from best to most degraded. A quality of None
+# forwards the producer's own encode untouched.
+DEFAULT_LADDER = [
+    (None, 1.0),
+    (80, 1.0),
+    (65, 1.0),
+    (50, 0.75),
+    (40, 0.5),
+    (30, 0.5),
+]
+
+
+def encode_level(image, jpeg, quality, scale):
+    """Return the JPEG for one ladder step, reusing `jpeg` for the top step."""
+    if quality is None and scale == 1.0:
+        return jpeg
+    if scale != 1.0:
+        height, width = image.shape[:2]
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality or 95])
+    return buffer.tobytes()
+
+
+class AdaptiveController:
+    """Per-client quality and frame-rate control driven by how fast sends drain.
+
+    After every send the caller reports how long the write blocked and how
+    many bytes are still queued. When sends take up too much of the frame
+    budget the client moves down the quality ladder, and once at the bottom
+    it lowers its frame rate. Recovery happens in the opposite order, and
+    only after a run of healthy sends so the level does not oscillate.
+    """
+
+    def __init__(self, ladder=DEFAULT_LADDER, min_level=0, max_level=None,
+                 max_fps=30, min_fps=5, max_backlog=256 * 1024,
+                 degrade_above=0.6, upgrade_below=0.25, upgrade_after=30, smoothing=0.3):
+        self.ladder = ladder
+        self.min_level = min_level
+        self.max_level = len(ladder) - 1 if max_level is None else max_level
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.max_backlog = max_backlog
+        self.degrade_above = degrade_above
+        self.upgrade_below = upgrade_below
+        self.upgrade_after = upgrade_after
+        self.smoothing = smoothing
+
+        self.level = min_level
+        self.fps = max_fps
+        self.busy = 0.0
+        self.throughput = 0.0
+        self.dropped = 0
+        self._good_samples = 0
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.fps
+
+    @property
+    def params(self):
+        return self.ladder[self.level]
+
+    def record_drops(self, count):
+        self.dropped += max(0, count)
+
+    def record_send(self, send_time, nbytes, backlog=0):
+        # Fraction of the frame budget this client spends blocked on writes
+        sample = send_time / self.frame_interval
+        self.busy += self.smoothing * (sample - self.busy)
+        if send_time > 0:
+            rate = nbytes / send_time
+            self.throughput += self.smoothing * (rate - self.throughput)
+
+        if self.busy > self.degrade_above or backlog > self.max_backlog:
+            self._good_samples = 0
+            self._degrade()
+            # Judge the new level on its own sends
+            self.busy = self.upgrade_below
+        elif self.busy < self.upgrade_below and backlog == 0:
+            self._good_samples += 1
+            if self._good_samples >= self.upgrade_after:
+                self._good_samples = 0
+                self._upgrade()
+        else:
+            self._good_samples = 0
+
+    def _degrade(self):
+        if self.level < self.max_level:
+            self.level += 1
+        else:
+            self.fps = max(self.min_fps, self.fps * 0.75)
+
+    def _upgrade(self):
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps * 1.25)
+        elif self.level > self.min_level:
+            self.level -= 1
+
+    def stats(self):
+        quality, scale = self.params
+        return {
+            'level': self.level,
+            'quality': quality,
+            'scale': scale,
+            'fps': round(self.fps, 1),
+            'busy': round(self.busy, 2),
+            'throughput_kbps': round(self.throughput * 8 / 1000, 1),
+            'dropped': self.dropped,
+        }
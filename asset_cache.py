@@ -0,0 +1,240 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    # gzip is always available; brotli is used when installed
+    brotli = None
+
+# In-memory cache for static assets such as the viewer's glTF models. Each
+# file is read and compressed once, kept with its gzip and brotli forms, and
+# served with a strong ETag so a reload costs a 304 instead of the model.
+# Files are re-read when their size or mtime changes. Sidecars written by
+# tools/compress_models.py (model.gltf.gz, model.gltf.br) are used instead
+# of compressing at runtime when they are at least as new as the file.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Files smaller than this are not worth a compressed copy
+MIN_COMPRESS_BYTES = 1024
+# A compressed copy is only kept when it saves at least this fraction
+MIN_SAVING = 0.1
+
+SIDECARS = {'br': '.br', 'gzip': '.gz'}
+# Preferred first when a client accepts several
+ENCODINGS = ['br', 'gzip']
+
+# Fingerprinted URLs (?v=<etag>) never change; everything else revalidates
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+mimetypes.add_type('model/gltf+json', '.gltf')
+mimetypes.add_type('model/gltf-binary', '.glb')
+
+
+def compress(data, encoding, best=False):
+    # Maximum levels are for offline sidecars; brotli 11 takes seconds per MB
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(data, quality=11 if best else 5)
+    return None
+
+
+class Asset:
+    __slots__ = ('name', 'version', 'size', 'mtime', 'content_type', 'bodies')
+
+    def __init__(self, name, data, mtime, content_type, bodies):
+        self.name = name
+        self.version = hashlib.blake2b(data, digest_size=12).hexdigest()
+        self.size = len(data)
+        self.mtime = mtime
+        self.content_type = content_type
+        # 'identity' plus whichever compressed forms were worth keeping
+        self.bodies = bodies
+
+    def etag(self, encoding='identity'):
+        return f'"{self.version}"' if encoding == 'identity' else f'"{self.version}-{encoding}"'
+
+    @property
+    def nbytes(self):
+        return sum(len(body) for body in self.bodies.values())
+
+
+class AssetCache:
+    """Serves files under `directory` from memory, bounded to `max_bytes` (LRU)."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = os.path.realpath(directory)
+        self.max_bytes = max_bytes
+        self._assets = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _resolve(self, name):
+        # Only paths inside the directory, as send_from_directory allows
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        return path
+
+    def _load(self, name, path, stat):
+        with open(path, 'rb') as f:
+            data = f.read()
+        bodies = {'identity': data}
+        if len(data) >= MIN_COMPRESS_BYTES:
+            for encoding in ENCODINGS:
+                body = self._read_sidecar(path, encoding, stat.st_mtime)
+                if body is None:
+                    body = compress(data, encoding)
+                if body is not None and len(body) <= len(data) * (1 - MIN_SAVING):
+                    bodies[encoding] = body
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return Asset(name, data, stat.st_mtime, content_type, bodies)
+
+    def _read_sidecar(self, path, encoding, mtime):
+        sidecar = path + SIDECARS[encoding]
+        try:
+            if os.stat(sidecar).st_mtime < mtime:
+                return None
+            with open(sidecar, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def preload(self):
+        """Load every file under the directory, so the first viewer does not pay for compression."""
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if not filename.endswith(tuple(SIDECARS.values())):
+                    self.get(os.path.relpath(os.path.join(root, filename), self.directory))
+
+    def get(self, name):
+        """Return the Asset for `name`, or None if there is no such file."""
+        path = self._resolve(name)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        with self._lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.mtime == stat.st_mtime and asset.size == stat.st_size:
+                self._assets.move_to_end(path)
+                return asset
+
+        asset = self._load(name, path, stat)
+        with self._lock:
+            previous = self._assets.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            if asset.nbytes <= self.max_bytes:
+                self._assets[path] = asset
+                self._bytes += asset.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._assets.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+        return asset
+
+
+def negotiate(accept_encoding, asset):
+    """Pick the best body the client accepts: brotli, then gzip, then identity."""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    for encoding in ENCODINGS:
+        if encoding in asset.bodies and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return 'identity'
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single bytes range, None to ignore it, or False if unsatisfiable."""
+    unit, _, spec = (header or '').partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        # Multipart ranges are answered with the whole body
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _matches(if_none_match, asset):
+    if if_none_match is None:
+        return False
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    if '*' in tags:
+        return True
+    return any(asset.etag(encoding) in tags for encoding in asset.bodies)
+
+
+def asset_response(asset, headers, version=None):
+    """Build (status, headers, body) for a GET of `asset`.
+
+    `headers` are the request headers (any case-insensitive mapping) and
+    `version` the ?v= query value; a URL carrying the asset's current
+    version is cached as immutable.
+    """
+    encoding = negotiate(headers.get('Accept-Encoding'), asset)
+    response = {
+        'Cache-Control': IMMUTABLE if version == asset.version else REVALIDATE,
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if _matches(headers.get('If-None-Match'), asset):
+        response['ETag'] = asset.etag(encoding)
+        return 304, response, b''
+
+    range_header = headers.get('Range')
+    if_range = headers.get('If-Range')
+    if range_header and (if_range is None or if_range == asset.etag()):
+        # Ranges address the uncompressed bytes
+        body = asset.bodies['identity']
+        span = _parse_range(range_header, len(body))
+        response['ETag'] = asset.etag()
+        response['Content-Type'] = asset.content_type
+        if span is False:
+            response['Content-Range'] = f'bytes */{len(body)}'
+            return 416, response, b''
+        if span is not None:
+            start, end = span
+            response['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+            response['Content-Length'] = str(end - start + 1)
+            return 206, response, body[start:end + 1]
+
+    body = asset.bodies[encoding]
+    response['ETag'] = asset.etag(encoding)
+    response['Content-Type'] = asset.content_type
+    response['Content-Length'] = str(len(body))
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    return 200, response, body
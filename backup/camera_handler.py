@@ -1,14 +1,36 @@
-from picamera2 import Picamera2
-from libcamera import controls
+try:
+    from picamera2 import Picamera2
+    from libcamera import controls
+except ImportError:
+    # Off the Pi, pass a camera_factory such as synthetic_camera.FakePicamera2
+    Picamera2 = None
+    controls = None
+import atexit
+import os
+import sys
 import threading
 import time
 import cv2
 import numpy as np
-from typing import Optional, Generator
+from typing import Any, Callable, Optional, Generator
 from contextlib import contextmanager
 
+# The shared streaming modules live at the repository root; make them
+# importable when this file is run directly from backup/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mjpeg import part  # noqa: E402
+from frame_hub import FrameHub, EncodedFrame  # noqa: E402
+from jpeg_pool import JpegEncoderPool  # noqa: E402
+from stream_profiles import PROFILES, DEFAULT_PROFILE, LORES_SIZE, fit, jpeg_params  # noqa: E402
+
+JPEG_PARAMS = jpeg_params(PROFILES['full'])  # Quality 95, optimized
+
 class PiCameraHandler:
-    def __init__(self):
+    def __init__(self, encode_workers: Optional[int] = None,
+                 camera_factory: Optional[Callable[[int], Any]] = None):
+        # Builds the camera object for a camera id; defaults to Picamera2
+        self.camera_factory = camera_factory or Picamera2
         self.cameras = {
             0: None,  # Primary camera
             1: None   # Secondary camera
@@ -26,6 +48,29 @@ class PiCameraHandler:
             1: None
         }
         self.frame_interval = 0.016  # ~60 FPS for better performance
+        # One hub per output profile; a profile is only encoded while it has viewers
+        self.hubs = {
+            0: {name: FrameHub() for name in PROFILES},
+            1: {name: FrameHub() for name in PROFILES}
+        }
+        self.viewers = {
+            0: {name: 0 for name in PROFILES},
+            1: {name: 0 for name in PROFILES}
+        }
+        self.capture_threads = {
+            0: None,
+            1: None
+        }
+        self.thread_lock = threading.Lock()
+        self._no_signal_frame = None
+        # 1080p encodes run on a process pool shared by both cameras;
+        # None uses every core, 0 encodes inline on the capture thread
+        self.encode_workers = encode_workers
+        self._encoder = None
+        self.dropped_frames = {
+            0: 0,
+            1: 0
+        }
     
     def initialize_camera(self, camera_id: int) -> bool:
         if camera_id not in self.cameras:
@@ -34,18 +79,23 @@ class PiCameraHandler:
         try:
             with self.camera_locks[camera_id]:
                 if self.cameras[camera_id] is None:
+                    if self.camera_factory is None:
+                        print(f"Camera {camera_id} init error: picamera2 is not installed")
+                        return False
                     try:
-                        self.cameras[camera_id] = Picamera2(camera_id)
-                        # Increased resolution and quality settings
+                        self.cameras[camera_id] = self.camera_factory(camera_id)
+                        # Full HD main stream, plus the ISP-scaled lores stream
+                        # that low-resolution profiles are cut from
                         config = self.cameras[camera_id].create_preview_configuration(
                             main={"size": (1920, 1080), "format": "RGB888"},  # Full HD
+                            lores={"size": LORES_SIZE, "format": "YUV420"},
                             buffer_count=4
                         )
                         self.cameras[camera_id].configure(config)
                         self.camera_configs[camera_id] = config
                         
                         # Enhanced camera settings with autofocus
-                        self.cameras[camera_id].set_controls({
+                        camera_controls = {
                             "FrameDurationLimits": (16666, 16666),  # ~60 FPS
                             "ExposureTime": 33333,  # Default exposure
                             "AnalogueGain": 1.0,    # Default gain
@@ -56,13 +106,17 @@ class PiCameraHandler:
                             "Sharpness": 1.0,       # Default sharpness
                             "AeEnable": True,       # Auto exposure enabled
                             "AwbEnable": True,      # Auto white balance enabled
-                            "AfMode": controls.AfModeEnum.Continuous,  # Continuous autofocus
-                            "AfSpeed": controls.AfSpeedEnum.Normal,    # Normal autofocus speed
-                            "AfRange": controls.AfRangeEnum.Normal,    # Full autofocus range
-                            "AfMetering": controls.AfMeteringEnum.Auto,# Auto AF metering
-                            "AfWindows": [[0, 0, 1, 1]],              # Full frame AF window
-                            "AfTrigger": controls.AfTriggerEnum.Start # Start autofocus
-                        })
+                        }
+                        if controls is not None:
+                            camera_controls.update({
+                                "AfMode": controls.AfModeEnum.Continuous,  # Continuous autofocus
+                                "AfSpeed": controls.AfSpeedEnum.Normal,    # Normal autofocus speed
+                                "AfRange": controls.AfRangeEnum.Normal,    # Full autofocus range
+                                "AfMetering": controls.AfMeteringEnum.Auto,# Auto AF metering
+                                "AfWindows": [[0, 0, 1, 1]],              # Full frame AF window
+                                "AfTrigger": controls.AfTriggerEnum.Start # Start autofocus
+                            })
+                        self.cameras[camera_id].set_controls(camera_controls)
                         
                         self.cameras[camera_id].start()
                         self.is_running[camera_id] = True
@@ -77,53 +131,149 @@ class PiCameraHandler:
             print(f"Camera {camera_id} error: {str(e)}")
             return False
 
-    def generate_frames(self, camera_id: int) -> Generator[bytes, None, None]:
-        if camera_id not in self.cameras:
-            return
+    def _ensure_capture_thread(self, camera_id: int):
+        with self.thread_lock:
+            thread = self.capture_threads[camera_id]
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self._capture_loop, args=(camera_id,), daemon=True)
+                self.capture_threads[camera_id] = thread
+                thread.start()
 
-        if not self.is_running[camera_id]:
-            self.initialize_camera(camera_id)
+    def stop_camera(self, camera_id: int):
+        """Stop a camera's capture thread and release the camera; viewers get the no-signal frame."""
+        self.is_running[camera_id] = False
+        with self.thread_lock:
+            thread, self.capture_threads[camera_id] = self.capture_threads[camera_id], None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self.camera_locks[camera_id]:
+            camera, self.cameras[camera_id] = self.cameras[camera_id], None
+        if camera is not None:
+            try:
+                camera.stop()
+                camera.close()
+            except Exception as e:
+                print(f"Camera {camera_id} stop error: {str(e)}")
 
-        last_frame_time = 0
-        while True:
-            current_time = time.time()
-            if current_time - last_frame_time < self.frame_interval:
-                time.sleep(0.001)
-                continue
+    def _get_encoder(self) -> Optional[JpegEncoderPool]:
+        if self.encode_workers == 0:
+            return None
+        with self.thread_lock:
+            if self._encoder is None:
+                self._encoder = JpegEncoderPool(self.encode_workers).start()
+                # Unlink the shared memory block when the server exits
+                atexit.register(self._encoder.close)
+            return self._encoder
 
+    def _publish_encoded(self, jpeg: Optional[bytes], meta):
+        camera_id, profile, capture_time = meta
+        if jpeg is not None:
+            self.hubs[camera_id][profile].publish(EncodedFrame(jpeg, None, capture_time), capture_time)
+
+    def _active_profiles(self, camera_id: int) -> list:
+        with self.thread_lock:
+            return [PROFILES[name] for name, count in self.viewers[camera_id].items() if count > 0]
+
+    def _capture_streams(self, camera, names: list) -> dict:
+        # Both streams come from the same request so a frame's profiles match
+        if len(names) > 1:
+            arrays, _ = camera.capture_arrays(names)
+        else:
+            arrays = [camera.capture_array(names[0])]
+        images = dict(zip(names, arrays))
+        if 'lores' in images:
+            # lores is planar YUV420, possibly padded to the ISP's row stride
+            images['lores'] = cv2.cvtColor(images['lores'], cv2.COLOR_YUV2BGR_I420)[:, :LORES_SIZE[0]]
+        return images
+
+    def _capture_loop(self, camera_id: int):
+        # One capture-and-encode loop per camera; viewers wait on its profile hubs
+        hubs = self.hubs[camera_id]
+        encoder = self._get_encoder()
+        rotate = cv2.ROTATE_180 if camera_id == 0 else None
+        next_frame_time = time.time()
+        while self.is_running[camera_id]:
+            profiles = self._active_profiles(camera_id)
+            if not profiles:
+                time.sleep(self.frame_interval)
+                next_frame_time = time.time()
+                continue
+            # The full-HD main stream is only read while someone watches it
+            names = sorted({profile.stream for profile in profiles})
             with self.camera_locks[camera_id]:
                 try:
-                    if self.cameras[camera_id] is not None and self.is_running[camera_id]:
-                        # Capture frame
-                        frame = self.cameras[camera_id].capture_array()
-                        
-                        # Rotate camera 1 stream by 180 degrees
-                        if camera_id == 0:
-                            frame = cv2.rotate(frame, cv2.ROTATE_180)
-                        
-                        # Encode to JPEG with higher quality
-                        ret, jpeg = cv2.imencode('.jpg', frame, [
-                            cv2.IMWRITE_JPEG_QUALITY, 95,  # Increased JPEG quality
-                            cv2.IMWRITE_JPEG_OPTIMIZE, 1
-                        ])
-                        frame_data = jpeg.tobytes()
-                        
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-                    else:
-                        frame_data = self.generate_no_signal_frame()
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
-                    
+                    if self.cameras[camera_id] is None:
+                        break
+                    # Capture frame
+                    images = self._capture_streams(self.cameras[camera_id], names)
                 except Exception as e:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + 
-                           self.generate_no_signal_frame() + b'\r\n')
-                
-            last_frame_time = time.time()
+                    print(f"Camera {camera_id} capture error: {str(e)}")
+                    images = None
+
+            if images is None:
+                no_signal = EncodedFrame(self.generate_no_signal_frame(), None, time.time())
+                for profile in profiles:
+                    hubs[profile.name].publish(no_signal)
+                time.sleep(0.5)
+                continue
+            capture_time = time.time()
+
+            for profile in profiles:
+                frame = fit(images[profile.stream], profile.size)
+                params = jpeg_params(profile)
+                if encoder is not None:
+                    # Rotation and encoding happen in the pool; results come back
+                    # in capture order and are published from its collector thread
+                    if not encoder.submit((camera_id, profile.name), frame, params, self._publish_encoded,
+                                          (camera_id, profile.name, capture_time), rotate):
+                        self.dropped_frames[camera_id] += 1
+                else:
+                    # Rotate camera 1 stream by 180 degrees
+                    if rotate is not None:
+                        frame = cv2.rotate(frame, rotate)
+
+                    # Encode once per profile for all of its viewers
+                    ret, jpeg = cv2.imencode('.jpg', frame, params)
+                    hubs[profile.name].publish(EncodedFrame(jpeg.tobytes(), frame, capture_time), capture_time)
+
+            next_frame_time = max(next_frame_time + self.frame_interval, time.time())
+            time.sleep(max(0.0, next_frame_time - time.time()))
+
+    def generate_frames(self, camera_id: int, profile: str = DEFAULT_PROFILE) -> Generator[bytes, None, None]:
+        if camera_id not in self.cameras or profile not in PROFILES:
+            return
+
+        if not self.is_running[camera_id]:
+            self.initialize_camera(camera_id)
+        if self.is_running[camera_id]:
+            self._ensure_capture_thread(camera_id)
+
+        with self.thread_lock:
+            self.viewers[camera_id][profile] += 1
+        try:
+            hub = self.hubs[camera_id][profile]
+            last_seq, frame = hub.latest()
+            while True:
+                if frame is not None:
+                    yield part(frame.jpeg, frame.timestamp)
+                elif not self.is_running[camera_id]:
+                    yield part(self.generate_no_signal_frame())
+
+                # Wake only for a frame this viewer has not been sent yet
+                seq, latest = hub.wait(last_seq, timeout=1.0)
+                if latest is not None:
+                    last_seq, frame = seq, latest
+                elif not self.is_running[camera_id]:
+                    frame = None
+        finally:
+            with self.thread_lock:
+                self.viewers[camera_id][profile] -= 1
 
     def generate_no_signal_frame(self) -> bytes:
         """Generate a 'Camera Not Available' frame"""
+        if self._no_signal_frame is not None:
+            return self._no_signal_frame
+
         # Updated resolution to match main camera resolution
         frame = np.full((1080, 1920, 3), 255, dtype=np.uint8)
         
@@ -140,7 +290,8 @@ class PiCameraHandler:
         cv2.putText(frame, text, (text_x, text_y), font, font_scale, color, thickness)
         
         ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
-        return jpeg.tobytes()
+        self._no_signal_frame = jpeg.tobytes()
+        return self._no_signal_frame
 
 # Create a singleton instance
 camera_handler = PiCameraHandler()
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""Per-profile cost of PiCameraHandler streams on the fake Picamera2 backend.
+
+Runs the handler against synthetic_camera.FakePicamera2 (1080p main plus
+640x360 YUV420 lores) with a few viewer mixes on camera 1 and reports, per
+profile, frames per second, bytes per frame and the tether bandwidth, plus
+the process CPU the capture-and-encode loop used. Encoding is inline so
+the CPU figure is the camera loop's own.
+
+Before measuring it checks, with assertions, that each profile's JPEGs
+have the expected size, and that an unknown profile gets a 400 from both
+rov_server runtimes; --check stops after that.
+
+    python -m benchmarks.camera_profiles --duration 5
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from backup.camera_handler import PiCameraHandler
+from mjpeg import MJPEGParser
+from synthetic_camera import FakePicamera2
+
+EXPECTED_SIZES = {'full': (1920, 1080), 'low': (640, 360), 'thumb': (320, 180)}
+BAD_QUERIES = ['profile=huge', 'resolution=wide']
+
+SCENARIOS = {
+    'full': ['full'],
+    'low': ['low'],
+    'thumb': ['thumb'],
+    'full+low+thumb': ['full', 'low', 'thumb'],
+    '4x low': ['low'] * 4,
+}
+
+
+def first_frame_size(handler, profile):
+    frames = handler.generate_frames(1, profile)
+    try:
+        chunk = next(frames)
+    finally:
+        frames.close()
+    jpeg = MJPEGParser().feed(chunk + b'--frame\r\n')[0]
+    image = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return image.shape[1], image.shape[0]
+
+
+async def async_statuses(camera_streams, paths):
+    from aiohttp.test_utils import TestClient, TestServer
+    import rov_async_server
+    async with TestClient(TestServer(rov_async_server.make_video_app(camera_streams))) as client:
+        statuses = []
+        for path in paths:
+            response = await client.get(path)
+            statuses.append(response.status)
+            response.close()
+        return statuses
+
+
+def check_profiles():
+    handler = PiCameraHandler(encode_workers=0, camera_factory=FakePicamera2)
+    try:
+        for profile, expected in EXPECTED_SIZES.items():
+            size = first_frame_size(handler, profile)
+            assert size == expected, f"{profile} frames are {size}, expected {expected}"
+        assert list(handler.generate_frames(1, 'huge')) == [], "unknown profile produced frames"
+    finally:
+        handler.stop_camera(1)
+
+    import rov_server
+    paths = [f'/camera/0?{query}' for query in BAD_QUERIES]
+    client = rov_server.app.test_client()
+    for path in paths:
+        status = client.get(path).status_code
+        assert status == 400, f"rov_server answered {path} with {status}"
+    for path, status in zip(paths, asyncio.run(async_statuses(rov_server.camera_streams, paths))):
+        assert status == 400, f"rov_async_server answered {path} with {status}"
+
+
+def run(profiles, duration):
+    handler = PiCameraHandler(encode_workers=0, camera_factory=FakePicamera2)
+    counts = [[0, 0] for _ in profiles]
+    stop = threading.Event()
+
+    def watch(i, profile):
+        frames = handler.generate_frames(1, profile)
+        for chunk in frames:
+            if stop.is_set():
+                break
+            counts[i][0] += 1
+            counts[i][1] += len(chunk)
+        frames.close()
+
+    threads = [threading.Thread(target=watch, args=(i, profile), daemon=True)
+               for i, profile in enumerate(profiles)]
+    for thread in threads:
+        thread.start()
+    # Skip camera start-up before measuring
+    time.sleep(1)
+    for count in counts:
+        count[0] = count[1] = 0
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - wall_start
+    rows = [{'profile': profile,
+             'fps': round(frames / elapsed, 1),
+             'kb_per_frame': round(nbytes / max(frames, 1) / 1024, 1),
+             'mbps': round(nbytes * 8 / elapsed / 1e6, 2)}
+            for profile, (frames, nbytes) in zip(profiles, counts)]
+    stop.set()
+    handler.stop_camera(1)
+    for thread in threads:
+        # Viewers see the stop at their next frame, at most the hub timeout away
+        thread.join()
+    return {'cpu_percent': round(100 * cpu / elapsed, 1), 'viewers': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--check', action='store_true', help='only run the profile checks')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    check_profiles()
+    print("profile checks passed")
+    if args.check:
+        return
+
+    results = {}
+    print(f"{'scenario':<16} {'cpu %':>6}  {'profile':<6} {'fps':>5} {'KB/frame':>9} {'Mbit/s':>7}")
+    for name, profiles in SCENARIOS.items():
+        result = results[name] = run(profiles, args.duration)
+        for i, row in enumerate(result['viewers']):
+            label, cpu = (name, result['cpu_percent']) if i == 0 else ('', '')
+            print(f"{label:<16} {cpu:>6}  {row['profile']:<6} {row['fps']:>5} {row['kb_per_frame']:>9} "
+                  f"{row['mbps']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Bandwidth and encode latency of MJPEG against the fMP4 H.264 mode.
+
+Both encoders are fed the same synthetic_camera frames at the camera rate:
+
+- mjpeg   cv2.imencode per frame, as the /camera routes do
+- h264    fmp4.Fmp4Stream (libx264 ultrafast/zerolatency, one fragment per
+          frame), as /camera/<id>/fmp4 and camera_server ?format=fmp4 do
+
+For each it reports the achieved frame rate, the bitrate and bytes per
+frame, and the latency from handing a frame over until its encoded bytes are
+ready to send (p50 and p95); for H.264 that is until the fragment is
+published. CPU is this process for MJPEG and the ffmpeg child for H.264.
+ffmpeg is taken from FFMPEG_BINARY or PATH; pass --encoder h264_v4l2m2m on
+the Pi to measure the hardware encoder.
+
+    python -m benchmarks.h264_vs_mjpeg --size 1280x720 --fps 30 --duration 10 --bitrate 2M
+"""
+import argparse
+import json
+import resource
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from fmp4 import Fmp4Stream, ffmpeg_available
+from synthetic_camera import SyntheticCapture
+
+
+def paced_frames(capture, fps, duration):
+    """Yield frames from `capture` at `fps` for `duration` seconds."""
+    interval = 1.0 / fps
+    next_frame_time = time.perf_counter()
+    end = next_frame_time + duration
+    while next_frame_time < end:
+        ok, frame = capture.read()
+        if ok:
+            yield frame
+        next_frame_time += interval
+        delay = next_frame_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def summarize(name, frames, nbytes, latencies, elapsed, cpu, dropped=0):
+    latencies = np.array(latencies or [0.0]) * 1000
+    return {
+        'mode': name,
+        'fps': round(frames / elapsed, 1),
+        'mbps': round(nbytes * 8 / elapsed / 1e6, 2),
+        'kb_per_frame': round(nbytes / max(frames, 1) / 1024, 1),
+        'latency_p50_ms': round(float(np.percentile(latencies, 50)), 1),
+        'latency_p95_ms': round(float(np.percentile(latencies, 95)), 1),
+        'cpu_percent': round(100 * cpu / elapsed, 1),
+        'dropped': dropped,
+    }
+
+
+def run_mjpeg(args, size):
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), args.quality]
+    frames, nbytes, latencies = 0, 0, []
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for frame in paced_frames(SyntheticCapture(size, args.fps), args.fps, args.duration):
+        encode_start = time.perf_counter()
+        _, jpeg = cv2.imencode('.jpg', frame, params)
+        latencies.append(time.perf_counter() - encode_start)
+        frames += 1
+        nbytes += len(jpeg)
+    elapsed = time.perf_counter() - start
+    return summarize('mjpeg', frames, nbytes, latencies, elapsed, time.process_time() - cpu_start)
+
+
+def run_h264(args, size):
+    stream = Fmp4Stream(size, args.fps, args.bitrate, encoder=args.encoder).start()
+    pending = deque()
+    counts = {'frames': 0, 'bytes': 0}
+    latencies = []
+    done = threading.Event()
+
+    def watch():
+        # Fragments are published in write order, one per accepted frame
+        last_seq = 0
+        while not done.is_set():
+            seq, _ = stream.hub.wait(last_seq, timeout=0.5)
+            if seq == last_seq:
+                continue
+            now = time.perf_counter()
+            last_seq, fragments = stream.fragments_after(last_seq)
+            for fragment in fragments:
+                if pending:
+                    latencies.append(now - pending.popleft())
+                counts['frames'] += 1
+                counts['bytes'] += len(fragment)
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    for frame in paced_frames(SyntheticCapture(size, args.fps), args.fps, args.duration):
+        dropped = stream.dropped
+        write_time = time.perf_counter()
+        stream.write(frame)
+        if stream.dropped == dropped:
+            pending.append(write_time)
+    elapsed = time.perf_counter() - start
+    # Let the encoder catch up; the muxer holds the newest frame until the next one arrives
+    deadline = time.perf_counter() + 2
+    while len(pending) > 1 and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    done.set()
+    watcher.join()
+    init_bytes = len(stream.init or b'')
+    stream.close()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (children.ru_utime - children_start.ru_utime) + (children.ru_stime - children_start.ru_stime)
+    row = summarize('h264', counts['frames'], counts['bytes'] + init_bytes, latencies, elapsed, cpu,
+                    stream.dropped)
+    if not stream.init:
+        row['error'] = 'ffmpeg produced no output'
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--quality', type=int, default=80, help='JPEG quality')
+    parser.add_argument('--bitrate', default='2M', help='H.264 target bitrate')
+    parser.add_argument('--encoder', default='libx264', help='ffmpeg video encoder, e.g. h264_v4l2m2m')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.split('x'))
+    rows = [run_mjpeg(args, size)]
+    if ffmpeg_available():
+        rows.append(run_h264(args, size))
+    else:
+        print("ffmpeg not found (set FFMPEG_BINARY); skipping h264")
+
+    print(f"{'mode':<6} {'fps':>5} {'Mbit/s':>7} {'KB/frame':>9} {'p50 ms':>7} {'p95 ms':>7} {'cpu %':>6} {'dropped':>8}")
+    for row in rows:
+        print(f"{row['mode']:<6} {row['fps']:>5} {row['mbps']:>7} {row['kb_per_frame']:>9} "
+              f"{row['latency_p50_ms']:>7} {row['latency_p95_ms']:>7} {row['cpu_percent']:>6} {row['dropped']:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""1080p JPEG encode throughput, inline vs jpeg_pool, for two camera streams.
+
+Encodes synthetic 1920x1080 frames at the PiCameraHandler settings
+(quality 95, optimize, camera 0 rotated) for a fixed time and reports frames
+per second per stream. Refused submissions (every slot busy) are retried, so
+the pool numbers are its sustained capacity.
+
+    python -m benchmarks.jpeg_encode --workers 1,2,4 --duration 5
+"""
+import argparse
+import json
+import threading
+import time
+
+import cv2
+
+from jpeg_pool import JpegEncoderPool
+from synthetic_camera import SyntheticCapture
+
+JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+ROTATE = {0: cv2.ROTATE_180, 1: None}
+
+
+def make_frames(count=8):
+    captures = {camera: SyntheticCapture((1920, 1080), 1000, seed=camera) for camera in ROTATE}
+    return {camera: [cap.read()[1] for _ in range(count)] for camera, cap in captures.items()}
+
+
+def run_inline(frames, duration):
+    done = {camera: 0 for camera in frames}
+    stop_at = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < stop_at:
+        for camera, stream in frames.items():
+            frame = stream[i % len(stream)]
+            if ROTATE[camera] is not None:
+                frame = cv2.rotate(frame, ROTATE[camera])
+            cv2.imencode('.jpg', frame, JPEG_PARAMS)
+            done[camera] += 1
+        i += 1
+    return done
+
+
+def run_pool(frames, duration, workers):
+    pool = JpegEncoderPool(workers).start()
+    done = {camera: 0 for camera in frames}
+    lock = threading.Lock()
+
+    def delivered(jpeg, camera):
+        with lock:
+            done[camera] += 1
+
+    try:
+        # Let the workers finish importing before timing
+        for camera in frames:
+            pool.submit(camera, frames[camera][0], JPEG_PARAMS, lambda jpeg, meta: None, camera)
+        time.sleep(2)
+        with lock:
+            for camera in done:
+                done[camera] = 0
+
+        stop_at = time.perf_counter() + duration
+        i = 0
+        while time.perf_counter() < stop_at:
+            for camera, stream in frames.items():
+                while not pool.submit(camera, stream[i % len(stream)], JPEG_PARAMS, delivered,
+                                      camera, ROTATE[camera]):
+                    time.sleep(0.001)
+            i += 1
+        with lock:
+            return dict(done)
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    frames = make_frames()
+    rows = []
+    print(f"{'mode':<10} {'cam0 fps':>9} {'cam1 fps':>9}")
+    runs = [('inline', None)] + [(f'pool x{n}', int(n)) for n in args.workers.split(',')]
+    for name, workers in runs:
+        if workers is None:
+            done = run_inline(frames, args.duration)
+        else:
+            done = run_pool(frames, args.duration, workers)
+        fps = {camera: round(count / args.duration, 1) for camera, count in done.items()}
+        rows.append({'mode': name, 'workers': workers, 'fps': fps})
+        print(f"{name:<10} {fps[0]:>9} {fps[1]:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""MJPEG ingest throughput against frame size.
+
+Compares the original StreamDetector loop (1 KB chunks, bytes concatenation,
+SOI/EOI search over the whole buffer) with mjpeg.MJPEGParser, with and
+without Content-Length headers.
+
+    python -m benchmarks.mjpeg_ingest --frames 30
+"""
+import argparse
+import io
+import os
+import time
+
+from mjpeg import MJPEGParser, iter_frames, part
+
+
+def synthetic_jpeg(size):
+    # Random payload without 0xFF bytes so the legacy SOI/EOI search is not confused
+    body = os.urandom(size).replace(b'\xff', b'\xfe')
+    return b'\xff\xd8' + body + b'\xff\xd9'
+
+
+def bare_part(jpeg):
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+
+def legacy_ingest(stream):
+    count = 0
+    bytes_buffer = bytes()
+    for i in range(0, len(stream), 1024):
+        bytes_buffer += stream[i:i + 1024]
+        a = bytes_buffer.find(b'\xff\xd8')
+        b = bytes_buffer.find(b'\xff\xd9')
+        if a != -1 and b != -1:
+            bytes_buffer = bytes_buffer[b + 2:]
+            count += 1
+    return count
+
+
+def parser_ingest(stream, chunk_size=256 * 1024):
+    parser = MJPEGParser()
+    count = 0
+    view = memoryview(stream)
+    for i in range(0, len(stream), chunk_size):
+        count += len(parser.feed(view[i:i + chunk_size]))
+    # Without Content-Length the final part ends at the next boundary
+    count += len(parser.feed(b'--frame\r\n'))
+    return count
+
+
+def reader_ingest(stream, chunk_size=256 * 1024):
+    raw = io.BufferedReader(io.BytesIO(stream), buffer_size=chunk_size)
+    return sum(1 for _ in iter_frames(raw, chunk_size=chunk_size))
+
+
+def measure(fn, stream, expected):
+    start = time.perf_counter()
+    count = fn(stream)
+    elapsed = time.perf_counter() - start
+    assert count == expected, f"{fn.__name__} parsed {count} of {expected} frames"
+    return len(stream) / elapsed / 1e6, count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--sizes', default='20,100,300,1000',
+                        help='frame sizes in KB (1080p quality-95 is roughly 300-1000 KB)')
+    parser.add_argument('--skip-legacy-above', type=int, default=300,
+                        help='skip the quadratic legacy loop above this frame size in KB')
+    args = parser.parse_args()
+
+    print(f"{'frame KB':>9} {'method':<26} {'MB/s':>9} {'frames/s':>10}")
+    for size_kb in (int(s) for s in args.sizes.split(',')):
+        frames = [synthetic_jpeg(size_kb * 1024) for _ in range(args.frames)]
+        with_length = b''.join(part(f) for f in frames)
+        without_length = b''.join(bare_part(f) for f in frames)
+
+        runs = [
+            ('parser, Content-Length', parser_ingest, with_length),
+            ('parser, boundary scan', parser_ingest, without_length),
+            ('iter_frames + readinto', reader_ingest, with_length),
+        ]
+        if size_kb <= args.skip_legacy_above:
+            runs.insert(0, ('legacy 1 KB concat', legacy_ingest, without_length))
+
+        for name, fn, stream in runs:
+            mb_s, fps = measure(fn, stream, args.frames)
+            print(f"{size_kb:>9} {name:<26} {mb_s:>9.1f} {fps:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Viewer model load time against asset size, send_from_directory vs asset_cache.
+
+Generates glTF grid meshes (model.gltf plus model.bin) of increasing size
+and fetches them the way GLTFLoader does, the .gltf first and then its
+buffer. Three runs are made per size:
+
+- plain    the previous send_from_directory route
+- cold     asset_cache with Accept-Encoding br, gzip (first visit)
+- reload   asset_cache revalidated with If-None-Match (iframe remount)
+
+The cache is preloaded first, as the servers do at startup, and the time
+that takes is reported as `prepare`. For each run it reports the bytes on
+the wire, the loopback fetch time including decompression, and the
+estimated time until the model can be rendered over a --link-mbps tether
+(fetch time plus wire bytes at link speed). In-browser timings are logged by viewer.html as window.viewerTimings.
+
+    python -m benchmarks.model_assets --vertices 10000,100000,1000000 --link-mbps 20
+"""
+import argparse
+import gzip
+import http.client
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from flask import Flask, Response, abort, request, send_from_directory
+from werkzeug.serving import make_server
+
+from asset_cache import AssetCache, asset_response, brotli
+
+ASSETS = ['model.gltf', 'model.bin']
+
+
+def write_grid_model(directory, vertices):
+    side = max(2, int(vertices ** 0.5))
+    x, z = np.meshgrid(np.linspace(-1, 1, side, dtype=np.float32), np.linspace(-1, 1, side, dtype=np.float32))
+    y = (0.1 * np.sin(6 * x) * np.cos(6 * z)).astype(np.float32)
+    positions = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+    normals = np.tile(np.array([0, 1, 0], dtype=np.float32), (len(positions), 1))
+    quads = np.arange(side * side, dtype=np.uint32).reshape(side, side)[:-1, :-1].ravel()
+    indices = np.stack([quads, quads + side, quads + 1, quads + 1, quads + side, quads + side + 1],
+                       axis=-1).astype(np.uint32).ravel()
+    blobs = [positions.tobytes(), normals.tobytes(), indices.tobytes()]
+    offsets = np.cumsum([0] + [len(blob) for blob in blobs]).tolist()
+    with open(os.path.join(directory, 'model.bin'), 'wb') as f:
+        f.write(b''.join(blobs))
+
+    gltf = {
+        'asset': {'version': '2.0'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0, 'NORMAL': 1}, 'indices': 2}]}],
+        'buffers': [{'uri': 'model.bin', 'byteLength': offsets[-1]}],
+        'bufferViews': [{'buffer': 0, 'byteOffset': offsets[i], 'byteLength': len(blobs[i])} for i in range(3)],
+        'accessors': [
+            {'bufferView': 0, 'componentType': 5126, 'count': len(positions), 'type': 'VEC3',
+             'min': positions.min(axis=0).tolist(), 'max': positions.max(axis=0).tolist()},
+            {'bufferView': 1, 'componentType': 5126, 'count': len(normals), 'type': 'VEC3'},
+            {'bufferView': 2, 'componentType': 5125, 'count': len(indices), 'type': 'SCALAR'},
+        ],
+    }
+    with open(os.path.join(directory, 'model.gltf'), 'w') as f:
+        json.dump(gltf, f)
+    return offsets[-1] + os.path.getsize(os.path.join(directory, 'model.gltf'))
+
+
+def make_app(directory):
+    app = Flask(__name__)
+    cache = AssetCache(directory)
+    start = time.perf_counter()
+    cache.preload()
+    app.config['PREPARE_SECONDS'] = time.perf_counter() - start
+
+    @app.route('/plain/<path:filename>')
+    def plain(filename):
+        return send_from_directory(directory, filename)
+
+    @app.route('/models/<path:filename>')
+    def cached(filename):
+        asset = cache.get(filename)
+        if asset is None:
+            abort(404)
+        status, headers, body = asset_response(asset, request.headers, request.args.get('v'))
+        return Response(body, status=status, headers=headers)
+
+    return app
+
+
+def decode(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'br':
+        return brotli.decompress(body)
+    return body
+
+
+def fetch(port, prefix, etags=None):
+    """Fetch every asset once; returns (seconds, wire bytes, etags)."""
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    wire, new_etags = 0, {}
+    start = time.perf_counter()
+    for name in ASSETS:
+        headers = {'Accept-Encoding': 'br, gzip' if brotli is not None else 'gzip'}
+        if etags and name in etags:
+            headers['If-None-Match'] = etags[name]
+        connection.request('GET', f'{prefix}/{name}', headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        wire += len(body) + sum(len(k) + len(v) + 4 for k, v in response.getheaders())
+        decode(body, response.getheader('Content-Encoding'))
+        new_etags[name] = response.getheader('ETag')
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return elapsed, wire, new_etags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vertices', default='10000,100000,1000000')
+    parser.add_argument('--link-mbps', type=float, default=20.0, help='tether bandwidth for the estimate')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rows = []
+    print(f"{'vertices':>9} {'asset MB':>9} {'prepare s':>10}  {'run':<7} {'wire KB':>9} {'fetch ms':>9} {'est. ms':>9}")
+    for vertices in (int(v) for v in args.vertices.split(',')):
+        with tempfile.TemporaryDirectory() as directory:
+            size = write_grid_model(directory, vertices)
+            app = make_app(directory)
+            prepare = app.config['PREPARE_SECONDS']
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_port
+            try:
+                runs = [('plain', fetch(port, '/plain'))]
+                cold = fetch(port, '/models')
+                runs += [('cold', cold), ('reload', fetch(port, '/models', cold[2]))]
+            finally:
+                server.shutdown()
+
+        for name, (elapsed, wire, _) in runs:
+            estimate = elapsed + wire * 8 / (args.link_mbps * 1e6)
+            row = {'vertices': vertices, 'asset_bytes': size, 'prepare_seconds': round(prepare, 2),
+                   'run': name, 'wire_bytes': wire,
+                   'fetch_ms': round(elapsed * 1000, 1), 'estimated_ms': round(estimate * 1000, 1)}
+            rows.append(row)
+            print(f"{vertices:>9} {size / 1e6:>9.2f} {prepare:>10.2f}  {name:<7} {wire / 1024:>9.1f} "
+                  f"{row['fetch_ms']:>9} {row['estimated_ms']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
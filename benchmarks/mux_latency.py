@@ -0,0 +1,262 @@
+"""Control latency under video saturation: separate sockets, one FIFO socket, mux.
+
+A server, a client and a rate-limited link between them run on one event
+loop. The link is a TCP relay that forwards server-to-client bytes at
+--link-mbps through one FIFO queue of --link-buffer-kb that every socket
+shares, like a tether. The server offers --frame-kb video frames at --fps,
+more than the link carries, while the client sends a binary gamepad packet
+every --control-ms and times the ack (control_protocol's echoed client
+timestamp). Modes:
+
+- separate  control and video on their own WebSockets, as camera_server
+            and rov_server do today; control only queues in the link
+- fifo      one socket, everything sent in the order it was produced, as
+            camera_server does with frames and sensor snapshots
+- mux       one socket through mux.MuxConnection (control first, chunked
+            video held back while the socket's backlog is high)
+- idle      mux with no video, the floor for the link and loop
+
+Control in every mode still waits for the link's queue to drain; keeping
+that queue short is the adaptive controller's job, not the scheduler's.
+
+    python -m benchmarks.mux_latency --link-mbps 20 --frame-kb 200 --fps 30 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import deque
+
+import numpy as np
+import websockets
+
+from control_protocol import ACK_PACKET, ControlConnection, pack_gamepad
+from mux import (CHANNEL_CONTROL, CHANNEL_VIDEO, DEFAULT_CHUNK_SIZE, DEFAULT_UNSENT_LIMIT, FLAG_FIRST,
+                 FLAG_LAST, MuxConnection, VideoReassembler, pack, pack_frame, unpack)
+
+MODES = ['separate', 'fifo', 'mux', 'idle']
+RELAY_CHUNK = 4096
+LINK_SLACK = 0.01
+
+
+class Link:
+    """A tether: one FIFO queue of `buffer` bytes, drained at `mbps`, shared by every relayed socket."""
+
+    def __init__(self, mbps, buffer):
+        self.rate = mbps * 1e6 / 8
+        self.capacity = buffer
+        self.queued = 0
+        self._queue = asyncio.Queue()
+        self._waiting = deque()
+
+    async def send(self, writer, data):
+        # Admitted in arrival order, as packets join the queue
+        ticket = asyncio.get_running_loop().create_future()
+        self._waiting.append((ticket, len(data)))
+        self._admit()
+        await ticket
+        self._queue.put_nowait((writer, data))
+
+    def _admit(self):
+        while self._waiting and (self.queued == 0 or self.queued + self._waiting[0][1] <= self.capacity):
+            ticket, size = self._waiting.popleft()
+            self.queued += size
+            ticket.set_result(None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        free_at = loop.time()
+        while True:
+            writer, data = await self._queue.get()
+            # Oversleeping while busy must not cost link capacity; only idle time is lost
+            free_at = max(loop.time() - LINK_SLACK, free_at) + len(data) / self.rate
+            await asyncio.sleep(free_at - loop.time())
+            if not writer.is_closing():
+                writer.write(data)
+            self.queued -= len(data)
+            self._admit()
+
+
+async def relay(reader, writer, link=None):
+    try:
+        while True:
+            data = await reader.read(RELAY_CHUNK)
+            if not data:
+                break
+            if link is not None:
+                await link.send(writer, data)
+            else:
+                writer.write(data)
+                await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_link(server_port, link):
+    async def handle(client_reader, client_writer):
+        # Small socket buffers and reads, so the link's queue is the only one that matters
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        upstream.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RELAY_CHUNK)
+        upstream.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(upstream, ('127.0.0.1', server_port))
+        server_reader, server_writer = await asyncio.open_connection(sock=upstream, limit=RELAY_CHUNK)
+        await asyncio.gather(relay(client_reader, server_writer), relay(server_reader, client_writer, link),
+                             return_exceptions=True)
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def make_server_handler(mode, args):
+    frame = os.urandom(args.frame_kb * 1024)
+    interval = 1.0 / args.fps
+
+    async def paced_video(send):
+        loop = asyncio.get_running_loop()
+        next_frame, seq = loop.time(), 0
+        while True:
+            seq += 1
+            await send(pack_frame(frame, seq, time.time(), 0))
+            next_frame = max(next_frame + interval, loop.time())
+            await asyncio.sleep(next_frame - loop.time())
+
+    async def handler(websocket, path):
+        if mode in ('mux', 'idle'):
+            connection = MuxConnection(websocket, chunk_size=args.chunk_kb * 1024,
+                                       unsent_limit=args.unsent_kb * 1024)
+            control = ControlConnection(websocket, reply=lambda m: connection.sender.send(CHANNEL_CONTROL, m))
+            connection.on(CHANNEL_CONTROL, control.receive)
+            connection.produce(lambda sender: control.apply_loop())
+            if mode == 'mux':
+                async def offer(payload):
+                    connection.sender.put(CHANNEL_VIDEO, payload)
+                connection.produce(lambda sender: paced_video(offer))
+            await connection.serve()
+            return
+
+        async def send_control(message):
+            await websocket.send(pack(CHANNEL_CONTROL, message))
+
+        async def send_video(payload):
+            await websocket.send(pack(CHANNEL_VIDEO, payload, FLAG_FIRST | FLAG_LAST))
+
+        tasks = []
+        if mode == 'fifo' or path == '/video':
+            tasks.append(asyncio.ensure_future(paced_video(send_video)))
+        control = ControlConnection(websocket, reply=send_control)
+        if mode == 'fifo' or path == '/control':
+            tasks.append(asyncio.ensure_future(control.apply_loop()))
+        try:
+            async for message in websocket:
+                _, _, payload = unpack(message)
+                await control.receive(payload)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return handler
+
+
+async def client(url, args, stats, control=True):
+    async with websockets.connect(url, max_size=None) as websocket:
+        reassembler = VideoReassembler()
+
+        async def send_gamepad():
+            seq = 0
+            while True:
+                seq += 1
+                await websocket.send(pack(CHANNEL_CONTROL, pack_gamepad([seq % 2, 0, 0, 0], [0] * 4, seq)))
+                await asyncio.sleep(args.control_ms / 1000)
+
+        sender = asyncio.ensure_future(send_gamepad()) if control else None
+        try:
+            async for message in websocket:
+                channel, flags, payload = unpack(message)
+                if channel == CHANNEL_CONTROL and isinstance(payload, bytes):
+                    _, _, _, client_time, _, _ = ACK_PACKET.unpack(payload)
+                    stats['rtt'].append(time.time() * 1000 - client_time)
+                elif channel == CHANNEL_VIDEO:
+                    stats['video_bytes'] += len(payload)
+                    if reassembler.feed(flags, payload) is not None:
+                        stats['frames'] += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if sender is not None:
+                sender.cancel()
+
+
+async def run(mode, args):
+    server = await websockets.serve(make_server_handler(mode, args), '127.0.0.1', 0, max_size=None)
+    server_port = server.sockets[0].getsockname()[1]
+    link = Link(args.link_mbps, args.link_buffer_kb * 1024)
+    link_task = asyncio.ensure_future(link.run())
+    link_server = await start_link(server_port, link)
+    base = f"ws://127.0.0.1:{link_server.sockets[0].getsockname()[1]}"
+
+    stats = {'rtt': [], 'frames': 0, 'video_bytes': 0}
+    if mode == 'separate':
+        clients = [client(base + '/control', args, stats), client(base + '/video', args, stats, control=False)]
+    else:
+        clients = [client(base + '/', args, stats)]
+    tasks = [asyncio.ensure_future(c) for c in clients]
+    # Let the link fill before measuring
+    await asyncio.sleep(1)
+    stats.update(rtt=[], frames=0, video_bytes=0)
+    await asyncio.sleep(args.duration)
+    rtt = np.array(stats['rtt'] or [np.nan])
+    result = {
+        'mode': mode,
+        'acks': len(stats['rtt']),
+        'rtt_p50_ms': round(float(np.percentile(rtt, 50)), 1),
+        'rtt_p95_ms': round(float(np.percentile(rtt, 95)), 1),
+        'rtt_p99_ms': round(float(np.percentile(rtt, 99)), 1),
+        'rtt_max_ms': round(float(rtt.max()), 1),
+        'video_fps': round(stats['frames'] / args.duration, 1),
+        'video_mbps': round(stats['video_bytes'] * 8 / args.duration / 1e6, 2),
+    }
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    link_server.close()
+    link_task.cancel()
+    server.close()
+    await server.wait_closed()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--link-mbps', type=float, default=20.0)
+    parser.add_argument('--link-buffer-kb', type=int, default=32, help='FIFO queue in front of the link')
+    parser.add_argument('--frame-kb', type=int, default=200)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--control-ms', type=float, default=20, help='gamepad send interval')
+    parser.add_argument('--chunk-kb', type=int, default=DEFAULT_CHUNK_SIZE // 1024, help='mux video chunk size')
+    parser.add_argument('--unsent-kb', type=int, default=DEFAULT_UNSENT_LIMIT // 1024,
+                        help='unsent bytes the kernel may hold for the mux socket')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'mode':<9} {'acks':>5} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'video fps':>10} {'Mbit/s':>7}")
+    for mode in args.modes.split(','):
+        row = asyncio.run(run(mode, args))
+        rows.append(row)
+        print(f"{mode:<9} {row['acks']:>5} {row['rtt_p50_ms']:>7} {row['rtt_p95_ms']:>7} {row['rtt_p99_ms']:>7} "
+              f"{row['rtt_max_ms']:>7} {row['video_fps']:>10} {row['video_mbps']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
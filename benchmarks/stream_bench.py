@@ -0,0 +1,235 @@
+"""Streaming throughput and latency across the servers, on a synthetic camera.
+
+Each target is started as a subprocess fed by synthetic_camera instead of a
+real camera or remote video, then N clients connect from one asyncio loop:
+
+- rov, rov-async      MJPEG /camera/0 from rov_server (threaded / --async)
+- camera              binary WebSocket frames from camera_server
+- detect, detect-raw  /detection_feed and /raw_feed from detect_stream,
+                      reading a synthetic MJPEG upstream
+
+Latency is client receive time minus the frame's capture time, taken from
+the X-Timestamp part header or the binary frame header. Everything runs on
+one host, so both clocks are the same. For detect_stream the capture time is
+when the frame was ingested from the upstream.
+
+    python -m benchmarks.stream_bench --targets rov,rov-async,camera --clients 1,10 \\
+        --duration 10 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import websockets
+
+from benchmarks.viewer_load import REPO_DIR, process_stats, wait_for_port
+from mjpeg import MJPEGParser
+from mux import FRAME_HEADER
+
+UPSTREAM_PORT = 5090
+
+
+def target_commands(args):
+    source = f'synthetic:{args.size}@{args.fps:g}'
+    py = sys.executable
+    detect = [py, 'detect_stream.py', '--stream', f'http://127.0.0.1:{UPSTREAM_PORT}/',
+              '--backend', args.backend, '--port', '8000']
+    if args.model:
+        detect += ['--model', args.model]
+    upstream = [py, 'synthetic_camera.py', '--port', str(UPSTREAM_PORT), '--size', args.size,
+                '--fps', str(args.fps)]
+    # name: (helper processes, server process, port, client kind, path)
+    return {
+        'rov': ([], [py, 'rov_server.py', '--source', source], 5000, 'mjpeg', '/camera/0?adaptive=0'),
+        'rov-async': ([], [py, 'rov_server.py', '--async', '--source', source], 5000, 'mjpeg',
+                      '/camera/0?adaptive=0'),
+        'camera': ([], [py, 'camera_server.py', '--source', source], 8765, 'ws',
+                   '/?format=binary&adaptive=0'),
+        'detect': ([upstream], detect, 8000, 'mjpeg', '/detection_feed'),
+        'detect-raw': ([upstream], detect, 8000, 'mjpeg', '/raw_feed?size=native'),
+    }
+
+
+class ClientStats:
+    def __init__(self):
+        self.frames = 0
+        self.first = None
+        self.last = None
+        self.latencies = []
+
+    def frame(self, capture_time):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.frames += 1
+        if capture_time is not None:
+            self.latencies.append(now - capture_time)
+
+    def fps(self):
+        if self.frames < 2:
+            return 0.0
+        return (self.frames - 1) / (self.last - self.first)
+
+
+async def mjpeg_client(port, path, stop_at, stats):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    await writer.drain()
+
+    parser = MJPEGParser()
+    try:
+        while time.time() < stop_at:
+            data = await asyncio.wait_for(reader.read(256 * 1024), stop_at - time.time())
+            if not data:
+                break
+            parser.append(data)
+            while parser.next_frame() is not None:
+                timestamp = parser.headers.get(b'x-timestamp')
+                stats.frame(float(timestamp) if timestamp else None)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+
+
+async def ws_client(port, path, stop_at, stats):
+    async with websockets.connect(f'ws://localhost:{port}{path}', max_size=None) as websocket:
+        try:
+            while time.time() < stop_at:
+                message = await asyncio.wait_for(websocket.recv(), stop_at - time.time())
+                # Text messages are sensor pushes
+                if isinstance(message, bytes):
+                    _, _, _, capture_us = FRAME_HEADER.unpack_from(message)
+                    stats.frame(capture_us / 1_000_000)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_clients(kind, port, path, count, duration):
+    client = mjpeg_client if kind == 'mjpeg' else ws_client
+    stats = [ClientStats() for _ in range(count)]
+    stop_at = time.time() + duration
+    await asyncio.gather(*(client(port, path, stop_at, s) for s in stats))
+    return stats
+
+
+def percentiles(values):
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    ms = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2), 'max': round(ms.max(), 2)}
+
+
+def run_target(name, spec, client_counts, duration, warmup, startup_timeout):
+    helpers, server_cmd, port, kind, path = spec
+    processes = [subprocess.Popen(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for cmd in helpers]
+    if helpers:
+        wait_for_port(UPSTREAM_PORT, startup_timeout)
+    server = subprocess.Popen(server_cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    processes.append(server)
+
+    rows = []
+    try:
+        wait_for_port(port, startup_timeout)
+        # Warm up until frames flow (model load, capture start) before measuring
+        deadline = time.time() + startup_timeout
+        while not asyncio.run(run_clients(kind, port, path, 1, warmup))[0].frames:
+            if time.time() > deadline:
+                raise RuntimeError(f"{name} produced no frames")
+
+        for count in client_counts:
+            cpu_before, _, _ = process_stats(server.pid)
+            started = time.time()
+            stats = asyncio.run(run_clients(kind, port, path, count, duration))
+            wall = time.time() - started
+            cpu_after, threads, rss = process_stats(server.pid)
+
+            fps = [s.fps() for s in stats]
+            latency = percentiles([v for s in stats for v in s.latencies])
+            row = {
+                'target': name,
+                'clients': count,
+                'fps_min': round(min(fps), 1),
+                'fps_mean': round(sum(fps) / len(fps), 1),
+                'fps_per_client': [round(v, 1) for v in fps],
+                'latency_ms': latency,
+                'server_cpu_pct': round(100 * (cpu_after - cpu_before) / wall, 1),
+                'server_threads': threads,
+                'server_rss_mb': round(rss / 1e6, 1),
+            }
+            rows.append(row)
+            print(f"{name:<11} {count:>7} {row['fps_min']:>8} {row['fps_mean']:>9} "
+                  f"{latency['p50'] or '-':>8} {latency['p95'] or '-':>8} {latency['p99'] or '-':>8} "
+                  f"{row['server_cpu_pct']:>7} {row['server_rss_mb']:>7}")
+    except RuntimeError as e:
+        print(f"{name:<11} skipped: {e}")
+        rows.append({'target': name, 'error': str(e)})
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+    return rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--targets', default='rov,rov-async,camera',
+                        help="comma separated: rov, rov-async, camera, detect, detect-raw")
+    parser.add_argument('--clients', default='1,10')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--size', default='640x480', help="synthetic camera WIDTHxHEIGHT")
+    parser.add_argument('--fps', type=float, default=30, help="synthetic camera frame rate")
+    parser.add_argument('--model', help="model for the detect targets")
+    parser.add_argument('--backend', default='keras', help="inference backend for the detect targets")
+    parser.add_argument('--output', help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    commands = target_commands(args)
+    targets = args.targets.split(',')
+    unknown = [t for t in targets if t not in commands]
+    if unknown:
+        parser.error(f"unknown targets: {', '.join(unknown)}")
+    client_counts = [int(v) for v in args.clients.split(',')]
+
+    print(f"{'target':<11} {'clients':>7} {'fps min':>8} {'fps mean':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cpu %':>7} {'rss MB':>7}")
+    rows = []
+    for name in targets:
+        rows.extend(run_target(name, commands[name], client_counts, args.duration,
+                               args.warmup, args.startup_timeout))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'revision': git_revision(),
+                    'python': platform.python_version(),
+                    'cpus': os.cpu_count(),
+                    'args': vars(args),
+                },
+                'results': rows,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Concurrent MJPEG viewer load test for rov_server, threaded vs async runtime.
+
+Starts rov_server in each mode against a local video file, opens N viewers
+on /camera/0 from a single asyncio client, and reports per-viewer frame
+rate together with the server's CPU time and thread count.
+
+    python -m benchmarks.viewer_load --viewers 1,10,40 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from mjpeg import MJPEGParser
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def write_test_video(path, size=(640, 360), fps=30, seconds=10):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    width, height = size
+    for i in range(fps * seconds):
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        frame[:, :, 0] = (np.arange(width) + i * 4) % 256
+        frame[:, :, 1] = (np.arange(height)[:, None] + i * 2) % 256
+        cv2.putText(frame, str(i), (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+
+
+def process_stats(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK
+    threads = rss = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+    return cpu, threads, rss
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not open port {port}")
+
+
+async def viewer(port, path, stop_at, results, index):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+    await writer.drain()
+
+    parser = MJPEGParser()
+    frames = 0
+    first = None
+    try:
+        while time.time() < stop_at:
+            data = await asyncio.wait_for(reader.read(256 * 1024), stop_at - time.time())
+            if not data:
+                break
+            count = len(parser.feed(data))
+            if count and first is None:
+                first = time.time()
+            frames += count
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+    elapsed = time.time() - (first or time.time())
+    results[index] = frames / elapsed if elapsed > 0 else 0.0
+
+
+async def run_viewers(port, path, count, duration):
+    results = [0.0] * count
+    stop_at = time.time() + duration
+    await asyncio.gather(*(viewer(port, path, stop_at, results, i) for i in range(count)))
+    return results
+
+
+def run_mode(mode, source, viewer_counts, duration, port=5000):
+    cmd = [sys.executable, 'rov_server.py', '--source', source]
+    if mode == 'async':
+        cmd.append('--async')
+    server = subprocess.Popen(cmd, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rows = []
+    try:
+        wait_for_port(port)
+        # Warm up the capture worker before measuring
+        asyncio.run(run_viewers(port, '/camera/0?adaptive=0', 1, 2))
+        for count in viewer_counts:
+            cpu_before, _, _ = process_stats(server.pid)
+            started = time.time()
+            fps = asyncio.run(run_viewers(port, '/camera/0?adaptive=0', count, duration))
+            wall = time.time() - started
+            cpu_after, threads, rss = process_stats(server.pid)
+            rows.append({
+                'mode': mode,
+                'viewers': count,
+                'fps_min': round(min(fps), 1),
+                'fps_mean': round(sum(fps) / len(fps), 1),
+                'server_cpu_pct': round(100 * (cpu_after - cpu_before) / wall, 1),
+                'server_threads': threads,
+                'server_rss_mb': round(rss / 1e6, 1),
+            })
+            print(f"{mode:<9} {count:>7} {rows[-1]['fps_min']:>8} {rows[-1]['fps_mean']:>9} "
+                  f"{rows[-1]['server_cpu_pct']:>7} {threads:>8} {rows[-1]['server_rss_mb']:>7}")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', default='1,10,40')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--modes', default='threaded,async')
+    parser.add_argument('--source', help='video file to stream (a synthetic one is generated by default)')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        source = os.path.join(tempfile.mkdtemp(), 'viewer_load.avi')
+        write_test_video(source)
+
+    viewer_counts = [int(v) for v in args.viewers.split(',')]
+    print(f"{'mode':<9} {'viewers':>7} {'fps min':>8} {'fps mean':>9} {'cpu %':>7} {'threads':>8} {'rss MB':>7}")
+    rows = []
+    for mode in args.modes.split(','):
+        rows.extend(run_mode(mode, source, viewer_counts, args.duration))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
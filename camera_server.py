@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import websockets
 import cv2
@@ -5,18 +6,177 @@ import base64
 import json
 import time
 import random
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import urlparse, parse_qs
+from frame_hub import FrameHub, EncodedFrame, EncodeCache
+from adaptive import AdaptiveController, encode_level
+from telemetry import TelemetryStore, TelemetryScheduler, parse_channel_rates, pack_batch, batch_format
+from synthetic_camera import open_capture
+from fmp4 import Fmp4Stream, ffmpeg_available
+from control_protocol import ControlConnection
+from mux import MuxConnection, CHANNEL_CONTROL, CHANNEL_TELEMETRY, CHANNEL_VIDEO, pack_frame
+import metrics
 
-# Function to generate mock sensor data
-def generate_mock_data():
+# ?format=binary frames are mux.FRAME_HEADER followed by the JPEG
+CAMERA_ID = 1
+
+# Quality steps for adaptive clients; the capture encode is already 320x240 at quality 70
+CAMERA_LADDER = [
+    (None, 1.0),
+    (55, 1.0),
+    (45, 0.75),
+    (35, 0.5),
+]
+
+def query_param(path, name, default):
+    query = parse_qs(urlparse(path or '').query)
+    return query.get(name, [default])[0]
+
+def negotiate_format(path):
+    # Clients opt into binary frames with ws://host:8765/?format=binary, or
+    # H.264 with ?format=fmp4; anything else keeps the legacy base64 JSON messages.
+    frame_format = query_param(path, 'format', 'json')
+    return frame_format if frame_format in ('binary', 'fmp4') else 'json'
+
+def adaptive_requested(path):
+    return query_param(path, 'adaptive', '1') not in ('0', 'false', 'off')
+
+# ?format=fmp4 sends a JSON {"type": "stream", "format": "fmp4", "mimeType": ...}
+# text message, then the MP4 init segment and one moof + mdat fragment per
+# frame as binary messages, ready to append to a MediaSource SourceBuffer.
+# Without ffmpeg the announcement says "format": "binary" and JPEG frames follow.
+FMP4_START_TIMEOUT = 5.0
+
+# Mock sensor reads, one per channel
+SENSOR_SOURCES = {
+    "depth": lambda: round(random.uniform(8.5, 10.5), 2),
+    "temperature": lambda: round(random.uniform(20.0, 25.0), 1),
+    "pressure": lambda: round(random.uniform(1010.0, 1015.0), 2),
+    "battery": lambda: random.randint(80, 100),
+}
+
+# Sampling rate of each channel in Hz; subscribers may ask for less
+TELEMETRY_RATES = {
+    "depth": 10.0,
+    "temperature": 1.0,
+    "pressure": 2.0,
+    "battery": 0.2,
+}
+TELEMETRY_CHANNELS = list(SENSOR_SOURCES)
+
+# Sensor history kept for the whole dive in fixed memory
+telemetry = TelemetryStore(TELEMETRY_CHANNELS)
+scheduler = TelemetryScheduler(telemetry, SENSOR_SOURCES, TELEMETRY_RATES)
+
+# Telemetry subscriptions live on their own socket, away from video frames:
+#   ws://host:8765/ws/telemetry?channels=depth:5,battery&format=msgpack&batch=0.25
+# Batches arrive every `batch` seconds as one message (see telemetry.pack_batch),
+# binary when msgpack is requested and installed, JSON text otherwise.
+TELEMETRY_WS_PATH = '/ws/telemetry'
+DEFAULT_BATCH_INTERVAL = 0.25
+MIN_BATCH_INTERVAL = 0.05
+# Video sockets still get a snapshot of every channel, on their own cadence
+SENSOR_SNAPSHOT_INTERVAL = 1.0
+
+# Control, telemetry and video on one socket, scheduled by priority (see mux.py):
+#   ws://host:8765/mux?channels=depth:5,battery&format=msgpack&batch=0.25&video=1
+# The telemetry channel takes the same subscribe and history requests as
+# /ws/telemetry; the control channel takes rov_server's gamepad messages.
+MUX_WS_PATH = '/mux'
+
+telemetry_bytes_total = metrics.registry.counter(
+    'aura_telemetry_bytes_total', 'Telemetry batch bytes sent to subscribers.', ['format'])
+
+def batch_interval(value):
+    return max(MIN_BATCH_INTERVAL, float(value))
+
+def subscription_status(subscription):
     return {
-        "depth": round(random.uniform(8.5, 10.5), 2),
-        "temperature": round(random.uniform(20.0, 25.0), 1),
-        "pressure": round(random.uniform(1010.0, 1015.0), 2),
-        "battery": random.randint(80, 100)
+        "type": "subscribed",
+        "channels": subscription.rates,
+        "format": subscription.format,
+        "batch": subscription.batch_interval,
     }
 
+def query_history(channel, start=None, end=None, points=500):
+    # Raises KeyError for unknown channels and ValueError for bad numbers
+    return telemetry.query(
+        channel,
+        None if start in (None, '') else float(start),
+        None if end in (None, '') else float(end),
+        int(points))
+
+def json_response(status, payload):
+    return (
+        status,
+        [("Content-Type", "application/json"), ("Access-Control-Allow-Origin", "*")],
+        json.dumps(payload).encode('utf-8'),
+    )
+
+def telemetry_http_response(url):
+    # GET /telemetry lists channels; GET /telemetry/<channel>?start=&end=&points=
+    # returns min/max/mean windows with timestamps in seconds since the epoch
+    channel = url.path[len('/telemetry'):].strip('/')
+    if not channel:
+        return json_response(HTTPStatus.OK, telemetry.describe())
+
+    query = {k: v[0] for k, v in parse_qs(url.query).items()}
+    try:
+        return json_response(HTTPStatus.OK, query_history(
+            channel, query.get('start'), query.get('end'), query.get('points', 500)))
+    except KeyError:
+        return json_response(HTTPStatus.NOT_FOUND, {"error": f"Unknown channel {channel}"})
+    except ValueError as e:
+        return json_response(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+
+async def handle_client_request(message, send, subscription=None):
+    # Clients may ask for history on the same socket:
+    # {"type": "history", "channel": "depth", "start": ..., "end": ..., "points": ...}
+    # and telemetry subscribers may change channels, rates or batching:
+    # {"type": "subscribe", "channels": {"depth": 5}, "batch": 0.5}
+    if not isinstance(message, str):
+        return
+    try:
+        request = json.loads(message)
+    except ValueError:
+        return
+    if not isinstance(request, dict):
+        return
+    if request.get('type') == 'subscribe' and subscription is not None:
+        try:
+            rates = parse_channel_rates(request.get('channels'), scheduler.rates)
+            interval = batch_interval(request.get('batch', subscription.batch_interval))
+        except (ValueError, TypeError) as e:
+            await send(json.dumps({"type": "error", "error": str(e)}))
+            return
+        subscription.rates, subscription.batch_interval = rates, interval
+        await send(json.dumps(subscription_status(subscription)))
+        return
+    if request.get('type') != 'history':
+        return
+
+    try:
+        result = query_history(request.get('channel'), request.get('start'),
+                               request.get('end'), request.get('points', 500))
+        reply = {"type": "history", "id": request.get('id'), **result}
+    except (KeyError, ValueError, TypeError) as e:
+        reply = {"type": "history", "id": request.get('id'), "error": str(e)}
+    await send(json.dumps(reply))
+
+async def handle_client_messages(websocket, subscription=None):
+    async for message in websocket:
+        await handle_client_request(message, websocket.send, subscription)
+
 # Custom CORS handler
 async def process_request(path, request_headers):
+    url = urlparse(path)
+    if url.path.startswith('/telemetry'):
+        return telemetry_http_response(url)
+    if url.path == '/metrics':
+        return (HTTPStatus.OK, [("Content-Type", metrics.CONTENT_TYPE)],
+                metrics.registry.render().encode('utf-8'))
+
     # Allow requests from any origin (replace "*" with specific domain if needed)
     origin = request_headers.get("Origin")
     if origin:
@@ -26,55 +186,331 @@ async def process_request(path, request_headers):
         )
     return None  # Proceed with the WebSocket handshake
 
-async def send_data(websocket, path):
-    cap = cv2.VideoCapture(0)
-    
-    # Set lower resolution for faster processing
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-    
-    # Increase FPS
-    cap.set(cv2.CAP_PROP_FPS, 30)
+# Capture shared by every connection; each frame is read and encoded once
+class CameraBroadcaster:
+    def __init__(self, device=0, size=(320, 240), quality=70, fps=30, h264_bitrate='500k'):
+        self.device = device
+        self.size = size
+        self.quality = quality
+        self.frame_interval = 1.0 / fps
+        self.h264_bitrate = h264_bitrate
+        self.hub = FrameHub()
+        self.encode_cache = EncodeCache(keep_sequences=4)
+        self.clients = 0
+        self._task = None
+        # One H.264 encode shared by the fMP4 viewers, running while there are any
+        self.fmp4_stream = None
+        self.fmp4_viewers = 0
+        # Held while a stream starts, so no viewer joins one that may still fail
+        self._fmp4_lock = asyncio.Lock()
 
-    try:
-        last_frame_time = time.time()
-        while True:
-            try:
-                # Limit frame rate to reduce lag
-                current_time = time.time()
-                if current_time - last_frame_time < 1/30:  # Aim for 30 FPS
-                    await asyncio.sleep(0.01)
-                    continue
+    def attach(self):
+        self.clients += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._capture_loop())
+
+    def detach(self):
+        self.clients -= 1
+
+    def _open(self):
+        cap = open_capture(self.device)
+        
+        # Set lower resolution for faster processing
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        
+        # Increase FPS
+        cap.set(cv2.CAP_PROP_FPS, 30)
+        return cap
 
-                ret, frame = cap.read()
-                if not ret:
+    def _read_and_encode(self, cap):
+        with metrics.stage_seconds.time(stage='capture'):
+            ret, frame = cap.read()
+        capture_time = time.time()
+        if not ret:
+            return None
+
+        # Resize frame for faster processing and transmission
+        with metrics.stage_seconds.time(stage='resize'):
+            frame = cv2.resize(frame, self.size)
+
+        # Encode frame as JPEG with lower quality for faster transmission
+        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        with metrics.stage_seconds.time(stage='encode'):
+            _, buffer = cv2.imencode('.jpg', frame, encode_param)
+        return EncodedFrame(buffer.tobytes(), frame, capture_time)
+
+    async def _capture_loop(self):
+        loop = asyncio.get_running_loop()
+        cap = await loop.run_in_executor(None, self._open)
+        try:
+            next_frame_time = loop.time()
+            while self.clients > 0:
+                # Blocking capture and encode run off the event loop
+                frame = await loop.run_in_executor(None, self._read_and_encode, cap)
+                if frame is None:
                     print("Failed to capture frame")
+                    metrics.frames_dropped_total.inc(stream='camera1', reason='capture')
                     await asyncio.sleep(0.1)
                     continue
+                self.hub.publish(frame, frame.timestamp)
+                metrics.frames_total.inc(stream='camera1', event='captured')
+                if self.fmp4_stream is not None:
+                    self.fmp4_stream.write(frame.image)
+
+                # Limit frame rate to reduce lag
+                next_frame_time = max(next_frame_time + self.frame_interval, loop.time())
+                await asyncio.sleep(next_frame_time - loop.time())
+        finally:
+            cap.release()
+
+    async def open_fmp4(self):
+        """Join the shared H.264 encode, starting it if needed; None if ffmpeg is missing or fails.
+
+        A viewer that got a stream must hand it back with release_fmp4(stream).
+        """
+        async with self._fmp4_lock:
+            stream = self.fmp4_stream
+            if stream is None or not stream.running:
+                if not ffmpeg_available():
+                    return None
+                # Viewers of a stream that died release it themselves
+                stream = Fmp4Stream(self.size, 1.0 / self.frame_interval, self.h264_bitrate, name='camera1').start()
+                self.fmp4_stream, self.fmp4_viewers = stream, 0
+                ready = False
+                try:
+                    # The init segment only appears once ffmpeg has been fed a frame
+                    ready = await asyncio.get_running_loop().run_in_executor(
+                        None, stream.wait_ready, FMP4_START_TIMEOUT)
+                finally:
+                    if not ready:
+                        self.fmp4_stream = None
+                        stream.close()
+                if not ready:
+                    return None
+            self.fmp4_viewers += 1
+            return stream
+
+    def release_fmp4(self, stream):
+        if stream is not self.fmp4_stream:
+            stream.close()
+            return
+        self.fmp4_viewers -= 1
+        if self.fmp4_viewers == 0:
+            self.fmp4_stream = None
+            stream.close()
+
+    def jpeg_for(self, seq, frame, controller):
+        if controller is None:
+            return frame.jpeg
+        quality, scale = controller.params
 
-                # Resize frame for faster processing and transmission
-                frame = cv2.resize(frame, (320, 240))
+        def encode():
+            with metrics.stage_seconds.time(stage='adaptive_encode'):
+                return encode_level(frame.image, frame.jpeg, quality, scale)
+        return self.encode_cache.get(seq, controller.level, encode)
 
-                # Encode frame as JPEG with lower quality for faster transmission
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 70]
-                _, buffer = cv2.imencode('.jpg', frame, encode_param)
-                jpg_as_text = base64.b64encode(buffer).decode('utf-8')
+    def message_for(self, seq, frame, frame_format, controller):
+        # Built once per frame and quality step, then shared by every client at that step
+        jpeg = self.jpeg_for(seq, frame, controller)
+        if frame_format == 'binary':
+            return pack_frame(jpeg, seq, frame.timestamp, CAMERA_ID)
 
-                await websocket.send(json.dumps({
+        def encode():
+            with metrics.stage_seconds.time(stage='json_encode'):
+                return json.dumps({
                     "type": "camera",
                     "camera": "camera1",
-                    "frame": jpg_as_text
-                }))
+                    "frame": base64.b64encode(jpeg).decode('utf-8')
+                })
+        level = controller.level if controller is not None else 0
+        return self.encode_cache.get(seq, ('json', level), encode)
 
-                # Send sensor data less frequently
-                if int(current_time) % 5 == 0:  # Every 5 seconds
-                    mock_data = generate_mock_data()
-                    await websocket.send(json.dumps({
-                        "type": "sensor",
-                        "data": mock_data
-                    }))
+camera = CameraBroadcaster()
 
-                last_frame_time = current_time
+def subscribe_from_query(path):
+    # Raises ValueError for unknown channels or bad rates
+    return scheduler.subscribe(
+        query_param(path, 'channels', ''),
+        batch_interval(query_param(path, 'batch', DEFAULT_BATCH_INTERVAL)),
+        batch_format(query_param(path, 'format', 'json')))
+
+async def telemetry_batches(subscription):
+    # Packed batches every batch interval, skipping intervals with no samples
+    loop = asyncio.get_running_loop()
+    next_batch = loop.time()
+    while True:
+        next_batch = max(next_batch + subscription.batch_interval, loop.time())
+        await asyncio.sleep(next_batch - loop.time())
+        batch = subscription.take()
+        if not batch:
+            continue
+        message = pack_batch(batch, subscription.format)
+        telemetry_bytes_total.inc(len(message), format=subscription.format)
+        yield message
+
+async def telemetry_stream(websocket, path):
+    try:
+        subscription = subscribe_from_query(path)
+    except ValueError as e:
+        await websocket.close(1008, str(e))
+        return
+    metrics.clients.inc(endpoint='ws/telemetry')
+    receiver = asyncio.ensure_future(handle_client_messages(websocket, subscription))
+    try:
+        await websocket.send(json.dumps(subscription_status(subscription)))
+        async for message in telemetry_batches(subscription):
+            await websocket.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        receiver.cancel()
+        scheduler.unsubscribe(subscription)
+        metrics.clients.dec(endpoint='ws/telemetry')
+
+async def mux_stream(websocket, path):
+    try:
+        subscription = subscribe_from_query(path)
+    except ValueError as e:
+        await websocket.close(1008, str(e))
+        return
+    connection = MuxConnection(websocket)
+    control = ControlConnection(websocket, reply=partial(connection.sender.send, CHANNEL_CONTROL))
+    connection.on(CHANNEL_CONTROL, control.receive)
+    telemetry_reply = partial(connection.sender.send, CHANNEL_TELEMETRY)
+    connection.on(CHANNEL_TELEMETRY, partial(handle_client_request, send=telemetry_reply, subscription=subscription))
+
+    async def apply_control(sender):
+        await control.apply_loop()
+
+    async def send_telemetry(sender):
+        sender.put(CHANNEL_TELEMETRY, json.dumps(subscription_status(subscription)))
+        async for message in telemetry_batches(subscription):
+            sender.put(CHANNEL_TELEMETRY, message)
+
+    async def send_video(sender):
+        # Offers every new frame; the sender drops any it cannot start in time
+        last_seq = 0
+        while True:
+            seq, frame = await camera.hub.wait_async(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            last_seq = seq
+            sender.put(CHANNEL_VIDEO, camera.message_for(seq, frame, 'binary', None))
+
+    connection.produce(apply_control)
+    connection.produce(send_telemetry)
+    video = query_param(path, 'video', '1') not in ('0', 'false', 'off')
+    if video:
+        camera.attach()
+        connection.produce(send_video)
+    metrics.clients.inc(endpoint='ws/mux')
+    try:
+        await connection.serve()
+    finally:
+        if video:
+            camera.detach()
+        scheduler.unsubscribe(subscription)
+        metrics.clients.dec(endpoint='ws/mux')
+        sent, dropped = connection.sender.sent, connection.sender.dropped
+        print(f"Mux client disconnected: sent {sent}, dropped {dropped}")
+
+async def push_sensor_snapshots(websocket):
+    # Runs beside the frame loop so a snapshot never waits for, or holds up, a frame
+    try:
+        while True:
+            await asyncio.sleep(SENSOR_SNAPSHOT_INTERVAL)
+            await websocket.send(json.dumps({
+                "type": "sensor",
+                "data": telemetry.latest()
+            }))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+def sensor_snapshots_for(websocket, path):
+    # ?sensors=0 leaves telemetry to a /ws/telemetry subscription
+    if query_param(path, 'sensors', '1') in ('0', 'false', 'off'):
+        return None
+    return asyncio.ensure_future(push_sensor_snapshots(websocket))
+
+async def send_fmp4(websocket, path):
+    # Returns False, having sent nothing, when there is no H.264 encode to join
+    camera.attach()
+    stream = await camera.open_fmp4()
+    if stream is None:
+        camera.detach()
+        return False
+    metrics.clients.inc(endpoint='ws/fmp4')
+    receiver = asyncio.ensure_future(handle_client_messages(websocket))
+    snapshots = sensor_snapshots_for(websocket, path)
+    try:
+        await websocket.send(json.dumps(stream.announcement()))
+        await websocket.send(stream.init)
+        # Fragments that pile up while a send drains are skipped up to the next keyframe
+        async for fragment in stream.fragments_async():
+            await websocket.send(fragment)
+            metrics.frames_total.inc(stream='camera1', event='sent')
+    except websockets.exceptions.ConnectionClosed:
+        print("Client disconnected. Waiting for new connection.")
+    finally:
+        receiver.cancel()
+        if snapshots is not None:
+            snapshots.cancel()
+        camera.release_fmp4(stream)
+        camera.detach()
+        metrics.clients.dec(endpoint='ws/fmp4')
+    return True
+
+async def send_data(websocket, path):
+    if urlparse(path or '').path == TELEMETRY_WS_PATH:
+        await telemetry_stream(websocket, path)
+        return
+    if urlparse(path or '').path == MUX_WS_PATH:
+        await mux_stream(websocket, path)
+        return
+    frame_format = negotiate_format(path)
+    if frame_format == 'fmp4':
+        if await send_fmp4(websocket, path):
+            return
+        # MJPEG stays the fallback: say so, then send binary JPEG frames
+        frame_format = 'binary'
+        print("H.264 unavailable, falling back to JPEG frames")
+        await websocket.send(json.dumps({"type": "stream", "format": frame_format, "requested": "fmp4"}))
+    controller = AdaptiveController(ladder=CAMERA_LADDER) if adaptive_requested(path) else None
+    loop = asyncio.get_running_loop()
+    camera.attach()
+    metrics.clients.inc(endpoint=f'ws/{frame_format}')
+    receiver = asyncio.ensure_future(handle_client_messages(websocket))
+    snapshots = sensor_snapshots_for(websocket, path)
+
+    try:
+        last_seq = 0
+        while True:
+            try:
+                # The hub is this client's one-slot outbox: whatever was published
+                # while the previous send drained is replaced by the newest frame
+                seq, frame = await camera.hub.wait_async(last_seq, timeout=1.0)
+                if frame is None:
+                    continue
+                if last_seq and seq - last_seq > 1:
+                    if controller is not None:
+                        controller.record_drops(seq - last_seq - 1)
+                    metrics.frames_dropped_total.inc(seq - last_seq - 1, stream='camera1', reason='superseded')
+                last_seq = seq
+
+                message = camera.message_for(seq, frame, frame_format, controller)
+                send_start = loop.time()
+                await websocket.send(message)
+                metrics.stage_seconds.observe(loop.time() - send_start, stage='send')
+                metrics.frames_total.inc(stream='camera1', event='sent')
+
+                if controller is not None:
+                    transport = getattr(websocket, 'transport', None)
+                    backlog = transport.get_write_buffer_size() if transport else 0
+                    controller.record_send(loop.time() - send_start, len(message), backlog)
+
+                if controller is not None:
+                    await asyncio.sleep(send_start + controller.frame_interval - loop.time())
 
             except websockets.exceptions.ConnectionClosed:
                 print("Client disconnected. Waiting for new connection.")
@@ -84,17 +520,35 @@ async def send_data(websocket, path):
                 await asyncio.sleep(0.1)
 
     finally:
-        cap.release()
+        receiver.cancel()
+        if snapshots is not None:
+            snapshots.cancel()
+        camera.detach()
+        metrics.clients.dec(endpoint=f'ws/{frame_format}')
 
-async def main():
+async def main(port=8765):
+    asyncio.ensure_future(scheduler.run())
     server = await websockets.serve(
         send_data, 
         "localhost", 
-        8765, 
+        port, 
         process_request=process_request  # Add the custom CORS handler
     )
     print("Server started. Waiting for connections...")
     await server.wait_closed()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Camera and sensor WebSocket server")
+    parser.add_argument('--source', default='0',
+                        help="camera device index, video file or synthetic[:WxH][@FPS]")
+    parser.add_argument('--h264-bitrate', default=camera.h264_bitrate,
+                        help="target bitrate of the ?format=fmp4 H.264 stream, e.g. 500k or 2M")
+    parser.add_argument('--port', type=int, default=8765,
+                        help="WebSocket port; rov_server's control socket also defaults to 8765")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    camera.device = int(args.source) if args.source.isdigit() else args.source
+    camera.h264_bitrate = args.h264_bitrate
+    asyncio.run(main(args.port))
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import struct
+import time
+
+import numpy as np
+import websockets
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Binary gamepad packet, big-endian:
+#   type (uint8, 0x10), flags (uint8), sequence (uint32),
+#   client timestamp in ms (float64), axis count (uint8), button count (uint8)
+# followed by one int16 per axis (value * 32767) and one uint8 per button
+# (value * 255). Acks echo the sequence and client timestamp:
+#   type (uint8, 0x11), flags (uint8: 1 = axes changed, 2 = buttons changed),
+#   sequence (uint32), client timestamp in ms (float64),
+#   server processing time in ms (float32), commands coalesced (uint16)
+GAMEPAD_HEADER = struct.Struct('!BBIdBB')
+ACK_PACKET = struct.Struct('!BBIdfH')
+MSG_GAMEPAD = 0x10
+MSG_ACK = 0x11
+
+ACK_AXES_CHANGED = 1
+ACK_BUTTONS_CHANGED = 2
+
+AXIS_SCALE = 32767.0
+BUTTON_SCALE = 255.0
+
+
+class GamepadCommand:
+    __slots__ = ('axes', 'buttons', 'seq', 'client_time', 'received', 'binary')
+
+    def __init__(self, axes, buttons, seq=None, client_time=None, binary=False):
+        self.axes = axes
+        self.buttons = buttons
+        self.seq = seq
+        self.client_time = client_time
+        self.received = time.perf_counter()
+        self.binary = binary
+
+
+def pack_gamepad(axes, buttons, seq=0, client_time=None):
+    axes = np.clip(np.asarray(axes, dtype=np.float32), -1.0, 1.0)
+    buttons = np.clip(np.asarray(buttons, dtype=np.float32), 0.0, 1.0)
+    header = GAMEPAD_HEADER.pack(MSG_GAMEPAD, 0, seq & 0xFFFFFFFF,
+                                 time.time() * 1000 if client_time is None else client_time,
+                                 len(axes), len(buttons))
+    return (header
+            + np.round(axes * AXIS_SCALE).astype('>i2').tobytes()
+            + np.round(buttons * BUTTON_SCALE).astype('u1').tobytes())
+
+
+def unpack_gamepad(packet):
+    msg_type, _, seq, client_time, n_axes, n_buttons = GAMEPAD_HEADER.unpack_from(packet)
+    if msg_type != MSG_GAMEPAD:
+        raise ValueError(f"Unexpected control packet type {msg_type:#x}")
+    offset = GAMEPAD_HEADER.size
+    axes = np.frombuffer(packet, dtype='>i2', count=n_axes, offset=offset) / AXIS_SCALE
+    buttons = np.frombuffer(packet, dtype='u1', count=n_buttons, offset=offset + 2 * n_axes) / BUTTON_SCALE
+    return GamepadCommand(axes, buttons, seq, client_time, binary=True)
+
+
+def parse_message(message):
+    """Return a GamepadCommand for gamepad input, or the decoded JSON dict otherwise.
+
+    Raises ValueError for anything else, including JSON that is not an object.
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return unpack_gamepad(message)
+
+    data = json.loads(message)
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+    if 'axes' in data or 'buttons' in data:
+        try:
+            axes = np.asarray(data.get('axes', []), dtype=np.float64).ravel()
+            buttons = np.asarray(data.get('buttons', []), dtype=np.float64).ravel()
+        except TypeError as e:
+            raise ValueError(f"Bad gamepad values: {e}")
+        return GamepadCommand(axes, buttons, data.get('seq'), data.get('t'))
+    return data
+
+
+class ControlSession:
+    """Gamepad state for one connection, compared with whole-array operations."""
+
+    def __init__(self, deadband=0.1, change_threshold=0.1):
+        self.deadband = deadband
+        self.change_threshold = change_threshold
+        self.axes = None
+        self.buttons = None
+        self.applied = 0
+        self.coalesced = 0
+
+    def apply(self, command):
+        # Zero out stick noise inside the deadband before comparing
+        axes = np.where(np.abs(command.axes) < self.deadband, 0.0, command.axes)
+        buttons = command.buttons
+
+        changed_axes = self._changed(self.axes, axes, self.change_threshold)
+        changed_buttons = self._changed(self.buttons, buttons, 0.0)
+        if changed_axes.any():
+            logger.debug("Axes changed: %s", {int(i): round(float(axes[i]), 2)
+                                               for i in np.flatnonzero(changed_axes)})
+        if changed_buttons.any():
+            pressed = np.flatnonzero(changed_buttons & (buttons > 0))
+            if pressed.size:
+                logger.debug("Buttons pressed: %s", pressed.tolist())
+
+        self.axes = axes
+        self.buttons = buttons
+        self.applied += 1
+        return bool(changed_axes.any()), bool((changed_buttons & (buttons > 0)).any())
+
+    @staticmethod
+    def _changed(previous, current, threshold):
+        if previous is None or previous.shape != current.shape:
+            previous = np.zeros_like(current)
+        return np.abs(current - previous) > threshold
+
+
+def ack_for(command, changed_axes, changed_buttons, coalesced):
+    processing_ms = (time.perf_counter() - command.received) * 1000
+    if command.binary:
+        flags = (ACK_AXES_CHANGED if changed_axes else 0) | (ACK_BUTTONS_CHANGED if changed_buttons else 0)
+        return ACK_PACKET.pack(MSG_ACK, flags, command.seq & 0xFFFFFFFF, command.client_time,
+                               processing_ms, min(coalesced, 0xFFFF))
+
+    ack = {"status": "success", "message": "Input received"}
+    if command.seq is not None or command.client_time is not None:
+        ack.update({
+            "seq": command.seq,
+            "t": command.client_time,
+            "server_time": time.time() * 1000,
+            "processing_ms": round(processing_ms, 3),
+            "coalesced": coalesced,
+        })
+    return json.dumps(ack)
+
+
+control_messages_total = metrics.registry.counter(
+    'aura_control_messages_total', 'Control WebSocket messages received.', ['kind'])
+control_coalesced_total = metrics.registry.counter(
+    'aura_control_coalesced_total', 'Gamepad commands replaced by a newer one before being applied.')
+
+# WebSocket handler with connection-scoped change tracking. Gamepad input is
+# coalesced: the receiver keeps only the newest pending command and the
+# applier processes it, so a slow tick never builds a queue of stale input.
+# Replies go through `reply`, the socket's send unless the connection is a
+# channel of a multiplexed socket.
+class ControlConnection:
+    def __init__(self, websocket, reply=None):
+        self.websocket = websocket
+        self.reply = reply or websocket.send
+        self.session = ControlSession()
+        self.pending = None
+        self.pending_count = 0
+        self.ready = asyncio.Event()
+
+    async def receive(self, message):
+        try:
+            data = parse_message(message)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Ignoring malformed control message: {e}")
+            control_messages_total.inc(kind='malformed')
+            return
+
+        # Process gamepad-related messages
+        if isinstance(data, GamepadCommand):
+            control_messages_total.inc(kind='gamepad')
+            self.submit(data)
+        else:
+            control_messages_total.inc(kind='settings')
+            await self.handle_settings(data)
+
+    def submit(self, command):
+        self.pending = command
+        self.pending_count += 1
+        self.ready.set()
+
+    async def apply_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            command, self.pending = self.pending, None
+            coalesced, self.pending_count = self.pending_count - 1, 0
+            if command is None:
+                continue
+            self.session.coalesced += coalesced
+            if coalesced:
+                control_coalesced_total.inc(coalesced)
+
+            with metrics.stage_seconds.time(stage='control_apply'):
+                changed_axes, changed_buttons = self.session.apply(command)
+            # Timestamped clients are acked every time so they can measure
+            # round trips; legacy clients only hear about changes
+            timestamped = command.binary or command.seq is not None or command.client_time is not None
+            if timestamped or changed_axes or changed_buttons:
+                try:
+                    await self.reply(ack_for(command, changed_axes, changed_buttons, coalesced))
+                except websockets.exceptions.ConnectionClosed:
+                    return
+
+    async def handle_settings(self, data):
+        # Process advanced controller updates
+        if data.get('command') == 'update':
+            changed_advanced_settings = False
+            
+            # Remove 'command' from the data to process other settings
+            data.pop('command', None)
+            
+            # Print out each advanced controller setting update
+            for key, value in data.items():
+                print(f"Advanced Controller - {key}: {value}")
+                changed_advanced_settings = True
+            
+            # Send acknowledgment for advanced controller updates
+            if changed_advanced_settings:
+                await self.reply(json.dumps({"status": "success", "message": "Advanced settings received"}))
@@ -1,18 +1,41 @@
-from flask import Flask, Response, render_template_string, jsonify
+import time
+# Startup phases are logged relative to the start of module import
+_startup = time.perf_counter()
+
+import argparse
+from flask import Flask, Response, render_template_string, jsonify, request
 import cv2
 import numpy as np
-from tensorflow.keras.models import load_model
 import requests
+import threading
 from threading import Thread
 import numpy as np
 from flask_cors import CORS
-import time
 import logging
+from collections import namedtuple
+from frame_hub import FrameHub, EncodedFrame, EncodeCache
+from mjpeg import part, boundary_from_content_type, iter_frames
+from frame_bus import FrameBusReader
+from recorder import Recorder, register_playback_routes
+from urllib.parse import urlparse, parse_qs
+from inference_backends import BACKENDS, DEFAULT_MODELS, load_backend, preprocess, preprocess_batch
+import tiling
+import metrics
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def startup_elapsed():
+    return time.perf_counter() - _startup
+
+logger.info(f"Startup: modules imported in {startup_elapsed():.2f}s")
+
+# Tiled warm-up sizes its batches from each stream's first frame; streams
+# with no frame by then are assumed to be VGA
+WARMUP_FRAME_TIMEOUT = 10.0
+DEFAULT_FRAME_SHAPE = (480, 640)
+
 # HTML template remains the same as before
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -70,22 +93,103 @@ HTML_TEMPLATE = '''
 app = Flask(__name__)
 CORS(app)
 
-class StreamDetector:
-    def __init__(self, stream_url, model_path, input_size=(128, 128), retry_interval=5):
+# Published once per inferred frame and shared read-only by every feed client;
+# heatmap is the low resolution tile probability map in tiled mode, else None,
+# and timestamp is the capture time of the frame it was inferred from
+DetectionResult = namedtuple('DetectionResult', ['frame', 'jpeg', 'stats', 'heatmap', 'timestamp'])
+
+# Raw feed resolution unless the client asks for ?size=native or ?size=WxH
+DEFAULT_RAW_SIZE = (800, 450)
+
+EMPTY_STATS = {
+    'confidence': 0,
+    'crack_detected': False,
+    'crack_count': 0,
+    'largest_crack': 0,
+    'avg_width': 0,
+    'positive_tiles': 0
+}
+
+class SceneGate:
+    """Decides whether a frame differs enough from the last inferred one.
+
+    Frames are compared as small grayscale thumbnails by mean absolute
+    difference (0-255). The reference only moves when inference runs, so slow
+    drift still accumulates into a refresh, and refresh_interval forces one
+    regardless. A threshold of 0 disables gating.
+    """
+
+    def __init__(self, threshold=3.0, refresh_interval=2.0, thumbnail_size=(64, 36)):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.thumbnail_size = thumbnail_size
+        self._reference = None
+        self._last_inference = 0
+        self.inferred = 0
+        self.skipped = 0
+        self.forced = 0
+        self.last_difference = None
+
+    def thumbnail(self, frame):
+        small = cv2.resize(frame, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def should_infer(self, frame, now=None):
+        now = time.time() if now is None else now
+        if self.threshold <= 0:
+            self.inferred += 1
+            return True
+
+        thumb = self.thumbnail(frame)
+        if self._reference is not None and self._reference.shape == thumb.shape:
+            self.last_difference = float(np.abs(thumb - self._reference).mean())
+            if self.last_difference < self.threshold:
+                if now - self._last_inference < self.refresh_interval:
+                    self.skipped += 1
+                    return False
+                self.forced += 1
+
+        self._reference = thumb
+        self._last_inference = now
+        self.inferred += 1
+        return True
+
+    def stats(self):
+        total = self.inferred + self.skipped
+        return {
+            'inferred': self.inferred,
+            'skipped': self.skipped,
+            'forced_refresh': self.forced,
+            'skip_ratio': round(self.skipped / total, 3) if total else 0.0,
+            'last_difference': None if self.last_difference is None else round(self.last_difference, 2)
+        }
+
+
+class StreamFeed:
+    """One upstream stream and the results published for it.
+
+    `stream_url` is an MJPEG URL, or shm://<name> to attach to a local
+    frame_bus; shm://<name>?fallback=<MJPEG URL> reads the MJPEG stream while
+    no bus with that name exists.
+    """
+
+    def __init__(self, stream_url, retry_interval=5, condition=None, gate=None, name=None):
         self.stream_url = stream_url
-        self.model = load_model(model_path)
-        self.input_size = input_size
-        self.bytes = bytes()
-        self.frame = None
-        self.current_confidence = 0
-        self.crack_detected = False
-        self.crack_count = 0
-        self.largest_crack = 0
-        self.avg_width = 0
+        self.name = name or stream_url
+        self.bus_name, self.fallback_url = None, None
+        url = urlparse(stream_url)
+        if url.scheme == 'shm':
+            self.bus_name = url.netloc + url.path.rstrip('/')
+            self.fallback_url = parse_qs(url.query).get('fallback', [None])[0]
+        self.gate = gate or SceneGate()
+        self.frames = FrameHub(condition)
+        self.results = FrameHub()
+        self.encode_cache = EncodeCache()
+        self._placeholder = None
         self.retry_interval = retry_interval
         self.is_connected = False
         self.session = requests.Session()
-        
+
         # Start frame capturing thread
         self.thread = Thread(target=self._capture_stream_with_retry, daemon=True)
         self.thread.start()
@@ -93,36 +197,18 @@ class StreamDetector:
     def _capture_stream_with_retry(self):
         while True:
             try:
-                logger.info("Attempting to connect to stream...")
-                response = self.session.get(self.stream_url, stream=True, timeout=10)
-                
-                if response.status_code == 200:
-                    logger.info("Successfully connected to stream")
-                    self.is_connected = True
-                    
-                    # Process the stream
-                    bytes_buffer = bytes()
-                    for chunk in response.iter_content(chunk_size=1024):
-                        bytes_buffer += chunk
-                        a = bytes_buffer.find(b'\xff\xd8')
-                        b = bytes_buffer.find(b'\xff\xd9')
-                        
-                        if a != -1 and b != -1:
-                            jpg = bytes_buffer[a:b+2]
-                            bytes_buffer = bytes_buffer[b+2:]
-                            
-                            # Decode the frame
-                            frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                            if frame is not None:
-                                self.frame = frame
-                                self.bytes = bytes_buffer
-                            else:
-                                logger.warning("Failed to decode frame")
-                                self.is_connected = False
-                                break
+                if self.bus_name is None:
+                    self._read_mjpeg(self.stream_url)
                 else:
-                    logger.warning(f"Stream returned status code: {response.status_code}")
-                    self.is_connected = False
+                    try:
+                        self._read_frame_bus(self.bus_name)
+                    except FileNotFoundError:
+                        if self.fallback_url:
+                            logger.info(f"No frame bus {self.bus_name}, using {self.fallback_url}")
+                            self._read_mjpeg(self.fallback_url)
+                        else:
+                            logger.warning(f"No frame bus {self.bus_name}")
+                            self.is_connected = False
                     
             except Exception as e:
                 logger.error(f"Stream connection error: {str(e)}")
@@ -132,138 +218,500 @@ class StreamDetector:
                 logger.info(f"Retrying in {self.retry_interval} seconds...")
                 time.sleep(self.retry_interval)
 
+    def _read_mjpeg(self, url):
+        logger.info(f"Attempting to connect to stream {url}...")
+        response = self.session.get(url, stream=True, timeout=10)
+        
+        if response.status_code == 200:
+            logger.info(f"Successfully connected to stream {url}")
+            self.is_connected = True
+            
+            # Process the stream
+            boundary = boundary_from_content_type(response.headers.get('Content-Type'))
+            ingest_start = time.perf_counter()
+            for jpg in iter_frames(response.raw, boundary):
+                # Ingest covers waiting on the network as well as parsing
+                metrics.stage_seconds.observe(time.perf_counter() - ingest_start, stage='ingest')
+                with metrics.stage_seconds.time(stage='decode'):
+                    frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    self.frames.publish(EncodedFrame(jpg, frame, time.time()))
+                    metrics.frames_total.inc(stream=self.name, event='ingested')
+                    ingest_start = time.perf_counter()
+                else:
+                    logger.warning("Failed to decode frame")
+                    metrics.frames_dropped_total.inc(stream=self.name, reason='decode')
+                    self.is_connected = False
+                    break
+            else:
+                logger.warning("Stream ended")
+                self.is_connected = False
+        else:
+            logger.warning(f"Stream returned status code: {response.status_code}")
+            self.is_connected = False
+
+    def _read_frame_bus(self, name):
+        # Raw frames straight from the capture process: no JPEG on either side
+        reader = FrameBusReader(name)
+        logger.info(f"Attached to frame bus {name} ({reader.shape[1]}x{reader.shape[0]})")
+        self.is_connected = True
+        last_seq = 0
+        try:
+            while True:
+                ingest_start = time.perf_counter()
+                result = reader.wait(last_seq, timeout=self.retry_interval)
+                if result is None:
+                    # Writer stopped or restarted with a new segment; attach again
+                    logger.warning(f"Frame bus {name} stalled")
+                    self.is_connected = False
+                    return
+                metrics.stage_seconds.observe(time.perf_counter() - ingest_start, stage='ingest')
+                last_seq, timestamp, frame = result
+                self.frames.publish(EncodedFrame(None, frame, timestamp), timestamp)
+                metrics.frames_total.inc(stream=self.name, event='ingested')
+        finally:
+            reader.close()
+
+    def _placeholder_bytes(self):
+        if self._placeholder is not None:
+            return self._placeholder
+        placeholder = np.zeros((450, 800, 3), dtype=np.uint8)
+        cv2.putText(placeholder, "Waiting for stream...", (250, 225),
+                   cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        ret, buffer = cv2.imencode('.jpg', placeholder)
+        self._placeholder = buffer.tobytes()
+        return self._placeholder
+
+    def raw_jpeg(self, seq, captured, size):
+        # Forward the upstream bytes untouched when they already have the requested size
+        height, width = captured.image.shape[:2]
+        native = size is None or (width, height) == tuple(size)
+        if native and captured.jpeg is not None:
+            return captured.jpeg
+
+        # Frames from the frame bus arrive raw and are encoded once per size
+        def encode():
+            with metrics.stage_seconds.time(stage='raw_encode'):
+                image = captured.image if native else cv2.resize(captured.image, tuple(size))
+                ret, buffer = cv2.imencode('.jpg', image)
+            return buffer.tobytes()
+        return self.encode_cache.get(seq, 'native' if native else tuple(size), encode)
+
+    def _wait_for_next(self, hub, last_seq, current):
+        # Block until a new item arrives; only wake early to show the
+        # placeholder once the upstream connection has dropped
+        while True:
+            seq, latest = hub.wait(last_seq, timeout=1.0)
+            if latest is not None:
+                return seq, latest
+            if not self.is_connected:
+                return last_seq, current
+
+    def generate_raw_frames(self, size=DEFAULT_RAW_SIZE):
+        # Wake only when the capture thread publishes, and never resend a frame
+        last_seq, captured = self.frames.latest()
+        with metrics.clients.track(endpoint='raw_feed'):
+            while True:
+                if captured is not None and self.is_connected:
+                    yield part(self.raw_jpeg(last_seq, captured, size), captured.timestamp)
+                    metrics.frames_total.inc(stream=self.name, event='sent_raw')
+                else:
+                    yield part(self._placeholder_bytes())
+
+                last_seq, captured = self._wait_for_next(self.frames, last_seq, captured)
+
+    def generate_detection_frames(self):
+        # Every client reads the shared result; inference never runs here
+        last_seq, result = self.results.latest()
+        with metrics.clients.track(endpoint='detection_feed'):
+            while True:
+                if result is not None and self.is_connected:
+                    yield part(result.jpeg, result.timestamp)
+                    metrics.frames_total.inc(stream=self.name, event='sent_detection')
+                else:
+                    yield part(self._placeholder_bytes())
+
+                last_seq, result = self._wait_for_next(self.results, last_seq, result)
+
+    def get_current_stats(self):
+        _, result = self.results.latest()
+        stats = result.stats if result is not None else EMPTY_STATS
+        return {
+            'connection_status': 'connected' if self.is_connected else 'disconnected',
+            'confidence': round(stats['confidence'], 1),
+            'crack_detected': stats['crack_detected'],
+            'crack_count': stats['crack_count'],
+            'largest_crack': round(stats['largest_crack'], 2),
+            'avg_width': round(stats['avg_width'], 2),
+            'positive_tiles': stats['positive_tiles'],
+            'inference': self.gate.stats()
+        }
+
+
+class MultiStreamDetector:
+    """Runs one model over several streams, batching their latest frames per tick."""
+
+    def __init__(self, stream_urls, model_path, input_size=(128, 128), retry_interval=5,
+                 batch_window=0.015, backend='keras', backend_options=None,
+                 tiled=False, tile_size=tiling.DEFAULT_TILE_SIZE, tile_overlap=tiling.DEFAULT_OVERLAP,
+                 gate_threshold=3.0, gate_refresh=2.0):
+        # The model loads and warms up in the background so the HTTP server and
+        # raw feeds are available immediately; inference starts once it is ready
+        self.backend = None
+        self.ready = threading.Event()
+        self.model_state = {'state': 'loading', 'backend': backend, 'error': None,
+                            'load_seconds': None, 'warmup_seconds': None}
+        self.input_size = input_size
+        self.batch_window = batch_window
+
+        # Tiled mode scores overlapping tiles instead of one downscaled frame
+        self.tiled = tiled
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self._grids = {}
+
+        # All feeds share one condition so the inference loop wakes on any new frame
+        self._new_frame = threading.Condition()
+        # Near-identical frames (ROV holding station) reuse the last published result
+        self.feeds = [StreamFeed(url, retry_interval, self._new_frame, SceneGate(gate_threshold, gate_refresh),
+                                 name=str(i))
+                      for i, url in enumerate(stream_urls)]
+
+        self._loader = Thread(target=self._load_model, args=(backend, model_path, backend_options or {}),
+                              daemon=True)
+        self._loader.start()
+
+        # Inference runs once per captured frame, independent of feed clients
+        self.inference_thread = Thread(target=self._inference_loop, daemon=True)
+        self.inference_thread.start()
+
+    def _load_model(self, kind, model_path, options):
+        try:
+            start = time.perf_counter()
+            backend = load_backend(kind, model_path, **options)
+            self.model_state.update(state='warming', load_seconds=round(time.perf_counter() - start, 3))
+            logger.info(f"Startup: {kind} model loaded in {self.model_state['load_seconds']:.2f}s")
+
+            start = time.perf_counter()
+            self._warm_up(backend)
+            self.backend = backend
+            self.model_state.update(state='ready', warmup_seconds=round(time.perf_counter() - start, 3))
+            logger.info(f"Startup: model warmed up in {self.model_state['warmup_seconds']:.2f}s, "
+                        f"ready {startup_elapsed():.2f}s after start")
+            self.ready.set()
+        except Exception as e:
+            logger.error(f"Model load failed: {e}")
+            self.model_state.update(state='failed', error=str(e))
+
+    def _warm_up(self, backend):
+        # Run every batch size the loop will use once, so graph tracing,
+        # allocation and tensor resizing happen before the first real frame
+        sizes = {1, len(self.feeds)}
+        if self.tiled:
+            # A batch holds the tiles of one stream or of every stream at once
+            tiles = [len(self.tile_boxes(shape)) for shape in self._first_frame_shapes()]
+            sizes = set(tiles) | {sum(tiles)}
+        for size in sorted(sizes):
+            batch = np.zeros((size, self.input_size[1], self.input_size[0], 3), dtype=np.float32)
+            backend.predict(batch)
+
+    def _first_frame_shapes(self):
+        deadline = time.monotonic() + WARMUP_FRAME_TIMEOUT
+        shapes = []
+        for feed in self.feeds:
+            _, frame = feed.frames.wait(0, max(0.0, deadline - time.monotonic()))
+            if frame is None:
+                logger.warning(f"No frame from stream {feed.name} to warm up with, "
+                               f"assuming {DEFAULT_FRAME_SHAPE[1]}x{DEFAULT_FRAME_SHAPE[0]}")
+                shapes.append(DEFAULT_FRAME_SHAPE)
+            else:
+                shapes.append(frame.image.shape[:2])
+        return shapes
+
     def preprocess_frame(self, frame):
-        processed = cv2.resize(frame, self.input_size)
-        processed = processed.astype('float32') / 255.0
-        processed = np.expand_dims(processed, axis=0)
-        return processed
-    
+        return preprocess(frame, self.input_size)
+
+    def predict_batch(self, frames):
+        with metrics.stage_seconds.time(stage='preprocess'):
+            batch = preprocess_batch(frames, self.input_size)
+        with metrics.stage_seconds.time(stage='predict'):
+            return 1 - self.backend.predict(batch)
+
+    def tile_boxes(self, shape):
+        key = shape[:2]
+        if key not in self._grids:
+            self._grids[key] = tiling.tile_grid(shape, self.tile_size, self.tile_overlap)
+        return self._grids[key]
+
+    def predict_tiles(self, frames):
+        # Tiles from every frame go through a single predict call
+        grids = [self.tile_boxes(frame.shape) for frame in frames]
+        crops = [tile for frame, boxes in zip(frames, grids) for tile in tiling.crop_tiles(frame, boxes)]
+        scores = self.predict_batch(crops)
+        bounds = np.cumsum([0] + [len(boxes) for boxes in grids])
+        return [(boxes, scores[bounds[i]:bounds[i + 1]]) for i, boxes in enumerate(grids)]
+
+    def _measure_cracks(self, visualization, edges, stats):
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        stats['crack_count'] = len(contours)
+        if contours:
+            crack_lengths = [cv2.arcLength(cnt, True) for cnt in contours]
+            stats['largest_crack'] = max(crack_lengths) / 100
+            stats['avg_width'] = sum(crack_lengths) / len(crack_lengths) / 1000
+
+        cv2.drawContours(visualization, contours, -1, (0, 0, 255), 2)
+
+    def annotate(self, frame, prediction):
+        visualization = frame.copy()
+        stats = dict(EMPTY_STATS)
+        stats['confidence'] = float(prediction * 100)
+
+        if prediction > 0.5:
+            stats['crack_detected'] = True
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+            edges = cv2.Canny(blurred, 50, 150)
+            self._measure_cracks(visualization, edges, stats)
+
+        return visualization, stats
+
+    def annotate_tiles(self, frame, boxes, scores):
+        heat = tiling.heatmap(frame.shape, boxes, scores)
+        visualization = tiling.overlay_heatmap(frame, heat)
+        stats = dict(EMPTY_STATS)
+        stats['confidence'] = float(scores.max() * 100)
+
+        positive = [box for box, score in zip(boxes, scores) if score > 0.5]
+        stats['positive_tiles'] = len(positive)
+        if positive:
+            stats['crack_detected'] = True
+            # Edge and contour work only runs inside the positive tiles
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            self._measure_cracks(visualization, tiling.edges_in_boxes(gray, positive), stats)
+            for x, y, w, h in positive:
+                cv2.rectangle(visualization, (x, y), (x + w - 1, y + h - 1), (0, 255, 255), 1)
+
+        return visualization, stats, heat
+
+    def analyze(self, frames):
+        """Return (visualization, stats, heatmap) for each frame, in one predict call."""
+        predictions = self.predict_tiles(frames) if self.tiled else self.predict_batch(frames)
+        results = []
+        for frame, prediction in zip(frames, predictions):
+            # Canny, contours and drawing
+            with metrics.stage_seconds.time(stage='postprocess'):
+                if self.tiled:
+                    results.append(self.annotate_tiles(frame, *prediction))
+                else:
+                    results.append((*self.annotate(frame, prediction), None))
+        return results
+
     def detect_cracks(self, frame):
         if frame is None:
-            return None
+            return None, dict(EMPTY_STATS)
             
         try:
-            visualization = frame.copy()
-            processed_frame = self.preprocess_frame(frame)
-            prediction = 1 - self.model.predict(processed_frame, verbose=0)[0][0]
-            self.current_confidence = prediction * 100
-            
-            if prediction > 0.5:
-                self.crack_detected = True
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-                edges = cv2.Canny(blurred, 50, 150)
-                contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                
-                self.crack_count = len(contours)
-                if contours:
-                    crack_lengths = [cv2.arcLength(cnt, True) for cnt in contours]
-                    self.largest_crack = max(crack_lengths) / 100
-                    self.avg_width = sum(crack_lengths) / len(crack_lengths) / 1000
-                
-                cv2.drawContours(visualization, contours, -1, (0, 0, 255), 2)
-            else:
-                self.crack_detected = False
-                self.crack_count = 0
-                self.largest_crack = 0
-                self.avg_width = 0
-            
-            return visualization
-            
+            visualization, stats, _ = self.analyze([frame])[0]
+            return visualization, stats
         except Exception as e:
             logger.error(f"Error in crack detection: {e}")
-            return frame
-
-    def generate_raw_frames(self):
-        last_frame_time = 0
-        frame_interval = 1.0 / 30  # 30 FPS
-
-        while True:
-            current_time = time.time()
-            if current_time - last_frame_time < frame_interval:
-                time.sleep(0.001)  # Small sleep to prevent CPU overuse
-                continue
+            return frame, dict(EMPTY_STATS)
 
-            if self.frame is not None and self.is_connected:
-                frame_resized = cv2.resize(self.frame, (800, 450))
-                ret, buffer = cv2.imencode('.jpg', frame_resized)
-                frame_bytes = buffer.tobytes()
-            else:
-                placeholder = np.zeros((450, 800, 3), dtype=np.uint8)
-                cv2.putText(placeholder, "Waiting for stream...", (250, 225),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                ret, buffer = cv2.imencode('.jpg', placeholder)
-                frame_bytes = buffer.tobytes()
+    def _collect_new_frames(self, last_seqs, timeout):
+        def is_new(i):
+            return self.feeds[i].frames.seq != last_seqs[i]
 
-            last_frame_time = current_time
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        with self._new_frame:
+            if not self._new_frame.wait_for(lambda: any(is_new(i) for i in range(len(self.feeds))),
+                                            timeout):
+                return []
+            # Give the other connected streams a short window to join this batch
+            self._new_frame.wait_for(
+                lambda: all(is_new(i) for i, feed in enumerate(self.feeds) if feed.is_connected),
+                self.batch_window)
 
-    def generate_detection_frames(self):
-        last_frame_time = 0
-        frame_interval = 1.0 / 30  # 30 FPS
+        pending = []
+        for i, feed in enumerate(self.feeds):
+            seq, captured = feed.frames.latest()
+            if seq != last_seqs[i] and captured is not None:
+                if last_seqs[i] and seq - last_seqs[i] > 1:
+                    # Published while the previous batch was running
+                    metrics.frames_dropped_total.inc(seq - last_seqs[i] - 1, stream=feed.name,
+                                                     reason='superseded')
+                last_seqs[i] = seq
+                pending.append((feed, captured))
+        return pending
 
+    def _inference_loop(self):
+        self.ready.wait()
+        last_seqs = [0] * len(self.feeds)
+        first_result = True
         while True:
-            current_time = time.time()
-            if current_time - last_frame_time < frame_interval:
-                time.sleep(0.001)  # Small sleep to prevent CPU overuse
+            pending = self._collect_new_frames(last_seqs, timeout=1.0)
+            # Skipped frames leave the previous result and overlay on the feed
+            gated = []
+            for feed, captured in pending:
+                if feed.gate.should_infer(captured.image, captured.timestamp):
+                    gated.append((feed, captured))
+                else:
+                    metrics.frames_total.inc(stream=feed.name, event='skipped')
+            pending = gated
+            if not pending:
                 continue
 
-            if self.frame is not None and self.is_connected:
-                detection_frame = self.detect_cracks(self.frame)
-                if detection_frame is not None:
+            # One predict call covers the newest frame (or all its tiles) from every stream
+            try:
+                results = self.analyze([captured.image for _, captured in pending])
+            except Exception as e:
+                logger.error(f"Error in crack detection: {e}")
+                continue
+
+            for (feed, captured), (detection_frame, stats, heat) in zip(pending, results):
+                with metrics.stage_seconds.time(stage='resize'):
                     frame_resized = cv2.resize(detection_frame, (800, 450))
+                with metrics.stage_seconds.time(stage='encode'):
                     ret, buffer = cv2.imencode('.jpg', frame_resized)
-                    frame_bytes = buffer.tobytes()
-            else:
-                placeholder = np.zeros((450, 800, 3), dtype=np.uint8)
-                cv2.putText(placeholder, "Waiting for stream...", (250, 225),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                ret, buffer = cv2.imencode('.jpg', placeholder)
-                frame_bytes = buffer.tobytes()
+                if ret:
+                    result = DetectionResult(detection_frame, buffer.tobytes(), stats, heat, captured.timestamp)
+                    feed.results.publish(result, timestamp=captured.timestamp)
+                    metrics.frames_total.inc(stream=feed.name, event='inferred')
+                    if first_result:
+                        logger.info(f"Startup: first detection published {startup_elapsed():.2f}s after start")
+                        first_result = False
 
-            last_frame_time = current_time
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    def record(self, directory):
+        # Raw frames keep their upstream JPEG; frames from a frame bus have none and are not recorded
+        recorders = []
+        for i, feed in enumerate(self.feeds):
+            recorders.append(Recorder(feed.frames, directory, f'stream{i}-raw').start())
+            recorders.append(Recorder(feed.results, directory, f'stream{i}-detection').start())
+        return recorders
+
+    def feed(self, index=0):
+        return self.feeds[index]
+
+    def generate_raw_frames(self, index=0, size=DEFAULT_RAW_SIZE):
+        return self.feeds[index].generate_raw_frames(size)
+
+    def generate_detection_frames(self, index=0):
+        return self.feeds[index].generate_detection_frames()
+
+    def get_current_stats(self, index=0):
+        return {**self.feeds[index].get_current_stats(), 'model': dict(self.model_state)}
 
-    def get_current_stats(self):
-        return {
-            'connection_status': 'connected' if self.is_connected else 'disconnected',
-            'confidence': round(self.current_confidence, 1),
-            'crack_detected': self.crack_detected,
-            'crack_count': self.crack_count,
-            'largest_crack': round(self.largest_crack, 2),
-            'avg_width': round(self.avg_width, 2)
-        }
+
+class StreamDetector(MultiStreamDetector):
+    def __init__(self, stream_url, model_path, input_size=(128, 128), retry_interval=5,
+                 backend='keras', backend_options=None, **options):
+        self.stream_url = stream_url
+        super().__init__([stream_url], model_path, input_size, retry_interval,
+                         backend=backend, backend_options=backend_options, **options)
 
 detector = None
 
+def parse_size(value):
+    if not value:
+        return DEFAULT_RAW_SIZE
+    if value == 'native':
+        return None
+    width, height = (int(v) for v in value.lower().split('x'))
+    if width <= 0 or height <= 0:
+        raise ValueError(value)
+    return (width, height)
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 @app.route('/raw_feed')
-def raw_feed():
-    return Response(detector.generate_raw_frames(),
+@app.route('/raw_feed/<int:index>')
+def raw_feed(index=0):
+    if index >= len(detector.feeds):
+        return jsonify({'error': f'no stream {index}'}), 404
+    try:
+        size = parse_size(request.args.get('size'))
+    except ValueError:
+        return jsonify({'error': 'size must be "native" or WIDTHxHEIGHT'}), 400
+    return Response(detector.generate_raw_frames(index, size),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/detection_feed')
-def detection_feed():
-    return Response(detector.generate_detection_frames(),
+@app.route('/detection_feed/<int:index>')
+def detection_feed(index=0):
+    if index >= len(detector.feeds):
+        return jsonify({'error': f'no stream {index}'}), 404
+    return Response(detector.generate_detection_frames(index),
                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/ready')
+def ready():
+    # 200 once the model can serve detections, 503 while loading or after a failure
+    state = dict(detector.model_state)
+    return jsonify(state), 200 if state['state'] == 'ready' else 503
+
 @app.route('/stats')
-def get_stats():
-    return jsonify(detector.get_current_stats())
+@app.route('/stats/<int:index>')
+def get_stats(index=0):
+    if index >= len(detector.feeds):
+        return jsonify({'error': f'no stream {index}'}), 404
+    return jsonify(detector.get_current_stats(index))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crack detection stream server")
+    parser.add_argument('--backend', default='keras', choices=sorted(BACKENDS),
+                        help="inference backend used for the crack model")
+    parser.add_argument('--model', default=None,
+                        help="model file for the backend (defaults to the backend's file under crackDetectionModels/, "
+                             "as written by tools/convert_crack_model.py)")
+    parser.add_argument('--tiled', action='store_true',
+                        help="score overlapping tiles and show a crack probability heatmap")
+    parser.add_argument('--tile-size', type=int, default=tiling.DEFAULT_TILE_SIZE,
+                        help="tile edge in source pixels for --tiled")
+    parser.add_argument('--tile-overlap', type=float, default=tiling.DEFAULT_OVERLAP,
+                        help="fraction of overlap between neighbouring tiles")
+    parser.add_argument('--gate-threshold', type=float, default=3.0,
+                        help="mean thumbnail difference (0-255) below which inference is skipped; 0 disables")
+    parser.add_argument('--gate-refresh', type=float, default=2.0,
+                        help="seconds after which inference runs even on an unchanged scene")
+    parser.add_argument('--stream', dest='streams', action='append',
+                        help="upstream MJPEG URL or shm://NAME[?fallback=URL] for a local frame bus; "
+                             "repeat for several streams (defaults to the ROV's camera 1)")
+    parser.add_argument('--both-cameras', action='store_true',
+                        help="with no --stream, also analyse the ROV's camera 0 in the same batches")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--record', metavar='DIR',
+                        help="record raw and annotated frames under DIR and serve them at /recordings")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        stream_url = 'http://192.168.2.1:5000/camera/1'
-        detector = StreamDetector(
-            stream_url=stream_url,
-            model_path='crackDetectionModels/best_model.keras',
-            retry_interval=5
+        # The first stream is the one served on the plain /raw_feed,
+        # /detection_feed and /stats routes
+        stream_urls = args.streams or ['http://192.168.2.1:5000/camera/1']
+        if not args.streams and args.both_cameras:
+            stream_urls.append('http://192.168.2.1:5000/camera/0')
+        detector = MultiStreamDetector(
+            stream_urls=stream_urls,
+            model_path=args.model or DEFAULT_MODELS[args.backend],
+            retry_interval=5,
+            backend=args.backend,
+            tiled=args.tiled,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
+            gate_threshold=args.gate_threshold,
+            gate_refresh=args.gate_refresh
         )
-        app.run(host='0.0.0.0', port=8000, threaded=True)
+        if args.record:
+            detector.record(args.record)
+            register_playback_routes(app, args.record)
+        logger.info(f"Startup: serving on port {args.port} {startup_elapsed():.2f}s after start, "
+                    f"model {detector.model_state['state']}")
+        app.run(host='0.0.0.0', port=args.port, threaded=True)
     except Exception as e:
         logger.error(f"Server initialization error: {str(e)}")
\ No newline at end of file
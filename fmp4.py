@@ -0,0 +1,322 @@
+import atexit
+import logging
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from frame_hub import FrameHub
+
+logger = logging.getLogger(__name__)
+
+# H.264 in fragmented MP4, the opt-in alternative to MJPEG. Raw BGR frames
+# are piped into an ffmpeg subprocess tuned for latency (no B-frames, one
+# fragment per frame, a keyframe every `gop` frames) and its output is cut
+# into the init segment (ftyp + moov) and one moof + mdat fragment per frame.
+# Browsers play the fragments through Media Source Extensions as they
+# arrive. Unlike JPEGs, fragments cannot be skipped one at a time: a viewer
+# that falls behind jumps ahead to the newest keyframe instead. The muxer
+# writes a fragment once the next frame arrives, so fragments trail the
+# encoder by one frame interval.
+
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+MIMETYPE = 'video/mp4'
+
+# tfhd / trun flags and the sample flag bit for frames that are not keyframes
+TFHD_BASE_DATA_OFFSET = 0x01
+TFHD_SAMPLE_DESCRIPTION = 0x02
+TFHD_DEFAULT_DURATION = 0x08
+TFHD_DEFAULT_SIZE = 0x10
+TFHD_DEFAULT_FLAGS = 0x20
+TRUN_DATA_OFFSET = 0x01
+TRUN_FIRST_SAMPLE_FLAGS = 0x04
+TRUN_SAMPLE_DURATION = 0x100
+TRUN_SAMPLE_SIZE = 0x200
+TRUN_SAMPLE_FLAGS = 0x400
+SAMPLE_IS_NON_SYNC = 0x00010000
+
+
+def ffmpeg_available(binary=None):
+    binary = binary or FFMPEG
+    return os.path.isfile(binary) or shutil.which(binary) is not None
+
+
+def iter_boxes(data, offset=0, end=None):
+    """Yield (type, payload start, box end) for the boxes in data[offset:end]."""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield kind.decode('latin-1'), offset + header, offset + size
+        offset += size
+
+
+def _read_exactly(stream, size):
+    # Pipes return short reads; keep going until `size` bytes or end of stream
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_box(stream):
+    """Read one whole top-level box from a file object; None at end of stream."""
+    header = _read_exactly(stream, 8)
+    if header is None:
+        return None
+    size, kind = struct.unpack('>I4s', header)
+    if size == 1:
+        extended = _read_exactly(stream, 8)
+        if extended is None:
+            return None
+        header += extended
+        size = struct.unpack('>Q', extended)[0]
+    body = _read_exactly(stream, size - len(header))
+    if body is None:
+        return None
+    return kind.decode('latin-1'), header + body
+
+
+def is_keyframe(moof):
+    """True if the first sample of a moof box (header included) is a sync sample, i.e. an IDR frame."""
+    default_flags = None
+    for kind, traf_start, traf_end in iter_boxes(moof, 8):
+        if kind != 'traf':
+            continue
+        for child, offset, _ in iter_boxes(moof, traf_start, traf_end):
+            flags = struct.unpack_from('>I', moof, offset)[0] & 0xFFFFFF
+            offset += 4
+            if child == 'tfhd':
+                offset += 4
+                for bit, size in ((TFHD_BASE_DATA_OFFSET, 8), (TFHD_SAMPLE_DESCRIPTION, 4),
+                                  (TFHD_DEFAULT_DURATION, 4), (TFHD_DEFAULT_SIZE, 4)):
+                    if flags & bit:
+                        offset += size
+                if flags & TFHD_DEFAULT_FLAGS:
+                    default_flags = struct.unpack_from('>I', moof, offset)[0]
+            elif child == 'trun':
+                offset += 4
+                if flags & TRUN_DATA_OFFSET:
+                    offset += 4
+                if flags & TRUN_FIRST_SAMPLE_FLAGS:
+                    sample_flags = struct.unpack_from('>I', moof, offset)[0]
+                elif flags & TRUN_SAMPLE_FLAGS:
+                    if flags & TRUN_SAMPLE_DURATION:
+                        offset += 4
+                    if flags & TRUN_SAMPLE_SIZE:
+                        offset += 4
+                    sample_flags = struct.unpack_from('>I', moof, offset)[0]
+                elif default_flags is not None:
+                    sample_flags = default_flags
+                else:
+                    return False
+                return not sample_flags & SAMPLE_IS_NON_SYNC
+    return False
+
+
+def codec_string(init):
+    """RFC 6381 codec for MediaSource.isTypeSupported, e.g. avc1.42c01f, from the avcC box."""
+    index = init.find(b'avcC')
+    if index < 0:
+        return None
+    profile, compatibility, level = init[index + 5:index + 8]
+    return f'avc1.{profile:02x}{compatibility:02x}{level:02x}'
+
+
+def encoder_command(size, fps, bitrate='2M', gop=None, encoder='libx264', ffmpeg=None):
+    width, height = size
+    gop = gop or max(1, int(round(fps)))
+    command = [
+        ffmpeg or FFMPEG, '-hide_banner', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-framerate', f'{fps:g}', '-i', '-',
+        '-an', '-c:v', encoder, '-pix_fmt', 'yuv420p',
+        '-b:v', bitrate, '-maxrate', bitrate, '-bufsize', bitrate,
+        '-g', str(gop), '-bf', '0',
+    ]
+    if encoder == 'libx264':
+        command += ['-preset', 'ultrafast', '-tune', 'zerolatency', '-profile:v', 'baseline']
+    return command + [
+        '-f', 'mp4', '-movflags', 'empty_moov+default_base_moof+frag_every_frame',
+        '-flush_packets', '1', '-',
+    ]
+
+
+class Fmp4Stream:
+    """One H.264 encode of a raw frame source, shared by every fMP4 viewer.
+
+    write() never blocks the capture loop: frames that arrive while ffmpeg
+    is still busy are dropped, as a camera would. Fragments are kept for a
+    couple of GOPs so a new viewer can start from the latest keyframe.
+    """
+
+    def __init__(self, size, fps=30, bitrate='2M', gop=None, encoder='libx264', ffmpeg=None,
+                 name='0', max_lag=None):
+        self.size = tuple(size)
+        self.fps = fps
+        self.gop = gop or max(1, int(round(fps)))
+        self.command = encoder_command(self.size, fps, bitrate, self.gop, encoder, ffmpeg)
+        self.name = name
+        # A viewer further behind than this skips to the newest keyframe
+        self.max_lag = max_lag or self.gop
+        self.init = None
+        self.codec = None
+        self.hub = FrameHub()
+        self.dropped = 0
+        self._ready = threading.Event()
+        self._fragments = deque(maxlen=self.gop * 2 + 1)
+        self._lock = threading.Lock()
+        self._frames = queue.Queue(maxsize=1)
+        self._process = None
+
+    def start(self):
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE, bufsize=0)
+        threading.Thread(target=self._feed, args=(self._process.stdin,), daemon=True).start()
+        threading.Thread(target=self._read, args=(self._process,), daemon=True).start()
+        # Unregistered again by close(), so stopped streams are not kept alive
+        atexit.register(self.close)
+        return self
+
+    def write(self, frame):
+        if frame.shape[1::-1] != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        try:
+            self._frames.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def _feed(self, stdin):
+        try:
+            while True:
+                frame = self._frames.get()
+                if frame is None:
+                    break
+                stdin.write(frame.tobytes())
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+
+    def _read(self, process):
+        stdout = process.stdout
+        init, moof = [], None
+        while True:
+            box = read_box(stdout)
+            if box is None:
+                break
+            kind, data = box
+            if kind in ('ftyp', 'moov'):
+                init.append(data)
+                if kind == 'moov':
+                    self.init = b''.join(init)
+                    self.codec = codec_string(self.init)
+                    self._ready.set()
+            elif kind == 'moof':
+                moof = data
+            elif kind == 'mdat' and moof is not None:
+                self._publish(moof + data, is_keyframe(moof))
+                moof = None
+        error = process.stderr.read().decode(errors='replace').strip()
+        if error:
+            logger.error(f"ffmpeg for stream {self.name} exited: {error}")
+        self._ready.set()
+
+    def _publish(self, fragment, keyframe):
+        with self._lock:
+            seq = self.hub.seq + 1
+            self._fragments.append((seq, keyframe, fragment))
+        self.hub.publish(seq, time.time())
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def mime_type(self):
+        # What a browser passes to MediaSource.addSourceBuffer
+        return f'{MIMETYPE}; codecs="{self.codec}"' if self.codec else MIMETYPE
+
+    def announcement(self):
+        """JSON-able description a WebSocket viewer receives before the init segment."""
+        return {"type": "stream", "format": "fmp4", "mimeType": self.mime_type,
+                "width": self.size[0], "height": self.size[1], "fps": self.fps}
+
+    def wait_ready(self, timeout=5.0):
+        """Wait for the init segment; False if ffmpeg failed or is too slow to start."""
+        return self._ready.wait(timeout) and self.init is not None
+
+    def fragments_after(self, last_seq):
+        """Return (new last seq, fragments) for everything published after `last_seq`.
+
+        `last_seq` None starts at the newest buffered keyframe. A viewer that
+        has fallen out of the buffer, or is more than max_lag behind, resumes
+        at the newest keyframe so it never decodes a frame without its reference.
+        """
+        with self._lock:
+            fragments = list(self._fragments)
+        if not fragments:
+            return last_seq, []
+        newest = fragments[-1][0]
+        if last_seq is not None and last_seq < fragments[0][0] - 1:
+            last_seq = None
+        elif last_seq is not None and newest - last_seq > self.max_lag:
+            newer = [seq for seq, keyframe, _ in fragments if keyframe and seq > last_seq]
+            if newer:
+                last_seq = newer[-1] - 1
+        if last_seq is None:
+            keyframes = [seq for seq, keyframe, _ in fragments if keyframe]
+            if not keyframes:
+                return None, []
+            last_seq = keyframes[-1] - 1
+        return newest, [data for seq, _, data in fragments if seq > last_seq]
+
+    def iter_fragments(self, timeout=1.0):
+        """Blocking generator for threaded servers: the init segment, then fragments as they arrive."""
+        yield self.init
+        last_seq, hub_seq = None, 0
+        while self.running:
+            hub_seq, _ = self.hub.wait(hub_seq, timeout)
+            last_seq, fragments = self.fragments_after(last_seq)
+            yield from fragments
+
+    async def fragments_async(self, timeout=1.0):
+        """Coroutine twin of iter_fragments(), without the init segment."""
+        last_seq, hub_seq = None, 0
+        while self.running:
+            hub_seq, _ = await self.hub.wait_async(hub_seq, timeout)
+            last_seq, fragments = self.fragments_after(last_seq)
+            for fragment in fragments:
+                yield fragment
+
+    def close(self):
+        if self._process is None:
+            return
+        atexit.unregister(self.close)
+        try:
+            self._frames.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        self._process = None
@@ -0,0 +1,208 @@
+import atexit
+import os
+import socket
+import struct
+import tempfile
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Raw frames shared between processes on one host. A writer owns a ring of
+# frame slots in a named shared memory block; readers attach by name and
+# copy the newest frame out with no JPEG encode or decode. There is no lock:
+# a slot's sequence stamp is zeroed while its pixels are rewritten, and a
+# reader that sees the stamp differ before and after its copy retries.
+#
+# Readers sleep on a Unix socket next to the segment rather than polling:
+# each connects to the writer's socket, and every publish sends each
+# connected reader one byte. The byte only wakes the reader; the frame is
+# still read through the seqlock above. A reader that closes is dropped, and
+# a wakeup that does not fit a reader's socket buffer is skipped, since one
+# already waiting is enough.
+#
+# Layout: header, then `slots` x (slot header + height*width*channels bytes)
+#   header:      magic, version, height, width, channels, slots, latest seq
+#   slot header: seq of the frame in the slot (0 while writing), timestamp
+
+MAGIC = b'AURAFBUS'
+VERSION = 2
+HEADER = struct.Struct('<8sIIIIIxxxxQ')
+SLOT_HEADER = struct.Struct('<Qd')
+PREFIX = 'aura_'
+
+
+def _segment_name(name):
+    return PREFIX + name
+
+
+def _wakeup_path(name):
+    return os.path.join(tempfile.gettempdir(), _segment_name(name) + '.sock')
+
+
+class FrameBusWriter:
+    """Publishes frames of one fixed shape into the named ring."""
+
+    def __init__(self, name, shape, slots=4):
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) > 2 else 1
+        self.name = name
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frame_bytes = height * width * channels
+        self.slot_size = SLOT_HEADER.size + self.frame_bytes
+        size = HEADER.size + slots * self.slot_size
+        try:
+            self.shm = shared_memory.SharedMemory(_segment_name(name), create=True, size=size)
+        except FileExistsError:
+            # Left behind by a writer that did not exit cleanly
+            stale = shared_memory.SharedMemory(_segment_name(name))
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(_segment_name(name), create=True, size=size)
+        self.seq = 0
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, height, width, channels, slots, 0)
+        self._frames = [np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                   offset=HEADER.size + i * self.slot_size + SLOT_HEADER.size)
+                        for i in range(slots)]
+        self._readers = []
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        path = _wakeup_path(name)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self._listener.bind(path)
+        self._listener.listen(16)
+        self._listener.setblocking(False)
+        atexit.register(self.close)
+
+    def publish(self, frame, timestamp=None):
+        if frame.shape != self.shape or frame.dtype != np.uint8:
+            raise ValueError(f"frame bus {self.name} carries {self.shape} uint8 frames, got "
+                             f"{frame.shape} {frame.dtype}")
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = HEADER.size + slot * self.slot_size
+        timestamp = time.time() if timestamp is None else timestamp
+
+        # Mark the slot as being written, copy, then stamp it complete
+        SLOT_HEADER.pack_into(self.shm.buf, offset, 0, 0.0)
+        self._frames[slot][...] = frame
+        SLOT_HEADER.pack_into(self.shm.buf, offset, self.seq, timestamp)
+        struct.pack_into('<Q', self.shm.buf, HEADER.size - 8, self.seq)
+        self._wake_readers()
+        return self.seq
+
+    def _wake_readers(self):
+        while True:
+            try:
+                reader, _ = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+            reader.setblocking(False)
+            self._readers.append(reader)
+        for reader in list(self._readers):
+            try:
+                reader.send(b'\x01')
+            except BlockingIOError:
+                pass
+            except OSError:
+                reader.close()
+                self._readers.remove(reader)
+
+    def close(self):
+        if self.shm is None:
+            return
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+        self._listener.close()
+        try:
+            os.unlink(_wakeup_path(self.name))
+        except FileNotFoundError:
+            pass
+        self._frames = []
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+class FrameBusReader:
+    """Attaches to a writer's ring; raises FileNotFoundError if there is none."""
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = shared_memory.SharedMemory(_segment_name(name))
+        # The writer owns the segment; a reader exiting must not unlink it
+        try:
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        except Exception:
+            pass
+        magic, version, height, width, channels, slots, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"{_segment_name(name)} is not a version {VERSION} frame bus")
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.slots = slots
+        self.slot_size = SLOT_HEADER.size + height * width * channels
+        self._frames = [np.ndarray(self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                   offset=HEADER.size + i * self.slot_size + SLOT_HEADER.size)
+                        for i in range(slots)]
+        # Connected before the first read, so no publish after it goes unnoticed
+        self._wakeup = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._wakeup.connect(_wakeup_path(name))
+        except OSError as e:
+            self._wakeup.close()
+            self._frames = []
+            self.shm.close()
+            raise FileNotFoundError(f"frame bus {name} has no writer: {e}")
+
+    def latest_seq(self):
+        return struct.unpack_from('<Q', self.shm.buf, HEADER.size - 8)[0]
+
+    def read(self, last_seq=0, retries=3):
+        """Copy out the newest frame if it is newer than `last_seq`.
+
+        Returns (seq, timestamp, frame), or None if there is nothing new or
+        the writer kept overwriting the slot while it was being copied.
+        """
+        for _ in range(retries):
+            seq = self.latest_seq()
+            if seq == last_seq or seq == 0:
+                return None
+            slot = seq % self.slots
+            offset = HEADER.size + slot * self.slot_size
+            before, timestamp = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+            if before != seq:
+                continue
+            frame = self._frames[slot].copy()
+            after, _ = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+            if after == seq:
+                return seq, timestamp, frame
+        return None
+
+    def wait(self, last_seq=0, timeout=1.0):
+        """Block until a frame newer than `last_seq` can be read; None on timeout or if the writer exits."""
+        deadline = time.monotonic() + timeout
+        while True:
+            result = self.read(last_seq)
+            remaining = deadline - time.monotonic()
+            if result is not None or remaining <= 0:
+                return result
+            self._wakeup.settimeout(remaining)
+            try:
+                # Several publishes may have queued a byte each; one read clears them
+                if not self._wakeup.recv(4096):
+                    return self.read(last_seq)
+            except socket.timeout:
+                pass
+
+    def close(self):
+        self._wakeup.close()
+        self._frames = []
+        self.shm.close()
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+
+# An encoded frame as published by a capture worker. `jpeg` is the encoded
+# bytes every viewer shares, `image` the decoded BGR array it came from.
+# Frames read raw from a frame bus have no encode yet and carry jpeg=None.
+EncodedFrame = namedtuple('EncodedFrame', ['jpeg', 'image', 'timestamp'])
+
+
+class FrameHub:
+    """Holds the latest item published by a producer and wakes waiting readers.
+
+    Every publish bumps a sequence number, so readers can tell a new item
+    from one they have already sent and never block on a stale frame.
+    Threads wait on a condition variable; coroutines wait on an asyncio
+    Event per event loop, which the publisher sets thread-safely.
+    """
+
+    def __init__(self, condition=None):
+        # Hubs may share one condition so a consumer can wait on several at once
+        self._cond = condition or threading.Condition()
+        self.seq = 0
+        self.item = None
+        self.timestamp = 0
+        self._async_events = {}
+
+    def publish(self, item, timestamp=None):
+        with self._cond:
+            self.seq += 1
+            self.item = item
+            self.timestamp = time.time() if timestamp is None else timestamp
+            self._cond.notify_all()
+            seq = self.seq
+            loops = list(self._async_events)
+
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake_async, loop)
+            except RuntimeError:
+                # The loop has been closed; forget its waiters
+                with self._cond:
+                    self._async_events.pop(loop, None)
+        return seq
+
+    def _wake_async(self, loop):
+        with self._cond:
+            event = self._async_events.pop(loop, None)
+        if event is not None:
+            event.set()
+
+    def latest(self):
+        with self._cond:
+            return self.seq, self.item
+
+    def wait(self, last_seq=0, timeout=None):
+        """Block until an item newer than `last_seq` exists.
+
+        Returns `(seq, item)`, or `(last_seq, None)` if the timeout expires first.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq != last_seq, timeout):
+                return last_seq, None
+            return self.seq, self.item
+
+    async def wait_async(self, last_seq=0, timeout=None):
+        """Coroutine form of `wait`, usable from any event loop."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._cond:
+                if self.seq != last_seq:
+                    return self.seq, self.item
+                event = self._async_events.get(loop)
+                if event is None:
+                    event = self._async_events[loop] = asyncio.Event()
+
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return last_seq, None
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return last_seq, None
+
+
+class _PendingEncode:
+    # Stands in the cache while the first reader encodes; others wait on it
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class EncodeCache:
+    """Encodes each (frame sequence, variant) at most once, however many readers ask.
+
+    Only the newest sequence numbers are kept, so memory stays bounded to a
+    handful of encoded frames. The lock only guards the table: the first
+    reader of a key encodes it outside the lock while later readers of that
+    key wait for the result, so different variants encode in parallel.
+    """
+
+    def __init__(self, keep_sequences=2):
+        self.keep_sequences = keep_sequences
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, seq, key, encode):
+        with self._lock:
+            entry = self._entries.get((seq, key))
+            owner = entry is None
+            if owner:
+                entry = self._entries[(seq, key)] = _PendingEncode()
+                oldest = seq - self.keep_sequences
+                for stale in [k for k in self._entries if k[0] <= oldest]:
+                    del self._entries[stale]
+
+        if not owner:
+            entry.done.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.value
+
+        try:
+            entry.value = encode()
+        except BaseException as e:
+            entry.error = e
+            # Let the next reader try again rather than cache the failure
+            with self._lock:
+                if self._entries.get((seq, key)) is entry:
+                    del self._entries[(seq, key)]
+            raise
+        finally:
+            entry.done.set()
+        return entry.value
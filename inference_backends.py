@@ -0,0 +1,134 @@
+import os
+
+import cv2
+import numpy as np
+
+# Every backend takes the same input: a float32 NHWC batch of BGR frames
+# resized to the model's input size and scaled to [0, 1] (see preprocess).
+# predict() returns the model's first output column as a float array of
+# shape (N,), so callers can swap backends without touching post-processing.
+# Heavy runtimes are imported only when their backend is constructed.
+
+
+def preprocess(frame, input_size):
+    processed = cv2.resize(frame, input_size)
+    processed = processed.astype('float32') / 255.0
+    return np.expand_dims(processed, axis=0)
+
+
+def preprocess_batch(frames, input_size):
+    return np.concatenate([preprocess(frame, input_size) for frame in frames])
+
+
+class KerasBackend:
+    """Calls the Keras model directly, skipping model.predict's per-call setup.
+
+    With compiled=True the call is traced once into a tf.function with a
+    dynamic batch dimension, which removes most of the remaining Python
+    overhead for small batches.
+    """
+
+    name = 'keras'
+
+    def __init__(self, model_path, compiled=False):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(model_path, compile=False)
+        self._call = lambda batch: self.model(batch, training=False)
+
+        if compiled:
+            import tensorflow as tf
+            self.name = 'keras-compiled'
+            signature = [tf.TensorSpec([None, *self.model.input_shape[1:]], tf.float32)]
+            self._call = tf.function(self._call, input_signature=signature)
+
+    def predict(self, batch):
+        return np.asarray(self._call(batch))[:, 0]
+
+
+class TFLiteBackend:
+    """Runs a .tflite export, float32, float16 or int8 quantized.
+
+    Quantized input and output tensors are scaled with the parameters stored
+    in the model, so the preprocessing contract is unchanged.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=model_path,
+                                       num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input['shape'][0])
+
+    def _resize(self, batch_size):
+        shape = list(self.input['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        if len(batch) != self._batch_size:
+            self._resize(len(batch))
+
+        scale, zero_point = self.input['quantization']
+        if self.input['dtype'] != np.float32 and scale:
+            batch = np.round(batch / scale + zero_point).astype(self.input['dtype'])
+        self.interpreter.set_tensor(self.input['index'], batch)
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if self.output['dtype'] != np.float32 and scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output[:, 0].astype(np.float32)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0][:, 0]
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'keras-compiled': lambda path, **options: KerasBackend(path, compiled=True, **options),
+    'tflite': TFLiteBackend,
+    'onnx': OnnxBackend,
+}
+
+# Where each backend's model lives by default: the Keras original and the
+# exports tools/convert_crack_model.py writes next to it
+DEFAULT_MODELS = {
+    'keras': 'crackDetectionModels/best_model.keras',
+    'keras-compiled': 'crackDetectionModels/best_model.keras',
+    'tflite': 'crackDetectionModels/best_model_float16.tflite',
+    'onnx': 'crackDetectionModels/best_model.onnx',
+}
+
+
+def load_backend(kind, model_path, **options):
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{kind}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[kind](model_path, **options)
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# JPEG encoding spread over worker processes. Frames are copied once into a
+# slot of a shared memory block; the worker encodes straight from that slot
+# and writes the JPEG back into it, so only small tuples (slot index, shape,
+# length) are pickled. A collector thread puts results back into submission
+# order per stream before handing them to the caller.
+
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+
+
+def _worker(shm_name, slot_bytes, tasks, results):
+    import cv2
+    # Parallelism comes from the pool; keep each worker single threaded
+    cv2.setNumThreads(1)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            job, slot, shape, dtype, params, rotate = task
+            offset = slot * slot_bytes
+            frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            if rotate is not None:
+                frame = cv2.rotate(frame, rotate)
+            ret, jpeg = cv2.imencode('.jpg', frame, params)
+            del frame
+            if not ret or len(jpeg) > slot_bytes:
+                results.put((job, slot, -1))
+                continue
+            out = np.ndarray((len(jpeg),), dtype=np.uint8, buffer=shm.buf, offset=offset)
+            out[:] = jpeg.ravel()
+            del out
+            results.put((job, slot, len(jpeg)))
+    finally:
+        shm.close()
+
+
+class JpegEncoderPool:
+    """Encodes frames on several cores and delivers them in order per stream.
+
+    submit() never blocks the capture loop: when every slot is busy the frame
+    is refused and the caller can count it as dropped. Callbacks run on the
+    collector thread with (jpeg_bytes, meta), or (None, meta) if encoding
+    failed, in the order frames of that stream were submitted.
+    """
+
+    def __init__(self, workers=None, slots=None, slot_bytes=DEFAULT_SLOT_BYTES):
+        self.workers = workers or os.cpu_count() or 1
+        # Two slots per worker lets the next frame be copied in while one encodes
+        self.slots = slots or self.workers * 2
+        self.slot_bytes = slot_bytes
+        self._shm = None
+        self._processes = []
+        self._free = queue.Queue()
+        self._jobs = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._next_job = 0
+        self._collector = None
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        for _ in range(self.workers):
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(self._shm.name, self.slot_bytes, self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def submit(self, stream, frame, params, callback, meta=None, rotate=None):
+        """Queue `frame` for encoding; returns False if no slot is free."""
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"frame of {frame.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            return False
+
+        offset = slot * self.slot_bytes
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._shm.buf, offset=offset)
+        view[...] = frame
+        del view
+
+        with self._lock:
+            job = self._next_job
+            self._next_job += 1
+            state = self._streams.setdefault(stream, {'next': 0, 'submitted': 0, 'done': {}})
+            self._jobs[job] = (stream, state['submitted'], callback, meta)
+            state['submitted'] += 1
+        self._tasks.put((job, slot, frame.shape, frame.dtype.str, list(params), rotate))
+        return True
+
+    def _collect(self):
+        while True:
+            try:
+                result = self._results.get()
+            except (EOFError, OSError):
+                return
+            if result is None:
+                return
+            job, slot, length = result
+            jpeg = None
+            if length >= 0:
+                offset = slot * self.slot_bytes
+                jpeg = bytes(self._shm.buf[offset:offset + length])
+            self._free.put(slot)
+
+            with self._lock:
+                stream, seq, callback, meta = self._jobs.pop(job)
+                state = self._streams[stream]
+                state['done'][seq] = (jpeg, callback, meta)
+                ready = []
+                # Hold results until everything submitted before them is back
+                while state['next'] in state['done']:
+                    ready.append(state['done'].pop(state['next']))
+                    state['next'] += 1
+
+            for jpeg, callback, meta in ready:
+                callback(jpeg, meta)
+
+    def close(self):
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if self._collector is not None:
+            self._results.put(None)
+            self._collector.join(timeout=5)
+            self._collector = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
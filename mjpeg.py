@@ -0,0 +1,213 @@
+import re
+
+# multipart/x-mixed-replace framing shared by every MJPEG producer and consumer
+
+DEFAULT_BOUNDARY = b'frame'
+MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?')
+
+
+def part(jpeg, timestamp=None):
+    """Wrap one JPEG as a multipart part, with Content-Length so readers can skip scanning.
+
+    `timestamp` (epoch seconds) adds an X-Timestamp header with the frame's
+    capture time, which clients can use to measure latency.
+    """
+    extra = b'' if timestamp is None else b'X-Timestamp: %.6f\r\n' % timestamp
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n' + extra +
+            b'Content-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+
+
+def boundary_from_content_type(content_type):
+    match = _BOUNDARY_RE.search(content_type or '')
+    if not match:
+        return DEFAULT_BOUNDARY
+    boundary = match.group(1).encode()
+    # Some servers put the leading dashes in the header value as well
+    return boundary[2:] if boundary.startswith(b'--') else boundary
+
+
+class MJPEGParser:
+    """Incremental multipart/x-mixed-replace parser.
+
+    Data is appended to one reusable bytearray. Parts with a Content-Length
+    header are cut out by size; parts without one end at the next boundary
+    line, never at the first FFD9 marker, so embedded thumbnails cannot
+    split a frame. Boundary searches resume where the previous one stopped,
+    which keeps the work linear in the stream size.
+
+    Parts are returned as memoryviews into the buffer, so nothing is copied
+    per frame; a caller that keeps a part past the next call should take
+    bytes() of it. A view still in use keeps its old buffer alive: the parser
+    moves the unconsumed tail to a new buffer instead of resizing under it.
+    """
+
+    def __init__(self, boundary=DEFAULT_BOUNDARY, max_part_size=16 * 1024 * 1024):
+        self.delimiter = b'--' + boundary
+        self.next_delimiter = b'\r\n' + self.delimiter
+        self.max_part_size = max_part_size
+        self.headers = {}
+        self._buf = bytearray()
+        self._pos = 0
+        self._scan = 0
+        self._body_start = None
+        self._length = None
+
+    def append(self, data):
+        try:
+            self._buf += data
+        except BufferError:
+            self._rebase()
+            self._buf += data
+
+    def feed(self, data):
+        """Append `data` and return the list of parts (memoryviews) completed by it."""
+        self.append(data)
+        frames = []
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def next_frame(self):
+        """Return the next complete part from buffered data as a memoryview, or None."""
+        if self._body_start is None and not self._parse_headers():
+            return None
+
+        buf = self._buf
+        if self._length is not None:
+            end = self._body_start + self._length
+            if len(buf) < end:
+                return None
+            frame = memoryview(buf)[self._body_start:end]
+            self._pos = end
+        else:
+            start = max(self._body_start, self._scan)
+            end = buf.find(self.next_delimiter, start)
+            if end == -1:
+                self._scan = max(self._body_start, len(buf) - len(self.next_delimiter) + 1)
+                if len(buf) - self._body_start > self.max_part_size:
+                    raise ValueError("MJPEG part exceeds max_part_size without a boundary")
+                return None
+            frame = memoryview(buf)[self._body_start:end]
+            # Leave the CRLF before the delimiter for the next header search
+            self._pos = end
+
+        self._body_start = None
+        self._compact()
+        return frame
+
+    def pending_body(self):
+        """For a part whose size is known, return (bytes_needed, bytes_buffered).
+
+        Lets a reader allocate the frame once and read the remainder of the
+        body straight into it instead of through the parse buffer.
+        """
+        if self._body_start is None or self._length is None:
+            return None
+        return self._length, len(self._buf) - self._body_start
+
+    def take_partial_body(self, frame_view):
+        """Move the buffered start of the pending body into `frame_view`."""
+        available = len(self._buf) - self._body_start
+        with memoryview(self._buf) as buffered:
+            frame_view[:available] = buffered[self._body_start:]
+        self._pos = len(self._buf)
+        self._body_start = None
+        self._compact()
+        return available
+
+    def _parse_headers(self):
+        buf = self._buf
+        start = buf.find(self.delimiter, self._pos)
+        if start == -1:
+            # Keep only what could still be the start of a delimiter
+            self._pos = max(self._pos, len(buf) - len(self.delimiter) + 1)
+            self._compact()
+            return False
+        header_end = buf.find(b'\r\n\r\n', start)
+        if header_end == -1:
+            return False
+
+        headers = {}
+        for line in bytes(buf[start:header_end]).split(b'\r\n')[1:]:
+            name, sep, value = line.partition(b':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        self.headers = headers
+
+        length = headers.get(b'content-length')
+        self._length = int(length) if length and length.isdigit() else None
+        if self._length is not None and self._length > self.max_part_size:
+            raise ValueError(f"MJPEG part of {self._length} bytes exceeds max_part_size")
+        self._body_start = header_end + 4
+        self._scan = self._body_start
+        return True
+
+    def _compact(self):
+        # Drop consumed bytes once they make up most of the buffer
+        if self._pos and self._pos >= len(self._buf) // 2:
+            try:
+                del self._buf[:self._pos]
+            except BufferError:
+                self._rebase()
+                return
+            self._shift()
+
+    def _rebase(self):
+        # A returned part is still viewed: leave it the old buffer and copy
+        # only the unconsumed tail, which is what del would have moved anyway
+        self._buf = self._buf[self._pos:]
+        self._shift()
+
+    def _shift(self):
+        if self._body_start is not None:
+            self._body_start -= self._pos
+        self._scan = max(0, self._scan - self._pos)
+        self._pos = 0
+
+
+def iter_frames(raw, boundary=DEFAULT_BOUNDARY, chunk_size=256 * 1024):
+    """Yield complete JPEG parts read from the file-like `raw` stream.
+
+    Reads use `read1` where available so a large chunk size never delays a
+    frame that has already arrived. Once a part's Content-Length is known,
+    the rest of its body is read directly into the frame's own buffer.
+    Other parts are copied out of the parse buffer once, as callers keep
+    frames after asking for the next one.
+    """
+    parser = MJPEGParser(boundary)
+    read = getattr(raw, 'read1', None) or raw.read
+    readinto = getattr(raw, 'readinto', None)
+
+    while True:
+        frame = parser.next_frame()
+        if frame is not None:
+            jpeg = bytes(frame)
+            frame.release()
+            yield jpeg
+            continue
+
+        pending = parser.pending_body()
+        if pending is not None and readinto is not None and pending[0] - pending[1] >= chunk_size // 4:
+            length, _ = pending
+            frame = bytearray(length)
+            view = memoryview(frame)
+            filled = parser.take_partial_body(view)
+            while filled < length:
+                n = readinto(view[filled:])
+                if not n:
+                    return
+                filled += n
+            view.release()
+            yield frame
+            continue
+
+        data = read(chunk_size)
+        if not data:
+            return
+        parser.append(data)
@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import socket
+import struct
+from collections import deque
+
+import websockets
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# One WebSocket for control, telemetry and video. Every message is binary:
+# a two-byte header, logical channel (uint8) and flags (uint8), then the
+# payload. Channel numbers are also send priorities. The scheduler always
+# drains control (commands and acks) first, then telemetry, and sends video
+# only while the socket's write backlog is small. Video frames are cut into
+# chunks, so control waits behind at most one chunk. A frame that is
+# superseded before its first chunk goes out is dropped rather than queued.
+#
+# Payloads: control carries control_protocol packets (binary gamepad and
+# acks, or JSON with FLAG_TEXT); telemetry carries the batches /ws/telemetry
+# sends; video carries binary frames (FRAME_HEADER + JPEG) split over
+# chunks, the first marked FLAG_FIRST and the last FLAG_LAST.
+MUX_HEADER = struct.Struct('!BB')
+CHANNEL_CONTROL = 0
+CHANNEL_TELEMETRY = 1
+CHANNEL_VIDEO = 2
+CHANNELS = {CHANNEL_CONTROL: 'control', CHANNEL_TELEMETRY: 'telemetry', CHANNEL_VIDEO: 'video'}
+
+FLAG_TEXT = 0x01
+FLAG_FIRST = 0x02
+FLAG_LAST = 0x04
+
+# Binary video frames are a fixed header followed by the raw JPEG bytes:
+# message type (uint8), camera id (uint8), sequence number (uint32) and
+# capture timestamp in microseconds since the epoch (uint64), big-endian.
+FRAME_HEADER = struct.Struct('!BBIQ')
+MSG_TYPE_JPEG = 1
+
+DEFAULT_CHUNK_SIZE = 8 * 1024
+# Video is held back while more than this waits in the transport buffer
+DEFAULT_VIDEO_BACKLOG = 0
+# Unsent bytes the kernel may hold for a mux socket (TCP_NOTSENT_LOWAT).
+# More would queue control behind video inside the kernel, where the
+# scheduler cannot reorder it; bytes already in flight are not limited.
+# Without the option the whole send buffer is capped instead.
+DEFAULT_UNSENT_LIMIT = 4 * 1024
+FALLBACK_SEND_BUFFER = 16 * 1024
+DEFAULT_TELEMETRY_QUEUE = 32
+# How often held-back video checks whether the backlog has drained
+DRAIN_POLL = 0.002
+
+mux_messages_total = metrics.registry.counter(
+    'aura_mux_messages_total', 'Multiplexed WebSocket messages sent.', ['channel'])
+mux_dropped_total = metrics.registry.counter(
+    'aura_mux_dropped_total', 'Multiplexed messages dropped before sending.', ['channel'])
+mux_handler_errors_total = metrics.registry.counter(
+    'aura_mux_handler_errors_total', 'Inbound multiplexed messages whose handler raised.', ['channel'])
+mux_queue_seconds = metrics.registry.histogram(
+    'aura_mux_queue_seconds', 'Time from queueing to sending a multiplexed message.', ['channel'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+def pack_frame(jpeg_bytes, seq, capture_time, camera_id):
+    header = FRAME_HEADER.pack(MSG_TYPE_JPEG, camera_id, seq & 0xFFFFFFFF,
+                               int(capture_time * 1_000_000))
+    return header + jpeg_bytes
+
+
+def pack(channel, payload, flags=0):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+        flags |= FLAG_TEXT
+    return MUX_HEADER.pack(channel, flags) + payload
+
+
+def unpack(message):
+    """Return (channel, flags, payload); FLAG_TEXT payloads are decoded to str."""
+    if not isinstance(message, (bytes, bytearray)) or len(message) < MUX_HEADER.size:
+        raise ValueError("Multiplexed messages are binary with a 2-byte header")
+    channel, flags = MUX_HEADER.unpack_from(message)
+    payload = bytes(message[MUX_HEADER.size:])
+    if flags & FLAG_TEXT:
+        payload = payload.decode('utf-8')
+    return channel, flags, payload
+
+
+class VideoReassembler:
+    """Client side: joins video chunks back into frames."""
+
+    def __init__(self):
+        self._chunks = None
+        self.incomplete = 0
+
+    def feed(self, flags, payload):
+        """Add one chunk; returns the frame when its last chunk arrives, else None."""
+        if flags & FLAG_FIRST:
+            if self._chunks is not None:
+                self.incomplete += 1
+            self._chunks = []
+        if self._chunks is None:
+            return None
+        self._chunks.append(payload)
+        if not flags & FLAG_LAST:
+            return None
+        frame, self._chunks = b''.join(self._chunks), None
+        return frame
+
+
+class MuxSender:
+    """Send scheduler for one multiplexed socket: control, then telemetry, then video.
+
+    Control is never dropped. Telemetry keeps the newest `telemetry_queue`
+    batches. Video keeps one frame waiting to start; a newer frame replaces
+    it. run() does all the sending.
+    """
+
+    def __init__(self, websocket, chunk_size=DEFAULT_CHUNK_SIZE, video_backlog=DEFAULT_VIDEO_BACKLOG,
+                 telemetry_queue=DEFAULT_TELEMETRY_QUEUE, unsent_limit=DEFAULT_UNSENT_LIMIT):
+        self.websocket = websocket
+        self.chunk_size = chunk_size
+        self.video_backlog = video_backlog
+        self.unsent_limit = unsent_limit
+        self._control = deque()
+        self._telemetry = deque(maxlen=telemetry_queue)
+        self._video_next = None
+        self._video_chunks = deque()
+        self._wake = asyncio.Event()
+        self.sent = {name: 0 for name in CHANNELS.values()}
+        self.dropped = {name: 0 for name in CHANNELS.values()}
+
+    def _queued(self, channel, message):
+        return channel, message, asyncio.get_running_loop().time()
+
+    def _drop(self, channel, count=1):
+        name = CHANNELS[channel]
+        self.dropped[name] += count
+        mux_dropped_total.inc(count, channel=name)
+
+    async def send(self, channel, payload):
+        # Only queues; a coroutine so it can stand in for websocket.send
+        self.put(channel, payload)
+
+    def put(self, channel, payload):
+        if channel == CHANNEL_CONTROL:
+            self._control.append(self._queued(channel, pack(channel, payload)))
+        elif channel == CHANNEL_TELEMETRY:
+            if len(self._telemetry) == self._telemetry.maxlen:
+                self._drop(channel)
+            self._telemetry.append(self._queued(channel, pack(channel, payload)))
+        elif channel == CHANNEL_VIDEO:
+            if self._video_next is not None:
+                self._drop(channel)
+            self._video_next = self._queued(channel, payload)
+        else:
+            raise ValueError(f"Unknown channel {channel}")
+        self._wake.set()
+
+    def _backlog(self):
+        transport = getattr(self.websocket, 'transport', None)
+        return transport.get_write_buffer_size() if transport else 0
+
+    def _chunks(self, payload, queued):
+        chunks = deque()
+        for start in range(0, max(len(payload), 1), self.chunk_size):
+            end = start + self.chunk_size
+            flags = (FLAG_FIRST if start == 0 else 0) | (FLAG_LAST if end >= len(payload) else 0)
+            chunks.append((CHANNEL_VIDEO, pack(CHANNEL_VIDEO, payload[start:end], flags), queued))
+        return chunks
+
+    def _next(self):
+        if self._control:
+            return self._control.popleft()
+        if self._telemetry:
+            return self._telemetry.popleft()
+        if self._video_waiting() and self._backlog() <= self.video_backlog:
+            if not self._video_chunks:
+                _, payload, queued = self._video_next
+                self._video_next = None
+                self._video_chunks = self._chunks(payload, queued)
+            return self._video_chunks.popleft()
+        return None
+
+    def _video_waiting(self):
+        return bool(self._video_chunks) or self._video_next is not None
+
+    def _limit_kernel_queue(self):
+        transport = getattr(self.websocket, 'transport', None)
+        sock = transport.get_extra_info('socket') if transport else None
+        if sock is None or not self.unsent_limit:
+            return
+        try:
+            if hasattr(socket, 'TCP_NOTSENT_LOWAT'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, self.unsent_limit)
+            else:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, FALLBACK_SEND_BUFFER)
+        except OSError:
+            pass
+
+    async def run(self):
+        self._limit_kernel_queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            item = self._next()
+            if item is None:
+                self._wake.clear()
+                if self._video_waiting():
+                    # Held back by the backlog; wake for control or re-check shortly
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), DRAIN_POLL)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._wake.wait()
+                continue
+            channel, message, queued = item
+            name = CHANNELS[channel]
+            await self.websocket.send(message)
+            self.sent[name] += 1
+            mux_messages_total.inc(channel=name)
+            mux_queue_seconds.observe(loop.time() - queued, channel=name)
+
+
+class MuxConnection:
+    """Serves one multiplexed socket.
+
+    Register a handler per inbound channel with on(), and producers, which
+    are coroutine functions taking the MuxSender, with produce(). serve()
+    runs them with the sender until the client goes away. A handler that
+    raises is logged and counted; the message is dropped and the other
+    channels carry on.
+    """
+
+    def __init__(self, websocket, **sender_options):
+        self.websocket = websocket
+        self.sender = MuxSender(websocket, **sender_options)
+        self._handlers = {}
+        self._producers = []
+
+    def on(self, channel, handler):
+        self._handlers[channel] = handler
+
+    def produce(self, producer):
+        self._producers.append(producer)
+
+    async def serve(self):
+        tasks = [asyncio.ensure_future(self.sender.run())]
+        tasks += [asyncio.ensure_future(producer(self.sender)) for producer in self._producers]
+        try:
+            async for message in self.websocket:
+                try:
+                    channel, _, payload = unpack(message)
+                except (ValueError, UnicodeDecodeError):
+                    continue
+                handler = self._handlers.get(channel)
+                if handler is None:
+                    continue
+                try:
+                    await handler(payload)
+                except websockets.exceptions.ConnectionClosed:
+                    raise
+                except Exception:
+                    name = CHANNELS.get(channel, str(channel))
+                    logger.exception(f"Mux {name} handler failed")
+                    mux_handler_errors_total.inc(channel=name)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
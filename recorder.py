@@ -0,0 +1,336 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from mjpeg import part
+
+# Recording of already-encoded frames. A Recorder follows a FrameHub from
+# its own thread, so the capture and inference paths never wait on disk; if
+# it falls behind it simply records the newest frame. Frames are appended
+# to segment files (<start>.seg holds the concatenated JPEGs) next to a
+# fixed-size index (<start>.idx), which readers memory-map and binary search.
+#
+#   <directory>/<name>/<start>.seg
+#   <directory>/<name>/<start>.idx
+
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('offset', '<u8'),
+    ('size', '<u4'),
+    ('seq', '<u4'),
+    ('confidence', '<f4'),
+    ('crack_count', '<u2'),
+    ('crack_detected', 'u1'),
+    ('_pad', 'u1'),
+    ('largest_crack', '<f4'),
+    ('avg_width', '<f4'),
+])
+
+DEFAULT_SEGMENT_BYTES = 256 * 1024 * 1024
+DEFAULT_SEGMENT_SECONDS = 600
+
+
+def _index_record(timestamp, offset, size, seq, stats):
+    record = np.zeros(1, dtype=INDEX_DTYPE)
+    record['timestamp'] = timestamp
+    record['offset'] = offset
+    record['size'] = size
+    record['seq'] = seq & 0xFFFFFFFF
+    if stats:
+        record['confidence'] = stats.get('confidence', 0)
+        record['crack_count'] = min(int(stats.get('crack_count', 0)), 0xFFFF)
+        record['crack_detected'] = bool(stats.get('crack_detected', False))
+        record['largest_crack'] = stats.get('largest_crack', 0)
+        record['avg_width'] = stats.get('avg_width', 0)
+    return record.tobytes()
+
+
+class SegmentWriter:
+    """Appends frames to one stream's segments, rolling by size and age.
+
+    Index records are only written after the frame bytes they point at have
+    been flushed, so a reader never sees an entry for data not on disk.
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 segment_seconds=DEFAULT_SEGMENT_SECONDS, flush_interval=0.5):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._data = None
+        self._index = None
+        self._pending = []
+        self._last_flush = 0
+
+    def _open_segment(self, timestamp):
+        self.close()
+        base = os.path.join(self.directory, f'{timestamp:.6f}')
+        self._data = open(base + '.seg', 'ab')
+        self._index = open(base + '.idx', 'ab')
+        self._segment_start = timestamp
+        self._offset = self._data.tell()
+
+    def write(self, jpeg, timestamp, seq=0, stats=None):
+        if (self._data is None or self._offset >= self.segment_bytes
+                or timestamp - self._segment_start >= self.segment_seconds):
+            self._open_segment(timestamp)
+        self._data.write(jpeg)
+        self._pending.append(_index_record(timestamp, self._offset, len(jpeg), seq, stats))
+        self._offset += len(jpeg)
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._data is None:
+            return
+        self._data.flush()
+        if self._pending:
+            self._index.write(b''.join(self._pending))
+            self._index.flush()
+            self._pending = []
+        self._last_flush = time.time()
+
+    def close(self):
+        if self._data is None:
+            return
+        self.flush()
+        self._data.close()
+        self._index.close()
+        self._data = self._index = None
+
+
+class Recorder:
+    """Records the items published on `hub` under <directory>/<name>.
+
+    Items need `jpeg` and `timestamp` attributes (EncodedFrame,
+    DetectionResult); a `stats` attribute, when present, is stored in the
+    index. Items without an encode (jpeg is None) are skipped.
+    """
+
+    def __init__(self, hub, directory, name, **writer_options):
+        self.hub = hub
+        self.name = name
+        self.writer = SegmentWriter(os.path.join(directory, name), **writer_options)
+        self.recorded = 0
+        self.missed = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        last_seq, _ = self.hub.latest()
+        try:
+            while not self._stop.is_set():
+                seq, item = self.hub.wait(last_seq, timeout=self.writer.flush_interval)
+                if item is None:
+                    self.writer.flush()
+                    continue
+                if last_seq and seq - last_seq > 1:
+                    self.missed += seq - last_seq - 1
+                last_seq = seq
+                if getattr(item, 'jpeg', None) is None:
+                    continue
+                self.writer.write(item.jpeg, item.timestamp, seq, getattr(item, 'stats', None))
+                self.recorded += 1
+        finally:
+            self.writer.close()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+class _Segment:
+    def __init__(self, base):
+        self.base = base
+        self.refresh()
+
+    def changed(self):
+        return os.path.getsize(self.base + '.idx') != self.index_bytes
+
+    def refresh(self):
+        self.index_bytes = os.path.getsize(self.base + '.idx')
+        count = self.index_bytes // INDEX_DTYPE.itemsize
+        # A torn final record from a crash is ignored
+        self.index = (np.memmap(self.base + '.idx', dtype=INDEX_DTYPE, mode='r', shape=(count,))
+                      if count else np.zeros(0, dtype=INDEX_DTYPE))
+
+    def read(self, record):
+        with open(self.base + '.seg', 'rb') as f:
+            return os.pread(f.fileno(), int(record['size']), int(record['offset']))
+
+
+class Archive:
+    """Read side of one recorded stream: seeks are binary searches, reads are one pread."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.segments = []
+        self.refresh()
+
+    def refresh(self):
+        bases = sorted({os.path.splitext(f)[0] for f in os.listdir(self.directory) if f.endswith('.idx')},
+                       key=float) if os.path.isdir(self.directory) else []
+        known = {segment.base: segment for segment in self.segments}
+        self.segments = []
+        for base in bases:
+            path = os.path.join(self.directory, base)
+            segment = known.get(path)
+            if segment is None:
+                segment = _Segment(path)
+            elif segment.changed():
+                # The newest segment grows, and so can the one before it
+                # until the writer's last flush before rolling over
+                segment.refresh()
+            if len(segment.index):
+                self.segments.append(segment)
+        self._starts = np.array([segment.index['timestamp'][0] for segment in self.segments])
+
+    def span(self):
+        if not self.segments:
+            return None
+        return float(self.segments[0].index['timestamp'][0]), float(self.segments[-1].index['timestamp'][-1])
+
+    def frame_count(self):
+        return sum(len(segment.index) for segment in self.segments)
+
+    def locate(self, timestamp):
+        """(segment number, record number) of the last frame at or before `timestamp`."""
+        if not self.segments:
+            return None
+        s = max(0, int(np.searchsorted(self._starts, timestamp, side='right')) - 1)
+        times = self.segments[s].index['timestamp']
+        i = max(0, int(np.searchsorted(times, timestamp, side='right')) - 1)
+        return s, i
+
+    def frame_at(self, timestamp):
+        """Return (index record, jpeg bytes) for the frame showing at `timestamp`."""
+        position = self.locate(timestamp)
+        if position is None:
+            return None
+        segment = self.segments[position[0]]
+        record = segment.index[position[1]]
+        return record, segment.read(record)
+
+    def frames(self, start=None, end=None):
+        """Yield (index record, jpeg bytes) from `start` until `end`, in order."""
+        position = self.locate(start) if start is not None else (0, 0)
+        if position is None:
+            return
+        s, i = position
+        for segment in self.segments[s:]:
+            with open(segment.base + '.seg', 'rb') as f:
+                for record in segment.index[i:]:
+                    if end is not None and record['timestamp'] >= end:
+                        return
+                    yield record, os.pread(f.fileno(), int(record['size']), int(record['offset']))
+            i = 0
+
+    def events(self, start=None, end=None, min_confidence=50.0):
+        """Timestamps of indexed frames with a detected crack; no frame data is read."""
+        found = []
+        for segment in self.segments:
+            index = segment.index
+            mask = (index['crack_detected'] == 1) & (index['confidence'] >= min_confidence)
+            if start is not None:
+                mask &= index['timestamp'] >= start
+            if end is not None:
+                mask &= index['timestamp'] < end
+            found.append(index['timestamp'][mask])
+        return np.concatenate(found).tolist() if found else []
+
+
+def describe(archive):
+    span = archive.span()
+    return {
+        'name': archive.name,
+        'frames': archive.frame_count(),
+        'segments': len(archive.segments),
+        'start': span[0] if span else None,
+        'end': span[1] if span else None,
+    }
+
+
+def list_archives(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+
+def playback(archive, start=None, end=None, speed=1.0):
+    """MJPEG parts paced by the recorded timestamps (speed 2.0 plays twice as fast)."""
+    wall_start = None
+    for record, jpeg in archive.frames(start, end):
+        timestamp = float(record['timestamp'])
+        if wall_start is None:
+            wall_start, first = time.time(), timestamp
+        elif speed > 0:
+            delay = wall_start + (timestamp - first) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        yield part(jpeg, timestamp)
+
+
+def register_playback_routes(app, directory):
+    """Add /recordings routes for archives under `directory` to a Flask app.
+
+    GET /recordings                                  archives and their spans
+    GET /recordings/<name>?start=&end=               span plus crack event times
+    GET /recordings/<name>/frame?t=                  the JPEG showing at t
+    GET /recordings/<name>/play?start=&end=&speed=   MJPEG playback
+    """
+    from flask import Response, abort, jsonify, request
+
+    archives = {}
+
+    def archive(name):
+        # Only names that exist on disk, so the URL cannot point outside directory
+        if name not in list_archives(directory):
+            abort(404)
+        if name not in archives:
+            archives[name] = Archive(directory, name)
+        archives[name].refresh()
+        return archives[name]
+
+    def float_arg(name, default=None):
+        value = request.args.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            abort(400)
+
+    def recordings():
+        return jsonify([describe(archive(name)) for name in list_archives(directory)])
+
+    def recording(name):
+        found = archive(name)
+        start, end = float_arg('start'), float_arg('end')
+        return jsonify({**describe(found), 'crack_events': found.events(start, end)})
+
+    def recording_frame(name):
+        found = archive(name).frame_at(float_arg('t', float('inf')))
+        if found is None:
+            abort(404)
+        record, jpeg = found
+        return Response(jpeg, mimetype='image/jpeg',
+                        headers={'X-Timestamp': f"{float(record['timestamp']):.6f}"})
+
+    def recording_play(name):
+        found = archive(name)
+        return Response(playback(found, float_arg('start'), float_arg('end'), float_arg('speed', 1.0)),
+                        mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    app.add_url_rule('/recordings', 'recordings', recordings)
+    app.add_url_rule('/recordings/<name>', 'recording', recording)
+    app.add_url_rule('/recordings/<name>/frame', 'recording_frame', recording_frame)
+    app.add_url_rule('/recordings/<name>/play', 'recording_play', recording_play)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+
+import websockets
+from aiohttp import web
+
+from adaptive import AdaptiveController
+from mjpeg import MIMETYPE
+from stream_profiles import select_profile
+from asset_cache import AssetCache, asset_response
+import metrics
+
+# Single event loop runtime for rov_server: the camera MJPEG routes, the
+# viewer page, /models and the control WebSocket all share one asyncio loop,
+# so each viewer costs a coroutine rather than a Werkzeug thread. The opt-in
+# H.264 route also accepts WebSocket upgrades.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+MODELS_DIR = os.path.join(BASE_DIR, 'models')
+
+
+def make_video_app(camera_streams):
+    async def camera(request):
+        stream = camera_streams.get(int(request.match_info['camera_id']))
+        if stream is None:
+            raise web.HTTPNotFound()
+
+        adaptive = request.query.get('adaptive', '1') not in ('0', 'false', 'off')
+        try:
+            profile = select_profile(request.query.get('profile'), request.query.get('resolution'))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        response = web.StreamResponse(headers={'Content-Type': MIMETYPE, 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        frames = stream.generate_async(AdaptiveController() if adaptive else None, profile)
+        try:
+            async for chunk in frames:
+                # write() waits for the transport to drain, which is what the
+                # adaptive controller measures around each yield
+                await response.write(chunk)
+        except (ConnectionResetError, ConnectionError):
+            pass
+        finally:
+            await frames.aclose()
+        return response
+
+    async def camera_fmp4(request):
+        # H.264 fragments over a WebSocket (announcement, init segment, then
+        # one binary message per frame) or as one chunked video/mp4 response
+        camera_id = int(request.match_info['camera_id'])
+        stream = camera_streams.get(camera_id)
+        if stream is None:
+            raise web.HTTPNotFound()
+        fmp4 = await asyncio.get_running_loop().run_in_executor(None, stream.open_fmp4)
+        if fmp4 is None:
+            raise web.HTTPServiceUnavailable(text=f"H.264 is unavailable, use /camera/{camera_id}")
+
+        response = web.WebSocketResponse()
+        if response.can_prepare(request).ok:
+            send = response.send_bytes
+        else:
+            response = web.StreamResponse(headers={'Content-Type': fmp4.mime_type, 'Cache-Control': 'no-cache'})
+            send = response.write
+        fragments = stream.generate_fmp4_async(fmp4)
+
+        async def pump():
+            async for fragment in fragments:
+                await send(fragment)
+            if isinstance(response, web.WebSocketResponse):
+                await response.close()
+
+        try:
+            await response.prepare(request)
+            if isinstance(response, web.WebSocketResponse):
+                await response.send_str(json.dumps(fmp4.announcement()))
+                sender = asyncio.ensure_future(pump())
+                # Only reading notices the viewer's close frame
+                try:
+                    async for _ in response:
+                        pass
+                finally:
+                    sender.cancel()
+                    await asyncio.gather(sender, return_exceptions=True)
+            else:
+                await pump()
+        except (ConnectionResetError, ConnectionError):
+            pass
+        finally:
+            await fragments.aclose()
+            stream.release_fmp4(fmp4)
+        return response
+
+    async def index(request):
+        path = os.path.join(TEMPLATES_DIR, 'index.html')
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+    async def metrics_endpoint(request):
+        return web.Response(body=metrics.registry.render().encode(),
+                            headers={'Content-Type': metrics.CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get(r'/camera/{camera_id:\d+}', camera)
+    app.router.add_get(r'/camera/{camera_id:\d+}/fmp4', camera_fmp4)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.router.add_get('/', index)
+    return app
+
+
+def make_viewer_app():
+    async def viewer_index(request):
+        return web.FileResponse(os.path.join(TEMPLATES_DIR, 'viewer.html'))
+
+    assets = AssetCache(MODELS_DIR)
+
+    async def serve_model(request):
+        # The cache only resolves paths inside the models directory
+        asset = await asyncio.get_running_loop().run_in_executor(
+            None, assets.get, request.match_info['filename'])
+        if asset is None:
+            raise web.HTTPNotFound()
+        status, headers, body = asset_response(asset, request.headers, request.query.get('v'))
+        return web.Response(body=body, status=status, headers=headers)
+
+    async def preload(app):
+        # Compress models before the first viewer asks for them
+        asyncio.get_running_loop().run_in_executor(None, assets.preload)
+
+    app = web.Application()
+    app.on_startup.append(preload)
+    app.router.add_get('/', viewer_index)
+    app.router.add_get('/models/{filename:.+}', serve_model)
+    return app
+
+
+async def start_app(app, host, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+async def main(camera_streams, control_handler, host='0.0.0.0',
+               video_port=5000, viewer_port=5001, ws_port=8765):
+    runners = [
+        await start_app(make_video_app(camera_streams), host, video_port),
+        await start_app(make_viewer_app(), host, viewer_port),
+    ]
+    server = await websockets.serve(control_handler, "localhost", ws_port)
+    print(f"Async runtime serving video on :{video_port}, viewer on :{viewer_port}, "
+          f"control on ws://localhost:{ws_port}")
+    try:
+        await server.wait_closed()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
@@ -1,10 +1,29 @@
+import argparse
 import asyncio
 import websockets
-import json
-from flask import Flask, render_template, Response, send_from_directory
+from flask import Flask, render_template, Response, request, abort
 import cv2
 import threading
+import time
 import os
+import logging
+from functools import partial
+from urllib.parse import urlparse, parse_qs
+from frame_hub import FrameHub, EncodedFrame, EncodeCache
+from adaptive import AdaptiveController, encode_level
+from control_protocol import ControlConnection
+from mjpeg import part
+from synthetic_camera import open_capture
+import metrics
+from frame_bus import FrameBusWriter
+from recorder import Recorder, register_playback_routes
+import stream_profiles
+from stream_profiles import PROFILES, DEFAULT_PROFILE, select_profile
+from asset_cache import AssetCache, asset_response
+from fmp4 import Fmp4Stream, ffmpeg_available
+from mux import MuxConnection, CHANNEL_CONTROL, CHANNEL_VIDEO, pack_frame
+
+logger = logging.getLogger(__name__)
 
 # Original Flask app for video streaming
 app = Flask(__name__)
@@ -17,43 +36,328 @@ viewer_app = Flask(__name__,
 # Video stream URL
 video_url = "https://cdn.pixabay.com/video/2022/03/15/110877-689510466_tiny.mp4"
 
-# Original video streaming function
-def generate_video_stream():
-    while True:
-        cap = cv2.VideoCapture(video_url)
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+# How long an fMP4 viewer waits for the first frame and the H.264 init segment
+FMP4_START_TIMEOUT = 5.0
+
+# Capture-and-encode worker shared by every viewer of a camera route
+class CameraStream:
+    def __init__(self, source, idle_timeout=5.0, fallback_fps=30, name='0', frame_bus=False):
+        self.source = source
+        self.name = name
+        # With a frame bus, raw frames also go to shared memory as camera<name>
+        # for local consumers
+        self.frame_bus = frame_bus
+        self._bus_writer = None
+        # Set when something other than HTTP viewers (frame bus, recorder)
+        # needs frames, so capture keeps running with no one watching
+        self.always_on = frame_bus
+        self.idle_timeout = idle_timeout
+        self.fallback_fps = fallback_fps
+        self.fps = fallback_fps
+        # Opt-in H.264 encode shared by the fMP4 viewers, running while there are any
+        self.h264_bitrate = '2M'
+        self.fmp4_viewers = 0
+        self._fmp4 = None
+        # Held while a stream starts, so no viewer joins one that may still fail
+        self._fmp4_start_lock = threading.Lock()
+        self.hub = FrameHub()
+        self.encode_cache = EncodeCache(keep_sequences=4)
+        self.viewers = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_viewer_time = 0
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._capture_loop, daemon=True)
+                self._thread.start()
+
+    def start(self):
+        self.always_on = True
+        self._ensure_running()
+
+    def _has_viewers(self):
+        with self._lock:
+            if self.viewers > 0 or self.always_on:
+                return True
+            return time.time() - self._last_viewer_time < self.idle_timeout
+
+    def _capture_loop(self):
+        while self._has_viewers():
+            cap = open_capture(self.source)
+            if not cap.isOpened():
+                print(f"Could not open video source {self.source}, retrying...")
+                time.sleep(1)
                 continue
-            _, jpeg = cv2.imencode('.jpg', frame)
-            frame_bytes = jpeg.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        cap.release()
+            fps = self.fps = cap.get(cv2.CAP_PROP_FPS) or self.fallback_fps
+            frame_interval = 1.0 / fps
+            next_frame_time = time.time()
+            while cap.isOpened() and self._has_viewers():
+                with metrics.stage_seconds.time(stage='capture'):
+                    ret, frame = cap.read()
+                if not ret:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                capture_time = time.time()
+                if self.frame_bus:
+                    self._publish_raw(frame, capture_time)
+                with metrics.stage_seconds.time(stage='encode'):
+                    _, jpeg = cv2.imencode('.jpg', frame)
+                self.hub.publish(EncodedFrame(jpeg.tobytes(), frame, capture_time))
+                metrics.frames_total.inc(stream=self.name, event='captured')
+                fmp4 = self._fmp4
+                if fmp4 is not None:
+                    fmp4.write(frame)
+
+                # File sources decode faster than real time, so pace them
+                next_frame_time += frame_interval
+                delay = next_frame_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_frame_time = time.time()
+            cap.release()
+
+    def _publish_raw(self, frame, capture_time):
+        if self._bus_writer is None or self._bus_writer.shape != frame.shape:
+            if self._bus_writer is not None:
+                self._bus_writer.close()
+            self._bus_writer = FrameBusWriter(f'camera{self.name}', frame.shape)
+        self._bus_writer.publish(frame, capture_time)
+
+    def encoded_for(self, seq, frame, controller, profile=PROFILES[DEFAULT_PROFILE]):
+        image, jpeg = frame.image, frame.jpeg
+        if profile.size is not None:
+            # Scaled profiles are encoded once per frame for all their viewers
+            def scaled():
+                with metrics.stage_seconds.time(stage='profile_encode'):
+                    return stream_profiles.encode(frame.image, profile)
+            image, jpeg = self.encode_cache.get(seq, profile.name, scaled)
+        if controller is None:
+            return jpeg
+        quality, scale = controller.params
+
+        def encode():
+            with metrics.stage_seconds.time(stage='adaptive_encode'):
+                return encode_level(image, jpeg, quality, scale)
+        return self.encode_cache.get(seq, (profile.name, controller.level), encode)
+
+    async def encoded_for_async(self, seq, frame, controller, profile=PROFILES[DEFAULT_PROFILE]):
+        # Resizes and re-encodes run in the executor, like capture, so one
+        # slow encode never holds up the other viewers and routes on the loop
+        if controller is None and profile.size is None:
+            return frame.jpeg
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.encoded_for, seq, frame, controller, profile)
+
+    def open_fmp4(self, timeout=FMP4_START_TIMEOUT):
+        """Join the shared H.264 encode, starting it if needed; None if ffmpeg is missing or fails.
+
+        A viewer that got a stream must hand it back with release_fmp4(stream).
+        """
+        self.attach()
+        _, frame = self.hub.latest()
+        if frame is None:
+            # The encoder is sized from the first frame
+            _, frame = self.hub.wait(0, timeout)
+        if frame is None or not ffmpeg_available():
+            self.detach()
+            return None
+        with self._fmp4_start_lock:
+            stream = self._fmp4
+            if stream is None or not stream.running:
+                # Viewers of a stream that died release it themselves
+                height, width = frame.image.shape[:2]
+                stream = Fmp4Stream((width, height), self.fps, self.h264_bitrate, name=self.name).start()
+                with self._lock:
+                    self._fmp4, self.fmp4_viewers = stream, 0
+                if not stream.wait_ready(timeout):
+                    with self._lock:
+                        self._fmp4 = None
+                    stream.close()
+                    self.detach()
+                    return None
+            with self._lock:
+                self.fmp4_viewers += 1
+        return stream
+
+    def release_fmp4(self, stream):
+        self.detach()
+        with self._lock:
+            if stream is self._fmp4:
+                self.fmp4_viewers -= 1
+                if self.fmp4_viewers > 0:
+                    return
+                self._fmp4 = None
+        stream.close()
+
+    def attach(self):
+        """Count a viewer and make sure capture is running; every attach() needs a detach()."""
+        with self._lock:
+            self.viewers += 1
+        metrics.clients.inc(endpoint=f'camera/{self.name}')
+        self._ensure_running()
+
+    def detach(self):
+        with self._lock:
+            self.viewers -= 1
+            self._last_viewer_time = time.time()
+        metrics.clients.dec(endpoint=f'camera/{self.name}')
+
+    def next_frame(self, last_seq, timeout=1.0):
+        """For an attached viewer: wait for a frame newer than `last_seq`, as hub.wait() does."""
+        seq, frame = self.hub.wait(last_seq, timeout)
+        if frame is None:
+            # Worker may have exited while idle; restart it if needed
+            self._ensure_running()
+        return seq, frame
+
+    async def next_frame_async(self, last_seq, timeout=1.0):
+        seq, frame = await self.hub.wait_async(last_seq, timeout)
+        if frame is None:
+            self._ensure_running()
+        return seq, frame
+
+    def _record_drops(self, last_seq, seq, controller=None):
+        # Frames published before a viewer's first one were never its to drop
+        if last_seq and seq - last_seq > 1:
+            if controller is not None:
+                controller.record_drops(seq - last_seq - 1)
+            metrics.frames_dropped_total.inc(seq - last_seq - 1, stream=self.name, reason='superseded')
+
+    def generate(self, controller=None, profile=PROFILES[DEFAULT_PROFILE]):
+        self.attach()
+        try:
+            # A new viewer gets the current frame straight away
+            last_seq, frame = self.hub.latest()
+            while True:
+                if frame is not None:
+                    data = self.encoded_for(last_seq, frame, controller, profile)
+                    send_start = time.time()
+                    yield part(data, frame.timestamp)
+                    metrics.frames_total.inc(stream=self.name, event='sent')
+                    if controller is not None:
+                        # The server resumes us once the write has drained
+                        controller.record_send(time.time() - send_start, len(data))
+                        delay = send_start + controller.frame_interval - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+
+                # Frames published while we were sending are superseded by the newest
+                seq, latest = self.next_frame(last_seq)
+                if latest is None:
+                    continue
+                self._record_drops(last_seq, seq, controller)
+                last_seq, frame = seq, latest
+        finally:
+            self.detach()
+
+    async def generate_async(self, controller=None, profile=PROFILES[DEFAULT_PROFILE]):
+        # Coroutine twin of generate() for the single-loop runtime; viewers
+        # await the hub instead of holding a thread each
+        self.attach()
+        try:
+            last_seq, frame = self.hub.latest()
+            while True:
+                if frame is not None:
+                    data = await self.encoded_for_async(last_seq, frame, controller, profile)
+                    send_start = time.time()
+                    yield part(data, frame.timestamp)
+                    metrics.frames_total.inc(stream=self.name, event='sent')
+                    if controller is not None:
+                        controller.record_send(time.time() - send_start, len(data))
+                        await asyncio.sleep(send_start + controller.frame_interval - time.time())
+
+                seq, latest = await self.next_frame_async(last_seq)
+                if latest is None:
+                    continue
+                self._record_drops(last_seq, seq, controller)
+                last_seq, frame = seq, latest
+        finally:
+            self.detach()
+
+    def generate_fmp4(self, stream):
+        # The init segment, then one fragment per frame; lagging viewers skip to a keyframe
+        for fragment in stream.iter_fragments():
+            yield fragment
+            metrics.frames_total.inc(stream=self.name, event='sent')
+
+    async def generate_fmp4_async(self, stream):
+        yield stream.init
+        async for fragment in stream.fragments_async():
+            yield fragment
+            metrics.frames_total.inc(stream=self.name, event='sent')
+
+camera_streams = {
+    0: CameraStream(video_url, name='0'),
+    1: CameraStream(video_url, name='1'),
+}
+
+# Original video streaming function
+def generate_video_stream(camera_id=0, adaptive=True, profile=PROFILES[DEFAULT_PROFILE]):
+    # Each viewer gets its own controller; ?adaptive=0 always sends the profile's encode
+    controller = AdaptiveController() if adaptive else None
+    return camera_streams[camera_id].generate(controller, profile)
+
+def adaptive_requested():
+    return request.args.get('adaptive', '1') not in ('0', 'false', 'off')
+
+def requested_profile():
+    try:
+        return select_profile(request.args.get('profile'), request.args.get('resolution'))
+    except ValueError as e:
+        abort(400, str(e))
 
 # Original routes for app
 @app.route('/camera/0')
 def camera_0():
-    return Response(generate_video_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_video_stream(0, adaptive_requested(), requested_profile()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/camera/1')
 def camera_1():
-    return Response(generate_video_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_video_stream(1, adaptive_requested(), requested_profile()),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Opt-in H.264 as fragmented MP4 for MediaSource players; MJPEG stays at /camera/<id>
+@app.route('/camera/<int:camera_id>/fmp4')
+def camera_fmp4(camera_id):
+    camera = camera_streams.get(camera_id)
+    if camera is None:
+        abort(404)
+    stream = camera.open_fmp4()
+    if stream is None:
+        abort(503, f"H.264 is unavailable, use /camera/{camera_id}")
+    response = Response(camera.generate_fmp4(stream), mimetype=stream.mime_type,
+                        headers={'Cache-Control': 'no-cache'})
+    # Runs even if the viewer leaves before the first fragment
+    response.call_on_close(partial(camera.release_fmp4, stream))
+    return response
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 # Routes for viewer_app (Three.js viewer)
 @viewer_app.route('/')
 def viewer_index():
     return render_template('viewer.html')
 
+# Models are served from memory, precompressed, with ETags for 304 reloads
+model_assets = AssetCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
 @viewer_app.route('/models/<path:filename>')
 def serve_model(filename):
-    models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-    return send_from_directory(models_dir, filename)
+    asset = model_assets.get(filename)
+    if asset is None:
+        abort(404)
+    status, headers, body = asset_response(asset, request.headers, request.args.get('v'))
+    return Response(body, status=status, headers=headers)
 
 # Original ROV control function
 def control_rov(command):
@@ -67,71 +371,70 @@ def control_rov(command):
             if abs(axis_value) > 0.1:
                 print(f"Axis {i}: {axis_value:.2f}")
 
-# Original WebSocket handler
-# WebSocket handler with change tracking
-previous_axes = None
-previous_buttons = None
+async def handle_mux(websocket, path):
+    # Control and one camera on a single prioritized socket (see mux.py):
+    # ws://localhost:8765/mux?camera=0&profile=low; camera=none for control only
+    query = {k: v[0] for k, v in parse_qs(urlparse(path).query).items()}
+    camera_param = query.get('camera', '0')
+    stream = None
+    if camera_param != 'none':
+        stream = camera_streams.get(int(camera_param)) if camera_param.isdigit() else None
+        if stream is None:
+            await websocket.close(1008, f"Unknown camera {camera_param}")
+            return
+    try:
+        profile = select_profile(query.get('profile'), query.get('resolution'))
+    except ValueError as e:
+        await websocket.close(1008, str(e))
+        return
+
+    connection = MuxConnection(websocket)
+    control = ControlConnection(websocket, reply=partial(connection.sender.send, CHANNEL_CONTROL))
+    connection.on(CHANNEL_CONTROL, control.receive)
+
+    async def apply_control(sender):
+        await control.apply_loop()
+
+    async def send_video(sender):
+        # Offers every new frame; the sender drops any it cannot start in time.
+        # Profile encodes run in the executor, never ahead of control on the loop
+        last_seq = 0
+        while True:
+            seq, frame = await stream.next_frame_async(last_seq)
+            if frame is None:
+                continue
+            last_seq = seq
+            jpeg = await stream.encoded_for_async(seq, frame, None, profile)
+            sender.put(CHANNEL_VIDEO, pack_frame(jpeg, seq, frame.timestamp, int(camera_param)))
+
+    connection.produce(apply_control)
+    if stream is not None:
+        stream.attach()
+        connection.produce(send_video)
+    metrics.clients.inc(endpoint='mux')
+    try:
+        await connection.serve()
+    finally:
+        if stream is not None:
+            stream.detach()
+        metrics.clients.dec(endpoint='mux')
 
 async def handle_websocket(websocket, path):
-    global previous_axes, previous_buttons
+    if urlparse(path or '').path == '/mux':
+        await handle_mux(websocket, path)
+        return
+    connection = ControlConnection(websocket)
+    applier = asyncio.ensure_future(connection.apply_loop())
+    metrics.clients.inc(endpoint='control')
     try:
         async for message in websocket:
-            data = json.loads(message)
-            
-            # Process gamepad-related messages
-            if 'axes' in data or 'buttons' in data:
-                changed_axes = False
-                changed_buttons = False
-                
-                # Track axes changes
-                if 'axes' in data:
-                    if previous_axes is None:
-                        previous_axes = [0] * len(data['axes'])
-                    
-                    for i, (current, previous) in enumerate(zip(data['axes'], previous_axes)):
-                        # Only log significant changes (threshold of 0.1)
-                        if abs(current - previous) > 0.1:
-                            print(f"Axis {i} changed: {current:.2f}")
-                            changed_axes = True
-                    
-                    previous_axes = data['axes']
-                
-                # Track button changes
-                if 'buttons' in data:
-                    if previous_buttons is None:
-                        previous_buttons = [0] * len(data['buttons'])
-                    
-                    for i, (current, previous) in enumerate(zip(data['buttons'], previous_buttons)):
-                        # Log button state changes
-                        if current != previous:
-                            if current:
-                                print(f"Button {i} pressed")
-                                changed_buttons = True
-                    
-                    previous_buttons = data['buttons']
-                
-                # Send acknowledgment if any changes occurred
-                if changed_axes or changed_buttons:
-                    await websocket.send(json.dumps({"status": "success", "message": "Input received"}))
-            
-            # Process advanced controller updates
-            elif 'command' in data and data['command'] == 'update':
-                changed_advanced_settings = False
-                
-                # Remove 'command' from the data to process other settings
-                data.pop('command', None)
-                
-                # Print out each advanced controller setting update
-                for key, value in data.items():
-                    print(f"Advanced Controller - {key}: {value}")
-                    changed_advanced_settings = True
-                
-                # Send acknowledgment for advanced controller updates
-                if changed_advanced_settings:
-                    await websocket.send(json.dumps({"status": "success", "message": "Advanced settings received"}))
+            await connection.receive(message)
     
     except websockets.exceptions.ConnectionClosed:
         pass
+    finally:
+        applier.cancel()
+        metrics.clients.dec(endpoint='control')
         
 async def websocket_server():
     server = await websockets.serve(handle_websocket, "localhost", 8765)
@@ -143,10 +446,49 @@ def start_flask_app():
     app.run(host='0.0.0.0', port=5000, threaded=True)
 
 def start_viewer_app():
+    # Compress models before the first viewer asks for them
+    threading.Thread(target=model_assets.preload, daemon=True).start()
     viewer_app.run(host='0.0.0.0', port=5001, threaded=True)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="ROV video, viewer and control server")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="serve everything from one asyncio event loop (requires aiohttp)")
+    parser.add_argument('--source', default=None,
+                        help="video source for both cameras: a device index, file, URL or "
+                             "synthetic[:WxH][@FPS] (defaults to video_url)")
+    parser.add_argument('--frame-bus', action='store_true',
+                        help="also publish raw frames to shared memory (shm://camera0, shm://camera1) "
+                             "for consumers on this host")
+    parser.add_argument('--record', metavar='DIR',
+                        help="record both cameras under DIR and serve them at /recordings")
+    parser.add_argument('--h264-bitrate', default='2M',
+                        help="target bitrate of the /camera/<id>/fmp4 H.264 streams, e.g. 2M")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    # Start both Flask apps and WebSocket server concurrently
-    threading.Thread(target=start_flask_app, daemon=True).start()
-    threading.Thread(target=start_viewer_app, daemon=True).start()
-    asyncio.run(websocket_server())
\ No newline at end of file
+    args = parse_args()
+    if args.source:
+        for stream in camera_streams.values():
+            stream.source = int(args.source) if args.source.isdigit() else args.source
+    if args.frame_bus:
+        for stream in camera_streams.values():
+            stream.frame_bus = True
+            stream.start()
+    if args.record:
+        # Recorders read the same encodes the viewers get; nothing is re-encoded
+        for camera_id, stream in camera_streams.items():
+            Recorder(stream.hub, args.record, f'camera{camera_id}').start()
+            stream.start()
+        register_playback_routes(app, args.record)
+    for stream in camera_streams.values():
+        stream.h264_bitrate = args.h264_bitrate
+
+    if args.use_async:
+        import rov_async_server
+        asyncio.run(rov_async_server.main(camera_streams, handle_websocket))
+    else:
+        # Start both Flask apps and WebSocket server concurrently
+        threading.Thread(target=start_flask_app, daemon=True).start()
+        threading.Thread(target=start_viewer_app, daemon=True).start()
+        asyncio.run(websocket_server())
\ No newline at end of file
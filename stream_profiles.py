@@ -0,0 +1,71 @@
+import re
+from collections import namedtuple
+
+import cv2
+
+# Named output resolutions for camera routes. Each profile is encoded once
+# per captured frame and shared by every viewer that asks for it, so a
+# thumbnail tile or the detector (which scores 128x128 inputs) no longer
+# pulls full-HD JPEGs over the tether.
+#
+#   /camera/0?profile=low
+#   /camera/0?resolution=320x180     smallest profile at least that large
+#
+# `size` is a bounding box (the aspect ratio is kept, frames are never
+# upscaled); None means the source resolution. `stream` names the Picamera2
+# stream a profile is cut from: the full-resolution main stream, or the
+# ISP-scaled lores stream, which costs the Pi no resize at all.
+
+Profile = namedtuple('Profile', ['name', 'size', 'quality', 'stream'])
+
+LORES_SIZE = (640, 360)
+
+PROFILES = {
+    'full': Profile('full', None, 95, 'main'),
+    'low': Profile('low', LORES_SIZE, 80, 'lores'),
+    'thumb': Profile('thumb', (320, 180), 70, 'lores'),
+}
+DEFAULT_PROFILE = 'full'
+
+_RESOLUTION_RE = re.compile(r'^(\d+)x(\d+)$')
+
+
+def select_profile(profile=None, resolution=None):
+    """Profile for a ?profile= or ?resolution=WxH request; raises ValueError for bad values."""
+    if profile:
+        if profile not in PROFILES:
+            raise ValueError(f"unknown profile {profile!r}, expected one of {', '.join(PROFILES)}")
+        return PROFILES[profile]
+    if resolution:
+        match = _RESOLUTION_RE.match(resolution.lower())
+        if not match:
+            raise ValueError(f"resolution must look like 640x360, got {resolution!r}")
+        width, height = int(match.group(1)), int(match.group(2))
+        sized = sorted((p for p in PROFILES.values() if p.size is not None), key=lambda p: p.size[0] * p.size[1])
+        for candidate in sized:
+            if candidate.size[0] >= width and candidate.size[1] >= height:
+                return candidate
+    return PROFILES[DEFAULT_PROFILE]
+
+
+def fit(image, size):
+    """Downscale `image` to fit inside `size` (width, height), keeping its aspect ratio."""
+    if size is None:
+        return image
+    height, width = image.shape[:2]
+    scale = min(size[0] / width, size[1] / height)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def jpeg_params(profile):
+    return [cv2.IMWRITE_JPEG_QUALITY, profile.quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+
+
+def encode(image, profile):
+    """Return (scaled image, JPEG bytes) for one profile."""
+    image = fit(image, profile.size)
+    ret, jpeg = cv2.imencode('.jpg', image, jpeg_params(profile))
+    return image, jpeg.tobytes()
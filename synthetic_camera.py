@@ -0,0 +1,245 @@
+"""Synthetic camera stand-in for benchmarks and development without hardware.
+
+SyntheticCapture mimics the parts of cv2.VideoCapture the servers use and
+produces a deterministic, moving textured scene at a fixed frame rate.
+open_capture() is the capture factory the servers call: a source string of
+the form `synthetic[:WIDTHxHEIGHT][@FPS]` returns a SyntheticCapture, and
+anything else goes to cv2.VideoCapture unchanged. FakePicamera2 plays the
+same role for the Picamera2-based PiCameraHandler.
+
+Run as a script to serve the same scene as an MJPEG upstream, the way
+rov_server's /camera routes feed detect_stream:
+
+    python synthetic_camera.py --port 5090 --size 640x480 --fps 30
+"""
+import argparse
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from frame_hub import FrameHub
+from mjpeg import MIMETYPE, part
+
+DEFAULT_SIZE = (640, 480)
+DEFAULT_FPS = 30
+
+_SOURCE_RE = re.compile(r'^synthetic(?::(\d+)x(\d+))?(?:@(\d+(?:\.\d+)?))?$')
+
+
+def parse_source(source):
+    """Return (size, fps) for a synthetic source string, or None for any other source."""
+    match = _SOURCE_RE.match(source) if isinstance(source, str) else None
+    if not match:
+        return None
+    width, height, fps = match.groups()
+    size = (int(width), int(height)) if width else DEFAULT_SIZE
+    return size, float(fps) if fps else DEFAULT_FPS
+
+
+def open_capture(source):
+    parsed = parse_source(source)
+    if parsed is None:
+        return cv2.VideoCapture(source)
+    size, fps = parsed
+    return SyntheticCapture(size, fps)
+
+
+class SyntheticCapture:
+    """A seeded scene that pans a little every frame, with the frame number drawn in.
+
+    read() blocks until the next frame is due, as a real camera does, so a
+    consumer reading in a loop gets `fps` frames per second.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, fps=DEFAULT_FPS, seed=0):
+        self.fps = fps
+        self.seed = seed
+        self.index = 0
+        self._opened = True
+        self._next_frame_time = None
+        self._build(size)
+
+    def _build(self, size):
+        self.size = size
+        width, height = size
+        rng = np.random.default_rng(self.seed)
+        # Smooth low-frequency texture plus fine noise compresses like real footage
+        coarse = rng.integers(40, 200, (height // 16 + 1, 2 * width // 16 + 1, 3), dtype=np.uint8)
+        scene = cv2.resize(coarse, (2 * width, height), interpolation=cv2.INTER_CUBIC)
+        scene = cv2.add(scene, rng.integers(0, 24, scene.shape, dtype=np.uint8))
+        for _ in range(6):
+            x0, x1 = rng.integers(0, 2 * width, 2)
+            y0, y1 = rng.integers(0, height, 2)
+            cv2.line(scene, (int(x0), int(y0)), (int(x1), int(y1)), (20, 20, 20), 2)
+        self._scene = scene
+
+    def isOpened(self):
+        return self._opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.size[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.size[1]
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.index
+        return 0
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self._build((int(value), self.size[1]))
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self._build((self.size[0], int(value)))
+        elif prop == cv2.CAP_PROP_FPS:
+            self.fps = float(value)
+        elif prop == cv2.CAP_PROP_POS_FRAMES:
+            self.index = int(value)
+        else:
+            return False
+        return True
+
+    def read(self):
+        if not self._opened:
+            return False, None
+        now = time.time()
+        if self._next_frame_time is None:
+            self._next_frame_time = now
+        delay = self._next_frame_time - now
+        if delay > 0:
+            time.sleep(delay)
+        # A slow reader gets the next frame now rather than a burst of catch-up frames
+        self._next_frame_time = max(self._next_frame_time, now) + 1.0 / self.fps
+
+        width, height = self.size
+        offset = (self.index * 4) % width
+        frame = self._scene[:, offset:offset + width].copy()
+        cv2.putText(frame, str(self.index), (20, height - 20), cv2.FONT_HERSHEY_SIMPLEX,
+                    1, (255, 255, 255), 2)
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        self._opened = False
+
+
+class FakePicamera2:
+    """Stands in for picamera2.Picamera2 off the Pi, backed by SyntheticCapture.
+
+    Covers the calls PiCameraHandler makes: an RGB888 main stream plus an
+    optional YUV420 lores stream, captured singly or together from the same
+    frame. Pass it as the handler's camera_factory.
+    """
+
+    def __init__(self, camera_num=0, fps=DEFAULT_FPS):
+        self.camera_num = camera_num
+        self.fps = fps
+        self.config = None
+        self.controls = {}
+        self.started = False
+        self._capture = None
+
+    def create_preview_configuration(self, main=None, lores=None, buffer_count=4, **kwargs):
+        return {
+            'main': dict(main or {'size': DEFAULT_SIZE, 'format': 'RGB888'}),
+            'lores': dict(lores) if lores else None,
+            'buffer_count': buffer_count,
+        }
+
+    def configure(self, config):
+        self.config = config
+        self._capture = SyntheticCapture(tuple(config['main']['size']), self.fps, seed=self.camera_num)
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+
+    def start(self):
+        if self.config is None:
+            raise RuntimeError("camera must be configured before it is started")
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.stop()
+        if self._capture is not None:
+            self._capture.release()
+
+    def _arrays(self, names):
+        if not self.started:
+            raise RuntimeError("camera is not started")
+        _, main = self._capture.read()
+        arrays = []
+        for name in names:
+            if name == 'main':
+                arrays.append(main)
+            elif name == 'lores' and self.config['lores']:
+                # The ISP's lores output is planar YUV420, as on the Pi
+                small = cv2.resize(main, tuple(self.config['lores']['size']), interpolation=cv2.INTER_AREA)
+                arrays.append(cv2.cvtColor(small, cv2.COLOR_BGR2YUV_I420))
+            else:
+                raise ValueError(f"no {name} stream configured")
+        return arrays
+
+    def capture_array(self, name='main'):
+        return self._arrays([name])[0]
+
+    def capture_arrays(self, names=('main',)):
+        return self._arrays(names), {'SensorTimestamp': int(time.time() * 1e9)}
+
+
+def serve_mjpeg(port=5090, size=DEFAULT_SIZE, fps=DEFAULT_FPS, quality=80, host='0.0.0.0'):
+    """Serve the synthetic scene as multipart MJPEG on every path."""
+    hub = FrameHub()
+
+    def produce():
+        cap = SyntheticCapture(size, fps)
+        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        while True:
+            ret, frame = cap.read()
+            timestamp = time.time()
+            _, jpeg = cv2.imencode('.jpg', frame, encode_param)
+            hub.publish(jpeg.tobytes(), timestamp)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', MIMETYPE)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            last_seq = 0
+            try:
+                while True:
+                    seq, jpeg = hub.wait(last_seq, timeout=1.0)
+                    if jpeg is None:
+                        continue
+                    last_seq = seq
+                    self.wfile.write(part(jpeg, hub.timestamp))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    threading.Thread(target=produce, daemon=True).start()
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"Synthetic MJPEG camera {size[0]}x{size[1]}@{fps:g} on http://{host}:{port}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a synthetic MJPEG camera")
+    parser.add_argument('--port', type=int, default=5090)
+    parser.add_argument('--size', default='640x480', help="WIDTHxHEIGHT")
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS)
+    parser.add_argument('--quality', type=int, default=80)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    serve_mjpeg(args.port, (width, height), args.fps, args.quality)
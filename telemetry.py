@@ -0,0 +1,276 @@
+import asyncio
+import heapq
+import json
+import threading
+import time
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    # Batches fall back to compact JSON without it
+    msgpack = None
+
+# 8 hours at 10 samples per second; about 4.6 MB per channel
+DEFAULT_CAPACITY = 8 * 3600 * 10
+MAX_QUERY_POINTS = 5000
+
+
+class RingBuffer:
+    """Fixed-size, time-ordered store of (timestamp, value) samples.
+
+    Memory is allocated once; when full, the oldest samples are overwritten.
+    Timestamps are expected to be non-decreasing, which keeps both halves of
+    the ring sorted so range lookups are binary searches.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.head = 0
+        self._lock = threading.Lock()
+
+    def append(self, timestamp, value):
+        with self._lock:
+            self.times[self.head] = timestamp
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def _segments(self):
+        # Chronological views over the filled part of the ring
+        if self.count < self.capacity:
+            return [(self.times[:self.count], self.values[:self.count])]
+        return [(self.times[self.head:], self.values[self.head:]),
+                (self.times[:self.head], self.values[:self.head])]
+
+    def span(self):
+        with self._lock:
+            if self.count == 0:
+                return None
+            segments = self._segments()
+            return float(segments[0][0][0]), float(self.times[self.head - 1])
+
+    def latest(self):
+        with self._lock:
+            if self.count == 0:
+                return None
+            return float(self.times[self.head - 1]), float(self.values[self.head - 1])
+
+    def range(self, start, end):
+        """Copy out the samples with start <= timestamp < end, oldest first."""
+        with self._lock:
+            times, values = [], []
+            for seg_times, seg_values in self._segments():
+                lo, hi = np.searchsorted(seg_times, [start, end])
+                if hi > lo:
+                    times.append(seg_times[lo:hi].copy())
+                    values.append(seg_values[lo:hi].copy())
+        if not times:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
+
+
+def downsample(times, values, start, end, points):
+    """Reduce samples to at most `points` equal-width windows of min/max/mean.
+
+    Empty windows are omitted, so gaps in the data stay visible.
+    """
+    if len(times) == 0:
+        return {'t': [], 'min': [], 'max': [], 'mean': [], 'count': []}
+    if len(times) <= points:
+        return {'t': times.tolist(), 'min': values.tolist(), 'max': values.tolist(),
+                'mean': values.tolist(), 'count': [1] * len(times)}
+
+    edges = np.linspace(start, end, points + 1)
+    starts = np.searchsorted(times, edges[:-1])
+    ends = np.searchsorted(times, edges[1:])
+    filled = ends > starts
+    starts, ends = starts[filled], ends[filled]
+    counts = ends - starts
+
+    sums = np.add.reduceat(values, starts)
+    centers = (edges[:-1][filled] + edges[1:][filled]) / 2
+    return {
+        't': centers.tolist(),
+        'min': np.minimum.reduceat(values, starts).tolist(),
+        'max': np.maximum.reduceat(values, starts).tolist(),
+        'mean': (sums / counts).tolist(),
+        'count': counts.tolist(),
+    }
+
+
+class TelemetryStore:
+    """One RingBuffer per sensor channel, plus windowed history queries."""
+
+    def __init__(self, channels, capacity=DEFAULT_CAPACITY):
+        self.buffers = {name: RingBuffer(capacity) for name in channels}
+
+    def record(self, sample, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for name, value in sample.items():
+            buffer = self.buffers.get(name)
+            if buffer is not None:
+                buffer.append(timestamp, value)
+
+    def latest(self):
+        sample = {}
+        for name, buffer in self.buffers.items():
+            latest = buffer.latest()
+            if latest is not None:
+                sample[name] = latest[1]
+        return sample
+
+    def describe(self):
+        return {name: {'samples': buffer.count, 'capacity': buffer.capacity, 'span': buffer.span()}
+                for name, buffer in self.buffers.items()}
+
+    def query(self, channel, start=None, end=None, points=500):
+        if channel not in self.buffers:
+            raise KeyError(channel)
+        buffer = self.buffers[channel]
+        span = buffer.span()
+        if span is None:
+            return {'channel': channel, 'start': start, 'end': end, **downsample([], [], 0, 0, 0)}
+
+        start = span[0] if start is None else float(start)
+        # End is exclusive, so nudge past the newest sample by default
+        end = np.nextafter(span[1], np.inf) if end is None else float(end)
+        points = max(1, min(int(points), MAX_QUERY_POINTS))
+        times, values = buffer.range(start, end)
+        return {'channel': channel, 'start': start, 'end': float(end),
+                **downsample(times, values, start, end, points)}
+
+
+def parse_channel_rates(spec, rates):
+    """Parse "depth:10,battery" into {channel: Hz}.
+
+    A channel without a rate gets its sampling rate, and no channel is sent
+    faster than it is sampled. An empty spec subscribes to everything.
+    Raises ValueError for unknown channels or bad rates.
+    """
+    if spec is not None and not isinstance(spec, (str, dict)):
+        raise ValueError("channels must be a string or object")
+    if isinstance(spec, dict):
+        items = [(name, rate) for name, rate in spec.items()]
+    elif spec:
+        items = [item.partition(':')[::2] for item in spec.split(',') if item]
+    else:
+        return dict(rates)
+    wanted = {}
+    for name, rate in items:
+        if name not in rates:
+            raise ValueError(f"unknown telemetry channel {name!r}")
+        try:
+            rate = float(rate) if rate not in (None, '') else rates[name]
+        except TypeError:
+            raise ValueError(f"rate for {name} must be a number")
+        if rate <= 0:
+            raise ValueError(f"rate for {name} must be positive")
+        wanted[name] = min(rate, rates[name])
+    return wanted
+
+
+def batch_format(requested):
+    return 'msgpack' if requested == 'msgpack' and msgpack is not None else 'json'
+
+
+def pack_batch(batch, fmt='json'):
+    """Encode {channel: [(timestamp, value), ...]} as one telemetry message.
+
+    Timestamps are sent once as a base in seconds plus integer millisecond
+    offsets per sample:
+        {"type": "telemetry", "t": base, "channels": {"depth": [[ms, value], ...]}}
+    """
+    base = min(timestamp for samples in batch.values() for timestamp, _ in samples)
+    message = {
+        'type': 'telemetry',
+        't': round(base, 3),
+        'channels': {name: [[round((timestamp - base) * 1000), value] for timestamp, value in samples]
+                     for name, samples in batch.items()},
+    }
+    if fmt == 'msgpack':
+        return msgpack.packb(message)
+    return json.dumps(message, separators=(',', ':'))
+
+
+class TelemetrySubscription:
+    """One client's channels and rates, and the samples waiting for its next batch."""
+
+    # Sampling jitter must not make a 5 Hz subscriber of a 10 Hz channel drop to 3.3 Hz
+    RATE_TOLERANCE = 0.9
+
+    def __init__(self, rates, batch_interval=0.25, fmt='json'):
+        self.rates = rates
+        self.batch_interval = batch_interval
+        self.format = fmt
+        self.dropped = 0
+        self._pending = {}
+        self._last = {}
+
+    def offer(self, name, timestamp, value):
+        rate = self.rates.get(name)
+        if rate is None:
+            return
+        last = self._last.get(name)
+        if last is not None and timestamp - last < self.RATE_TOLERANCE / rate:
+            self.dropped += 1
+            return
+        self._last[name] = timestamp
+        self._pending.setdefault(name, []).append((timestamp, value))
+
+    def take(self):
+        """Return and clear the pending samples ({} if there are none)."""
+        batch, self._pending = self._pending, {}
+        return batch
+
+
+class TelemetryScheduler:
+    """Samples each channel at its own rate into a TelemetryStore and fans out to subscribers.
+
+    `sources` maps channel names to callables returning the current value;
+    they run on the event loop, so they must not block. Each channel keeps a
+    fixed cadence: a late sample does not shift the ones after it, and
+    samples missed entirely are skipped rather than bursted.
+    """
+
+    def __init__(self, store, sources, rates):
+        self.store = store
+        self.sources = sources
+        self.rates = {name: float(rates[name]) for name in sources}
+        self.subscribers = set()
+
+    def subscribe(self, rates=None, batch_interval=0.25, fmt='json'):
+        subscription = TelemetrySubscription(parse_channel_rates(rates, self.rates), batch_interval, fmt)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+
+    def sample(self, name):
+        timestamp = time.time()
+        value = self.sources[name]()
+        self.store.record({name: value}, timestamp)
+        for subscription in list(self.subscribers):
+            subscription.offer(name, timestamp, value)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        due = [(now, name) for name in self.sources]
+        heapq.heapify(due)
+        while True:
+            when, name = heapq.heappop(due)
+            delay = when - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.sample(name)
+            interval = 1.0 / self.rates[name]
+            when += interval
+            if when < loop.time():
+                when += interval * ((loop.time() - when) // interval + 1)
+            heapq.heappush(due, (when, name))
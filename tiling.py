@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+
+# Overlapping tile grid for localized crack classification. Every tile of
+# every frame goes through one batched predict call; the per-tile scores
+# become a coarse probability heatmap, and edge/contour work is limited to
+# the tiles that scored positive.
+
+DEFAULT_TILE_SIZE = 224
+DEFAULT_OVERLAP = 0.25
+# Heatmap is accumulated at 1/HEATMAP_SCALE resolution and upscaled for display
+HEATMAP_SCALE = 8
+
+
+def _starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    # Last tile is aligned to the edge so the border is always covered
+    starts.append(length - tile)
+    return starts
+
+
+def tile_grid(shape, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP):
+    """Return (x, y, w, h) boxes covering a frame of `shape`, row by row."""
+    height, width = shape[:2]
+    tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+    stride_x = max(1, int(tile_w * (1 - overlap)))
+    stride_y = max(1, int(tile_h * (1 - overlap)))
+    return [(x, y, tile_w, tile_h)
+            for y in _starts(height, tile_h, stride_y)
+            for x in _starts(width, tile_w, stride_x)]
+
+
+def crop_tiles(frame, boxes):
+    # Views only; the backend preprocessing does the resize and copy
+    return [frame[y:y + h, x:x + w] for x, y, w, h in boxes]
+
+
+def heatmap(shape, boxes, scores, scale=HEATMAP_SCALE):
+    """Average the tile scores over every pixel they cover, at reduced size."""
+    height, width = shape[:2]
+    small = (max(1, height // scale), max(1, width // scale))
+    total = np.zeros(small, dtype=np.float32)
+    coverage = np.zeros(small, dtype=np.float32)
+    for (x, y, w, h), score in zip(boxes, scores):
+        x0, y0 = x // scale, y // scale
+        x1, y1 = max(x0 + 1, (x + w) // scale), max(y0 + 1, (y + h) // scale)
+        total[y0:y1, x0:x1] += score
+        coverage[y0:y1, x0:x1] += 1
+    return total / np.maximum(coverage, 1)
+
+
+def overlay_heatmap(frame, heat, alpha=0.35):
+    colored = cv2.applyColorMap((np.clip(heat, 0, 1) * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    colored = cv2.resize(colored, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_LINEAR)
+    return cv2.addWeighted(frame, 1 - alpha, colored, alpha, 0)
+
+
+def edges_in_boxes(gray, boxes):
+    """Canny edges computed only inside `boxes`, zero elsewhere."""
+    edges = np.zeros_like(gray)
+    for x, y, w, h in boxes:
+        roi = cv2.Canny(cv2.GaussianBlur(gray[y:y + h, x:x + w], (5, 5), 0), 50, 150)
+        # Overlapping tiles OR their edges together rather than double counting
+        np.maximum(edges[y:y + h, x:x + w], roi, out=edges[y:y + h, x:x + w])
+    return edges
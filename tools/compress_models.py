@@ -0,0 +1,91 @@
+"""Precompress the viewer's 3D models, optionally applying mesh compression first.
+
+Writes .gz and .br sidecars next to every asset under the models directory;
+asset_cache serves those instead of compressing when the server starts.
+With --mesh, each .gltf/.glb is first rewritten with geometry compression
+to <name>.<mesh>.glb, which the viewer loads with ?model=<name>.<mesh>.glb:
+
+- draco    gltf-pipeline -d      (decoded in the viewer by DRACOLoader)
+- meshopt  gltfpack -cc          (decoded in the viewer by MeshoptDecoder)
+
+Both tools are run from PATH, or through npx when they are not installed.
+
+    python tools/compress_models.py models/ --mesh meshopt
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asset_cache import MIN_COMPRESS_BYTES, SIDECARS, compress  # noqa: E402
+
+MODEL_EXTENSIONS = ('.gltf', '.glb')
+SKIP_EXTENSIONS = tuple(SIDECARS.values()) + ('.png', '.jpg', '.jpeg', '.ktx2', '.webp')
+
+MESH_TOOLS = {
+    'draco': ('gltf-pipeline', lambda src, dst: ['-i', src, '-o', dst, '-d']),
+    'meshopt': ('gltfpack', lambda src, dst: ['-i', src, '-o', dst, '-cc']),
+}
+
+
+def mesh_compress(path, mesh):
+    tool, arguments = MESH_TOOLS[mesh]
+    stem = os.path.splitext(path)[0]
+    output = f'{stem}.{mesh}.glb'
+    command = [tool] if shutil.which(tool) else ['npx', '--yes', tool]
+    try:
+        subprocess.run(command + arguments(path, output), check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = getattr(e, 'stderr', '') or str(e)
+        print(f"{tool} failed on {path}: {detail.strip()}")
+        return None
+    return output
+
+
+def write_sidecars(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    sizes = {}
+    if len(data) < MIN_COMPRESS_BYTES:
+        return sizes
+    for encoding, suffix in SIDECARS.items():
+        body = compress(data, encoding, best=True)
+        if body is None:
+            continue
+        with open(path + suffix, 'wb') as f:
+            f.write(body)
+        sizes[encoding] = len(body)
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', nargs='?', default='models')
+    parser.add_argument('--mesh', choices=sorted(MESH_TOOLS), help='apply mesh compression to .gltf/.glb files')
+    args = parser.parse_args()
+
+    paths = []
+    for root, _, files in os.walk(args.directory):
+        for name in sorted(files):
+            if name.endswith(SKIP_EXTENSIONS) or '.draco.' in name or '.meshopt.' in name:
+                continue
+            paths.append(os.path.join(root, name))
+
+    if args.mesh:
+        for path in [p for p in paths if p.endswith(MODEL_EXTENSIONS)]:
+            output = mesh_compress(path, args.mesh)
+            if output is not None:
+                paths.append(output)
+
+    print(f"{'asset':<40} {'bytes':>12} {'gzip':>12} {'br':>12}")
+    for path in paths:
+        sizes = write_sidecars(path)
+        print(f"{os.path.relpath(path, args.directory):<40} {os.path.getsize(path):>12} "
+              f"{sizes.get('gzip', '-'):>12} {sizes.get('br', '-'):>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Convert the Keras crack model for the fast inference backends and compare them.
+
+Writes TFLite float16 and int8 exports, plus ONNX when tf2onnx is installed,
+next to the source model. Each artifact is then loaded through
+inference_backends and reported against the Keras reference for:
+
+- single-frame and batched latency
+- mean and max absolute output difference
+- agreement of the crack decision, and accuracy when labelled images are given
+
+    python tools/convert_crack_model.py crackDetectionModels/best_model.keras \\
+        --calibration-dir samples/ --eval-dir labelled/
+
+--eval-dir may contain `crack/` and `no_crack/` subfolders for accuracy,
+or just images for agreement only.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference_backends import load_backend, preprocess_batch  # noqa: E402
+
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.bmp')
+
+
+def load_images(directory, limit=None):
+    paths = []
+    for pattern in IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+    paths = sorted(paths)[:limit]
+    images = [cv2.imread(path) for path in paths]
+    return [(path, image) for path, image in zip(paths, images) if image is not None]
+
+
+def representative_batches(images, input_size, count=200):
+    if not images:
+        print("No calibration images given; int8 calibration uses random frames "
+              "and will be less accurate")
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (input_size[1], input_size[0], 3), dtype=np.uint8)
+                  for _ in range(count)]
+
+    def generator():
+        for image in images[:count]:
+            yield [preprocess_batch([image], input_size)]
+    return generator
+
+
+def export_tflite(model, path, quantization, calibration):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # Integer kernels inside, float input and output so preprocessing is unchanged
+        converter.representative_dataset = calibration
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                                               tf.lite.OpsSet.TFLITE_BUILTINS]
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, path):
+    try:
+        import tf2onnx
+    except ImportError:
+        print("tf2onnx is not installed; skipping the ONNX export")
+        return False
+    import tensorflow as tf
+    signature = [tf.TensorSpec([None, *model.input_shape[1:]], tf.float32, name='input')]
+    # from_function rather than from_keras, which does not handle Keras 3 models
+    call = tf.function(lambda batch: model(batch, training=False), input_signature=signature)
+    tf2onnx.convert.from_function(call, input_signature=signature, output_path=path)
+    return True
+
+
+def measure_latency(backend, input_size, batch_size, runs):
+    batch = np.random.default_rng(1).random((batch_size, input_size[1], input_size[0], 3),
+                                            dtype=np.float32)
+    for _ in range(5):
+        backend.predict(batch)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.predict(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return float(np.mean(timings)), float(np.percentile(timings, 95))
+
+
+def evaluate(backend, batch, labels):
+    outputs = np.concatenate([backend.predict(batch[i:i + 32]) for i in range(0, len(batch), 32)])
+    # Same decision rule as MultiStreamDetector: crack when 1 - output > 0.5
+    decisions = (1 - outputs) > 0.5
+    accuracy = float(np.mean(decisions == labels)) if labels is not None else None
+    return outputs, decisions, accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', help='path to best_model.keras')
+    parser.add_argument('--input-size', type=int, nargs=2, default=(128, 128), metavar=('W', 'H'))
+    parser.add_argument('--calibration-dir', help='images used to calibrate int8 quantization')
+    parser.add_argument('--eval-dir', help='images used to compare backend outputs')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=2, help='batch size for the batched latency column')
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+    input_size = tuple(args.input_size)
+    base = os.path.splitext(args.model)[0]
+    model = load_model(args.model, compile=False)
+
+    calibration_images = [image for _, image in load_images(args.calibration_dir)] if args.calibration_dir else []
+    artifacts = [('keras', args.model), ('keras-compiled', args.model)]
+
+    for quantization in ('float16', 'int8'):
+        path = f'{base}_{quantization}.tflite'
+        export_tflite(model, path, quantization, representative_batches(calibration_images, input_size))
+        artifacts.append(('tflite', path))
+        print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
+    if export_onnx(model, f'{base}.onnx'):
+        artifacts.append(('onnx', f'{base}.onnx'))
+        print(f"Wrote {base}.onnx ({os.path.getsize(base + '.onnx') / 1e6:.2f} MB)")
+
+    eval_images = load_images(args.eval_dir) if args.eval_dir else []
+    if not eval_images:
+        rng = np.random.default_rng(2)
+        eval_images = [(None, rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)) for _ in range(64)]
+    eval_batch = preprocess_batch([image for _, image in eval_images], input_size)
+    labels = None
+    if all(path and os.sep + 'crack' + os.sep in path or path and os.sep + 'no_crack' + os.sep in path
+           for path, _ in eval_images):
+        labels = np.array([os.sep + 'crack' + os.sep in path for path, _ in eval_images])
+
+    reference = None
+    print(f"\n{'backend':<16} {'artifact':<40} {'1 frame ms':>10} {'p95':>7} "
+          f"{f'batch {args.batch} ms':>11} {'mean |d|':>9} {'max |d|':>8} {'agree':>6} {'acc':>6}")
+    for kind, path in artifacts:
+        backend = load_backend(kind, path)
+        single, single_p95 = measure_latency(backend, input_size, 1, args.runs)
+        batched, _ = measure_latency(backend, input_size, args.batch, args.runs)
+        outputs, decisions, accuracy = evaluate(backend, eval_batch, labels)
+        if reference is None:
+            reference = (outputs, decisions)
+        diff = np.abs(outputs - reference[0])
+        agree = float(np.mean(decisions == reference[1]))
+        acc = f'{accuracy:.3f}' if accuracy is not None else '-'
+        print(f"{kind:<16} {os.path.basename(path):<40} {single:>10.2f} {single_p95:>7.2f} "
+              f"{batched:>11.2f} {diff.mean():>9.4f} {diff.max():>8.4f} {agree:>6.3f} {acc:>6}")
+
+
+if __name__ == '__main__':
+    main()